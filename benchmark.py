@@ -0,0 +1,332 @@
+"""Reproducible benchmarks for scanning, hashing and building plans.
+
+Usage::
+
+    python benchmark.py --files 5000 --sizes 4096:70,1048576:25,16777216:5
+
+A synthetic preserve/cleanup pair is generated from a seed, then every
+available hashing backend and the full comparison are run without the GUI,
+each in a fresh process so its peak RSS is its own. Results are printed as
+JSON. Files are read before every case, so figures are for a warm page
+cache.
+
+The in-process read path can be swept: ``--block-sizes``,
+``--mmap-thresholds`` and ``--fadvise`` take several values, and the hashlib
+and comparison cases run once per combination.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import comparison
+import hash_cache
+import hash_pool
+import sha256_tools
+from scanner import scan_entries
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+DEFAULT_SIZES = "4096:60,65536:20,1048576:15,16777216:5"
+
+# Tools each external backend needs on the PATH.
+_BACKEND_TOOLS = {"sha256sum": "sha256sum", "shasum": "shasum", "certutil": "certutil", "7zip": "7z"}
+
+
+def parse_sizes(spec):
+    """``"size:weight,size:weight"`` -> (sizes, weights)."""
+    sizes = []
+    weights = []
+    for part in spec.split(","):
+        size, _, weight = part.partition(":")
+        sizes.append(int(size))
+        weights.append(float(weight or 1))
+    return sizes, weights
+
+
+def _random_dir(rng, depth):
+    return os.path.join(*[f"d{rng.randrange(8)}" for _ in range(rng.randint(0, depth))] or [""])
+
+
+def generate_trees(base, files, sizes, dup_ratio, collision_ratio, depth, seed):
+    """Create ``base/preserve`` and ``base/cleanup`` with ``files`` files each.
+
+    A ``dup_ratio`` share of cleanup files copy a preserve file (half of them
+    at the same path), a ``collision_ratio`` share reuse a preserve path with
+    different content, and the rest are new. Returns the two folders.
+    """
+    rng = random.Random(seed)
+    size_choices, weights = parse_sizes(sizes)
+    preserve = os.path.join(base, "preserve")
+    cleanup = os.path.join(base, "cleanup")
+
+    def write(folder, rel_path, data):
+        path = os.path.join(folder, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as handle:
+            handle.write(data)
+
+    preserve_paths = []
+    for index in range(files):
+        rel_path = os.path.join(_random_dir(rng, depth), f"p{index}.bin")
+        write(preserve, rel_path, rng.randbytes(rng.choices(size_choices, weights)[0]))
+        preserve_paths.append(rel_path)
+
+    # Preserve paths not yet taken by a cleanup file, in random order.
+    free_order = list(preserve_paths)
+    rng.shuffle(free_order)
+    free = set(free_order)
+    for index in range(files):
+        roll = rng.random()
+        if roll < dup_ratio:
+            source = rng.choice(preserve_paths)
+            rel_path = source if rng.random() < 0.5 and source in free else os.path.join(_random_dir(rng, depth), f"c{index}.bin")
+            with open(os.path.join(preserve, source), "rb") as handle:
+                data = handle.read()
+        else:
+            rel_path = None
+            if roll < dup_ratio + collision_ratio:
+                while free_order and rel_path not in free:
+                    rel_path = free_order.pop()
+            if rel_path not in free:
+                rel_path = os.path.join(_random_dir(rng, depth), f"c{index}.bin")
+            data = rng.randbytes(rng.choices(size_choices, weights)[0])
+        free.discard(rel_path)
+        write(cleanup, rel_path, data)
+    return preserve, cleanup
+
+
+def _peak_rss_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def _tree_size(folder):
+    files = 0
+    total = 0
+    for entry in scan_entries(folder):
+        files += 1
+        total += entry.size
+    return files, total
+
+
+def _warm(folder):
+    for entry in scan_entries(folder):
+        with open(entry.full_path, "rb") as handle:
+            while handle.read(1024 * 1024):
+                pass
+
+
+def _bench_scan(preserve, cleanup):
+    start = time.perf_counter()
+    files = sum(1 for folder in (preserve, cleanup) for _ in scan_entries(folder))
+    wall = time.perf_counter() - start
+    return {"files": files, "bytes": 0, "wall": wall, "phases": {"scan": wall}}
+
+
+def _bench_hash(backend, preserve, workers):
+    sha256_tools.hash_method = backend
+    jobs = [(entry.rel_path, entry.full_path) for entry in scan_entries(preserve)]
+    total = sum(os.path.getsize(path) for _, path in jobs)
+    start = time.perf_counter()
+    failed = sum(1 for _, _, digest in hash_pool.hash_files(jobs, workers=workers) if not digest)
+    wall = time.perf_counter() - start
+    return {"files": len(jobs), "bytes": total, "wall": wall, "failed": failed, "phases": {"hash": wall}}
+
+
+def _bench_compare(preserve, cleanup, workers):
+    phases = {}
+    marks = []
+
+    def progress(stage, done, total=0):
+        if not marks or marks[-1][0] != stage:
+            marks.append((stage, time.perf_counter()))
+
+    start = time.perf_counter()
+    result = comparison.compare_trees(preserve, cleanup, workers=workers, progress=progress)
+    end = time.perf_counter()
+    for index, (stage, mark) in enumerate(marks):
+        following = marks[index + 1][1] if index + 1 < len(marks) else end
+        phases[stage.lower()] = phases.get(stage.lower(), 0.0) + following - mark
+    return {
+        "files": len(result.files["preserve"]) + len(result.files["cleanup"]),
+        "bytes": result.bytes_read,
+        "wall": end - start,
+        "phases": phases,
+        "plan": {
+            "delete": len(result.delete_plan),
+            "move_mismatch": len(result.move_mismatch_plan),
+            "move_new": len(result.move_new_plan),
+        },
+    }
+
+
+def _run_case(case, preserve, cleanup, workers, tuning):
+    """Run one benchmark case; called in a fresh process."""
+    hash_cache.mode = "ignore"
+    sha256_tools.BLOCK_SIZE = tuning["block_size"]
+    sha256_tools.MMAP_THRESHOLD = tuning["mmap_threshold"]
+    sha256_tools.FADVISE = tuning["fadvise"]
+    kind, _, backend = case.partition(":")
+    if kind == "scan":
+        report = _bench_scan(preserve, cleanup)
+    elif kind == "hash":
+        report = _bench_hash(backend, preserve, workers)
+    else:
+        report = _bench_compare(preserve, cleanup, workers)
+    report["name"] = case
+    report["tuning"] = tuning
+    report["files_per_s"] = report["files"] / report["wall"] if report["wall"] else None
+    report["mb_per_s"] = report["bytes"] / (1024 * 1024) / report["wall"] if report["wall"] else None
+    report["peak_rss_kb"] = _peak_rss_kb()
+    return report
+
+
+def _tunings(args):
+    """Every combination of the swept read-path settings."""
+    return [
+        {"block_size": block_size, "mmap_threshold": threshold, "fadvise": fadvise == "on"}
+        for block_size in args.block_sizes
+        for threshold in args.mmap_thresholds
+        for fadvise in dict.fromkeys(args.fadvise)
+    ]
+
+
+def available_backends():
+    backends = ["hashlib"]
+    for backend, tool in _BACKEND_TOOLS.items():
+        if shutil.which(tool):
+            backends.append(backend)
+    return backends
+
+
+def run(args):
+    base = args.workdir or tempfile.mkdtemp(prefix="filebackupcheck-bench-")
+    preserve = os.path.join(base, "preserve")
+    cleanup = os.path.join(base, "cleanup")
+    # Everything runs in child processes: a child's peak RSS starts from this
+    # process's, so it has to stay small.
+    context = multiprocessing.get_context("spawn")
+
+    def in_child(function, *function_args):
+        with context.Pool(1) as pool:
+            return pool.apply(function, function_args)
+
+    try:
+        if not (args.reuse and os.path.isdir(preserve) and os.path.isdir(cleanup)):
+            for folder in (preserve, cleanup):
+                shutil.rmtree(folder, ignore_errors=True)
+            in_child(generate_trees, base, args.files, args.sizes, args.dup_ratio, args.collision_ratio, args.depth, args.seed)
+        tunings = _tunings(args)
+        cases = [("scan", tunings[0])]
+        for backend in args.backends or available_backends():
+            # The read-path settings only apply to the in-process backend.
+            for tuning in tunings if backend == "hashlib" else tunings[:1]:
+                cases.append((f"hash:{backend}", tuning))
+        cases.extend(("compare", tuning) for tuning in tunings)
+
+        results = []
+        for case, tuning in cases:
+            for _ in range(args.repeat):
+                # fadvise drops hashed files from the page cache.
+                in_child(_warm, preserve)
+                in_child(_warm, cleanup)
+                results.append(in_child(_run_case, case, preserve, cleanup, args.workers, tuning))
+
+        preserve_files, preserve_bytes = _tree_size(preserve)
+        cleanup_files, cleanup_bytes = _tree_size(cleanup)
+        return {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "config": {
+                "files": args.files,
+                "sizes": args.sizes,
+                "dup_ratio": args.dup_ratio,
+                "collision_ratio": args.collision_ratio,
+                "depth": args.depth,
+                "seed": args.seed,
+                "workers": args.workers,
+                "tunings": tunings,
+            },
+            "tree": {
+                "preserve": {"files": preserve_files, "bytes": preserve_bytes},
+                "cleanup": {"files": cleanup_files, "bytes": cleanup_bytes},
+            },
+            "results": results,
+        }
+    finally:
+        if not args.workdir and not args.keep:
+            shutil.rmtree(base, ignore_errors=True)
+
+
+def _threshold(text):
+    return None if text.lower() == "none" else int(text)
+
+
+def _build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark scanning, hashing and comparison on synthetic trees.")
+    parser.add_argument("--files", type=int, default=2000, help="files per folder (default: %(default)s)")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="size distribution as size:weight,... (default: %(default)s)")
+    parser.add_argument("--dup-ratio", type=float, default=0.4, help="share of cleanup files duplicating a preserve file")
+    parser.add_argument("--collision-ratio", type=float, default=0.1, help="share of cleanup files at a preserve path with other content")
+    parser.add_argument("--depth", type=int, default=3, help="maximum directory depth")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=hash_pool.DEFAULT_WORKERS, help="files hashed concurrently")
+    parser.add_argument("--backends", nargs="+", choices=sha256_tools.HASH_METHODS, help="hashing backends to run (default: all available)")
+    parser.add_argument(
+        "--block-sizes",
+        nargs="+",
+        type=int,
+        default=[sha256_tools.BLOCK_SIZE],
+        help="read buffer sizes to sweep (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--mmap-thresholds",
+        nargs="+",
+        type=_threshold,
+        default=[sha256_tools.MMAP_THRESHOLD],
+        help="file sizes from which to hash through mmap, or none (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--fadvise",
+        nargs="+",
+        choices=("on", "off"),
+        default=["on" if sha256_tools.FADVISE else "off"],
+        help="posix_fadvise settings to sweep (default: %(default)s)",
+    )
+    parser.add_argument("--repeat", type=int, default=1, help="runs per case")
+    parser.add_argument("--workdir", help="folder for the generated trees (default: a temporary folder)")
+    parser.add_argument("--reuse", action="store_true", help="reuse trees already generated in --workdir")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary trees")
+    parser.add_argument("--output", default="-", help="file to write the JSON report to (default: stdout)")
+    return parser
+
+
+def main(argv=None):
+    args = _build_parser().parse_args(argv)
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            handle.write(text + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+"""Pick the fastest SHA256 backend on this machine once, and remember it.
+
+The first comparison detects which backends are available (hashlib and the
+sha256sum, shasum, certutil and 7z tools), times each one on a few real
+files from the folders being compared, and stores the fastest one, the
+timings and the tool paths in CONFIG_PATH. Later runs only read the file.
+Setting ``override`` in the file, or with set_override, replaces the
+calibrated choice; ``sha256_tools.hash_method = "auto"`` uses either.
+"""
+
+import json
+import os
+import time
+
+import hash_cache
+import sha256_tools
+from hash_pool import interleave
+from scanner import scan_entries
+
+CONFIG_PATH = os.path.join(hash_cache.CACHE_DIR, "hashing.json")
+
+# Files and bytes hashed by each backend while calibrating.
+CALIBRATION_FILES = 16
+CALIBRATION_BYTES = 32 * 1024 * 1024
+
+# Entries looked at before calibrating on the files found so far, so a tree
+# of files too large for the byte budget is not walked to its end.
+CALIBRATION_SCAN = 10000
+
+
+def load_config(path=CONFIG_PATH):
+    """The saved calibration, or an empty dict if there is none."""
+    try:
+        with open(path, encoding="utf-8") as handle:
+            config = json.load(handle)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as exc:
+        print(f"Ignoring hashing config {path}: {exc}")
+        return {}
+    return config if isinstance(config, dict) else {}
+
+
+def save_config(config, path=CONFIG_PATH):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    partial = path + ".partial"
+    with open(partial, "w", encoding="utf-8") as handle:
+        json.dump(config, handle, indent=2)
+    os.replace(partial, path)
+
+
+def apply_config(config):
+    """Point ``"auto"`` at the configured backend and reuse the stored tool paths."""
+    for method, tool in config.get("tools", {}).items():
+        if tool and os.path.isfile(tool):
+            sha256_tools.tool_paths.setdefault(method, tool)
+    method = config.get("override") or config.get("method")
+    sha256_tools.auto_method = method if method in sha256_tools.CALIBRATED_METHODS else "hashlib"
+
+
+def detect_backends():
+    """``{method: tool path}`` for every usable backend; hashlib has no tool."""
+    backends = {"hashlib": None}
+    for method in sha256_tools.CALIBRATED_METHODS[1:]:
+        tool = sha256_tools.find_tool(method)
+        if tool:
+            backends[method] = tool
+    return backends
+
+
+def sample_files(folders, count=CALIBRATION_FILES, budget=CALIBRATION_BYTES, scan=CALIBRATION_SCAN):
+    """A few non-empty files from ``folders``, taken from each in turn.
+
+    At most ``scan`` entries are looked at.
+    """
+    files = []
+    entries = interleave(*(scan_entries(folder) for folder in folders if folder))
+    for examined, entry in enumerate(entries, 1):
+        if 0 < entry.size <= budget:
+            files.append(entry.full_path)
+            budget -= entry.size
+        if len(files) >= count or budget <= 0 or examined >= scan:
+            break
+    return files
+
+
+def calibrate(folders, path=CONFIG_PATH):
+    """Time every available backend on files from ``folders`` and save the fastest.
+
+    A backend that fails or disagrees with hashlib on any file is left out.
+    Returns the saved config, or the current one if there were no files.
+    """
+    config = load_config(path)
+    files = sample_files(folders)
+    if not files:
+        return config
+    backends = detect_backends()
+    # An untimed pass first, so every backend reads from a warm page cache.
+    _, expected = sha256_tools.time_backend("hashlib", files)
+    timings = {}
+    for method in backends:
+        seconds, digests = sha256_tools.time_backend(method, files)
+        if all(digests.get(filepath) == digest for filepath, digest in expected.items()):
+            timings[method] = seconds
+        else:
+            print(f"Hashing backend {method} gave wrong or no digests; not using it")
+    config.update(
+        method=min(timings, key=timings.get),
+        tools=backends,
+        timings=timings,
+        files=len(files),
+        bytes=sum(os.path.getsize(filepath) for filepath in files),
+        time=time.time(),
+    )
+    config.setdefault("override", None)
+    try:
+        save_config(config, path)
+    except OSError as exc:
+        print(f"Error saving hashing config {path}: {exc}")
+    apply_config(config)
+    return config
+
+
+def needs_calibration(config):
+    """Whether ``config`` has no backend, or its backend's tool has gone missing."""
+    method = config.get("method")
+    tool = config.get("tools", {}).get(method)
+    return method not in sha256_tools.CALIBRATED_METHODS or (method != "hashlib" and not (tool and os.path.isfile(tool)))
+
+
+def ensure_calibrated(folders, path=CONFIG_PATH):
+    """Apply the saved calibration, calibrating first if there is none.
+
+    It is redone when the chosen backend's tool has gone missing.
+    """
+    config = load_config(path)
+    if needs_calibration(config):
+        config = calibrate(folders, path)
+    apply_config(config)
+    return config
+
+
+def set_override(method, path=CONFIG_PATH):
+    """Always use ``method`` for ``"auto"``; None or ``"auto"`` restores the calibrated choice."""
+    config = load_config(path)
+    config["override"] = None if method in (None, "auto") else method
+    save_config(config, path)
+    apply_config(config)
+    return config
@@ -0,0 +1,209 @@
+"""On-disk checkpoints of a running comparison.
+
+While a comparison runs, what it has learnt is appended to a JSON Lines
+file every CHECKPOINT_INTERVAL seconds: the folder roots first, then the
+stat, sample, digest and fingerprint of every file read, and every table
+row once it is final. A comparison that was closed or crashed is resumed
+by comparing the same folders again with the checkpoint as ``previous``,
+so only files that were not read yet, or changed since, are read.
+
+Comparing the same folders again after plans were carried out extends the
+checkpoint rather than writing it anew: a "run" record starts the rows of
+the new comparison, and only the files it reads are added.
+"""
+
+import json
+import os
+import time
+
+import hash_cache
+from comparison import ComparisonResult
+
+CHECKPOINT_PATH = os.path.join(hash_cache.CACHE_DIR, "comparison-checkpoint.jsonl")
+
+# Seconds between writes of what was learnt since the last one.
+CHECKPOINT_INTERVAL = 30.0
+
+
+def _open_for_append(path):
+    """Open ``path`` to add records to; the Checkpoint closes it."""
+    return open(path, "a", encoding="utf-8")
+
+
+class Checkpoint:
+    """Append-only record of one comparison.
+
+    ``previous`` is a ComparisonResult holding every stat, sample, digest
+    and fingerprint recorded, ``rows`` maps ``(side, rel_path)`` to the rows
+    of the last comparison that were final, and ``finished`` is set once it
+    ran to the end.
+    """
+
+    def __init__(self, path, preserve_folder, cleanup_folders):
+        self.path = path
+        self.preserve_folder = preserve_folder
+        self.cleanup_folders = list(cleanup_folders)
+        self.previous = ComparisonResult()
+        self.rows = {}
+        self.finished = False
+        self._pending = []
+        self._handle = None
+        self._flushed = time.monotonic()
+
+    @classmethod
+    def create(cls, preserve_folder, cleanup_folders, previous=None, path=CHECKPOINT_PATH):
+        """Start a checkpoint, replacing the last one only once it is written.
+
+        Everything known from a ``previous`` result is carried into the new
+        checkpoint, so resuming a resumed comparison loses nothing.
+        """
+        checkpoint = cls(path, preserve_folder, cleanup_folders)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        partial = path + ".partial"
+        with open(partial, "w", encoding="utf-8") as handle:
+            handle.write(json.dumps({"preserve": preserve_folder, "cleanup": checkpoint.cleanup_folders, "time": time.time()}) + "\n")
+            if previous is not None:
+                for full_path, stat_key in previous.stats.items():
+                    record = checkpoint._file_record(
+                        full_path,
+                        stat_key,
+                        previous.samples.get(full_path),
+                        previous.digests.get(full_path),
+                        previous.fingerprints.get(full_path),
+                    )
+                    if record is not None:
+                        handle.write(json.dumps(record) + "\n")
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(partial, path)
+        checkpoint._handle = _open_for_append(path)
+        return checkpoint
+
+    @classmethod
+    def extend(cls, preserve_folder, cleanup_folders, previous, carried=(), path=CHECKPOINT_PATH):
+        """Continue the checkpoint at ``path`` for another comparison of the same folders.
+
+        Only what the new comparison learns is appended, and the files in
+        ``carried``, whose samples and digests ``previous`` took over when
+        they were moved or linked. Without a checkpoint of these folders at
+        ``path``, a new one is created from ``previous``.
+        """
+        try:
+            with open(path, encoding="utf-8") as handle:
+                header = json.loads(handle.readline())
+            cleanup = header["cleanup"]
+            folders = header["preserve"], [cleanup] if isinstance(cleanup, str) else cleanup
+        except (OSError, ValueError, KeyError, TypeError):
+            folders = None
+        if folders != (preserve_folder, list(cleanup_folders)):
+            return cls.create(preserve_folder, cleanup_folders, previous, path)
+        checkpoint = cls(path, preserve_folder, cleanup_folders)
+        checkpoint._handle = _open_for_append(path)
+        # Ends a line cut short by a crash; an empty line is skipped on load.
+        checkpoint._handle.write("\n")
+        checkpoint._pending.append({"run": time.time()})
+        for full_path in carried:
+            if full_path in previous.stats:
+                checkpoint.add_file(
+                    full_path,
+                    previous.stats[full_path],
+                    previous.samples.get(full_path),
+                    previous.digests.get(full_path),
+                    previous.fingerprints.get(full_path),
+                )
+        return checkpoint
+
+    @classmethod
+    def load(cls, path=CHECKPOINT_PATH):
+        """Read a checkpoint; a line cut short by a crash is ignored."""
+        with open(path, encoding="utf-8") as handle:
+            try:
+                header = json.loads(handle.readline())
+                cleanup = header["cleanup"]
+                checkpoint = cls(path, header["preserve"], [cleanup] if isinstance(cleanup, str) else cleanup)
+            except (ValueError, KeyError, TypeError):
+                raise ValueError(f"{path} is not a comparison checkpoint") from None
+            known = checkpoint.previous
+            for line in handle:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if "path" in record:
+                    full_path = record["path"]
+                    stat_key = tuple(record["stat"])
+                    if known.stats.get(full_path) != stat_key:
+                        known.samples.pop(full_path, None)
+                        known.digests.pop(full_path, None)
+                        known.fingerprints.pop(full_path, None)
+                    known.stats[full_path] = stat_key
+                    if record.get("sample"):
+                        known.samples[full_path] = record["sample"]
+                    if record.get("digest"):
+                        known.digests[full_path] = record["digest"]
+                    if record.get("fingerprint"):
+                        known.fingerprints[full_path] = record["fingerprint"]
+                elif "row" in record:
+                    side, rel_path, *row = record["row"]
+                    checkpoint.rows[(side, rel_path)] = tuple(row)
+                elif "run" in record:
+                    checkpoint.rows = {}
+                    checkpoint.finished = False
+                elif "end" in record:
+                    checkpoint.finished = True
+        return checkpoint
+
+    def _file_record(self, full_path, stat_key, sample=None, digest=None, fingerprint=None):
+        if not sample and not digest and not fingerprint:
+            return None
+        record = {"path": full_path, "stat": list(stat_key)}
+        if sample:
+            record["sample"] = sample
+        if digest:
+            record["digest"] = digest
+        if fingerprint:
+            record["fingerprint"] = fingerprint
+        return record
+
+    def add_file(self, full_path, stat_key, sample=None, digest=None, fingerprint=None):
+        """A sample, digest or fingerprint of ``full_path`` is known."""
+        record = self._file_record(full_path, stat_key, sample, digest, fingerprint)
+        if record is not None:
+            self._pending.append(record)
+
+    def add_row(self, key, row):
+        self._pending.append({"row": [key[0], key[1], *row]})
+
+    def maybe_flush(self):
+        if time.monotonic() - self._flushed >= CHECKPOINT_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """Write and sync everything recorded since the last flush."""
+        self._flushed = time.monotonic()
+        if self._handle is None or not self._pending:
+            return
+        try:
+            self._handle.write("".join(json.dumps(record) + "\n" for record in self._pending))
+            self._handle.flush()
+            os.fsync(self._handle.fileno())
+        except OSError as exc:
+            print(f"Error writing checkpoint {self.path}: {exc}")
+        self._pending = []
+
+    def close(self, finished=False):
+        """Flush, and mark the comparison as run to the end if ``finished``."""
+        if finished:
+            self._pending.append({"end": time.time()})
+            self.finished = True
+        self.flush()
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+
+def load_checkpoint(path=CHECKPOINT_PATH):
+    """The last comparison's checkpoint, or None if there is none."""
+    if not os.path.exists(path):
+        return None
+    return Checkpoint.load(path)
@@ -0,0 +1,875 @@
+"""Comparison core shared by the GUI and the command line.
+
+Duplicate detection is staged so content is only read where it can change
+the plan:
+
+1. size   - a cleanup file can only duplicate a preserve file of equal size;
+2. sample - the head and tail of large files must match before going further;
+3. full   - a full SHA256 confirms a duplicate before it is planned for delete.
+
+In prefilter mode the full stage uses the much faster fingerprint hash of
+sha256_tools instead, and only a cleanup file whose fingerprint matches a
+preserve file is read again for a SHA256, together with that preserve file,
+before it is planned for delete.
+
+The stages are pipelined rather than run one after the other: both folders
+are walked with os.scandir on their own threads and each file is sampled or
+hashed as soon as the walk so far shows it has a same-size counterpart.
+Hardlinks to one file (same device and inode) are read once and the result
+is shared by every path.
+
+Nothing in this module touches Tk; progress is reported through a
+``progress(stage, done, total)`` callable and finished rows through
+``on_row(key, row)``.
+"""
+
+import os
+import queue
+import threading
+
+from hash_pool import HashScheduler
+from scanner import entries_from_files, scan_entries
+from sha256_tools import (
+    FINGERPRINT_ALGORITHM,
+    SAMPLE_SIZE,
+    calculate_fingerprint,
+    calculate_sample_sha256,
+    calculate_sha256,
+)
+
+NOT_HASHED_UNIQUE_SIZE = "not hashed, unique size"
+NOT_HASHED_SAMPLE_DIFFERS = "not hashed, head/tail differs"
+
+ACTION_REFERENCE = "Reference Copy"
+ACTION_DELETE = "Delete (duplicate of {})"
+ACTION_MOVE_MISMATCH = "MOVE WITH RENAME (path exists but content differs)"
+ACTION_MOVE_NEW = "MOVE - New file to preserve folder"
+ACTION_CLEANUP_COPY = "SKIP - Same content as {} (another cleanup folder)"
+
+# Scanned files allowed to wait for the hashing pool before the walk pauses.
+SCAN_QUEUE_DEPTH = 10000
+
+
+class ComparisonResult:
+    """Plans and table rows produced by compare_folders.
+
+    ``rows`` maps ``(side, rel_path)`` to the table row for that file. The
+    stats, samples and digests of every file read are kept by full path so a
+    later compare_folders call can reuse them for files that did not change.
+
+    ``labels`` maps each cleanup side (a key of ``files``) to the folder
+    name its rows are shown under; see cleanup_sides. ``roots`` maps every
+    side to the folder its files were read from, where the caller gave it.
+
+    ``fingerprints`` holds the ``"algorithm:hex"`` fingerprints of files
+    read in prefilter mode; ``digests`` only ever holds SHA256 digests.
+
+    ``link_plan`` holds ``(cleanup_path, preserve_path)`` for the duplicates
+    in ``delete_plan`` that are not yet hardlinks of their preserve copy;
+    it is the alternative to deleting them. ``duplicates`` maps every path
+    in ``delete_plan`` to the preserve file with the same content.
+    """
+
+    def __init__(self):
+        self.rows = {}
+        self.delete_plan = []
+        self.duplicates = {}
+        self.link_plan = []
+        self.move_mismatch_plan = []
+        self.move_new_plan = []
+        self.file_hashes = {}
+        self.preserve_hashes = {}
+        self.preserve_path_to_hash = {}
+        self.files = {"preserve": {}, "cleanup": {}}
+        self.stats = {}
+        self.samples = {}
+        self.digests = {}
+        self.fingerprints = {}
+        self.bytes_read = 0
+        self.bytes_cached = 0
+        self.labels = {"cleanup": None}
+        self.roots = {}
+
+    def plans_for(self, side):
+        """The delete, link and move plans restricted to one cleanup side."""
+        paths = set(self.files[side].values())
+        return {
+            "delete": [path for path in self.delete_plan if path in paths],
+            "link": [link for link in self.link_plan if link[0] in paths],
+            "move_mismatch": [move for move in self.move_mismatch_plan if move[0] in paths],
+            "move_new": [move for move in self.move_new_plan if move[0] in paths],
+        }
+
+    def carry_over(self, src, dst):
+        """Record that ``src`` was moved to ``dst`` without changing content."""
+        try:
+            self.stats[dst] = _stat_key(os.stat(dst))
+        except OSError:
+            return
+        for known in (self.samples, self.digests, self.fingerprints):
+            if src in known:
+                known[dst] = known.pop(src)
+
+
+def add_prime_to_filename(path):
+    """Add prime (') before file extension."""
+    dir_name, filename = os.path.split(path)
+    if '.' in filename:
+        name, ext = os.path.splitext(filename)
+        new_filename = name + "'" + ext
+    else:
+        new_filename = filename + "'"
+    return os.path.join(dir_name, new_filename)
+
+
+def move_target(rel_path, rank, exists):
+    """Where the ``rank``-th cleanup file at ``rel_path`` is moved to, relative to the preserve folder.
+
+    Files at one path in several cleanup folders take ``rel_path``, then
+    primed names, in folder order, skipping names that ``exists`` in the
+    preserve folder, so no two moves share a destination.
+    """
+    target = rel_path
+    while True:
+        if not exists(target):
+            if not rank:
+                return target
+            rank -= 1
+        target = add_prime_to_filename(target)
+
+
+def unprimed_paths(rel_path):
+    """``rel_path`` and the paths it may be the primed move target of."""
+    paths = [rel_path]
+    dir_name, filename = os.path.split(rel_path)
+    name, ext = os.path.splitext(filename) if "." in filename else (filename, "")
+    while name.endswith("'"):
+        name = name[:-1]
+        paths.append(os.path.join(dir_name, name + ext))
+    return paths
+
+
+def _stat_key(stat_result):
+    """The parts of a stat result that must match for a digest to be reused."""
+    return stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino
+
+
+def _produce(side, entries, events, slots, stop):
+    """Feed scanner entries into the event queue, at most ``slots`` ahead."""
+    try:
+        for entry in entries:
+            while not slots.acquire(timeout=0.1):
+                if stop.is_set():
+                    return
+            if stop.is_set():
+                return
+            events.put(("entry", side, entry))
+    except Exception as exc:  # pragma: no cover - defensive
+        print(f"Error scanning {side} folder: {exc}")
+    finally:
+        events.put(("scanned", side, None))
+
+
+class _MatchGroup:
+    """Files of several folders that may share content (same size and sample)."""
+
+    __slots__ = ("first_cleanup", "first_preserve", "pending", "preserve_pending", "waiting")
+
+    def __init__(self):
+        self.pending = 0
+        self.preserve_pending = 0
+        self.first_preserve = {}
+        self.first_cleanup = {}
+        self.waiting = []
+
+
+class _Comparison:
+    """State of one comparison while entries and digests stream in.
+
+    Every decision only depends on what has been seen so far and only ever
+    adds candidates: a size becomes shared, a (size, sample) pair starts to
+    match. Hashing therefore starts while the folders are still being
+    walked, and a row is emitted once nothing still to come can change it.
+
+    ``labels`` maps each cleanup side to the folder name its rows are shown
+    under, or None for a single cleanup folder. With several cleanup
+    folders, files are also matched across them.
+
+    With ``prefilter``, files are matched on fingerprints, and a cleanup
+    file is only decided a duplicate once its SHA256 and that of its
+    preserve copy (the "confirm" stage) are equal.
+
+    ``preserve_paths`` are the relative paths in the preserve folder when
+    only some of its files are compared; by default, those compared.
+    ``cleanup_paths`` likewise maps each cleanup side to its relative paths.
+    """
+
+    def __init__(
+        self, preserve_folder, previous, on_row, checkpoint=None, labels=None, prefilter=False, preserve_paths=None,
+        cleanup_paths=None,
+    ):
+        self.preserve_folder = preserve_folder
+        self.prefilter = prefilter
+        self.previous = previous
+        self.on_row = on_row
+        self.checkpoint = checkpoint
+        self.labels = labels or {"cleanup": None}
+        self.sides = ["preserve", *self.labels]
+        self.side_index = {side: index for index, side in enumerate(self.sides)}
+        self.cross = len(self.labels) > 1
+        self.result = ComparisonResult()
+        self.result.labels = self.labels
+        self.files = self.result.files
+        for side in self.sides:
+            self.files.setdefault(side, {})
+        self.sizes = {side: {} for side in self.sides}
+        self.preserve_paths = self.sizes["preserve"] if preserve_paths is None else preserve_paths
+        self.cleanup_paths = self.sizes if cleanup_paths is None else cleanup_paths
+        self.order = {side: {} for side in self.sides}
+        self.by_size = {side: {} for side in self.sides}
+        self.by_match = {side: {} for side in self.sides}
+        self.shared_sizes = set()
+        self.samples = {}
+        self.digests = {}
+        self.physical = {}
+        self.by_physical = {"sample": {}, "full": {}, "confirm": {}}
+        self.in_flight = {}
+        self.groups = {}
+        self.rows = {}
+        self.decisions = {}
+        self.targets = {}
+        self.duplicates = {}
+        self.sha256 = {}
+        self.confirming = {}
+        self.confirm_waiting = {}
+        self.scheduler = None
+        self.outstanding = 0
+        self.outstanding_samples = 0
+        self.submitted = 0
+        self.completed = 0
+        self.walk_done = False
+        self.settled = False
+
+    def _others(self, side):
+        """Sides whose files ``side``'s files are matched against."""
+        if side == "preserve":
+            return self.sides[1:]
+        return [other for other in self.sides if other != side and (self.cross or other == "preserve")]
+
+    def _shown_path(self, key):
+        side, rel_path = key
+        label = self.labels.get(side)
+        return os.path.join(label, rel_path) if label else rel_path
+
+    # -- hashing --------------------------------------------------------
+
+    def _store(self, stage):
+        """Where the result keeps what ``stage`` reads, by full path."""
+        if stage == "sample":
+            return self.result.samples
+        if stage == "full" and self.prefilter:
+            return self.result.fingerprints
+        return self.result.digests
+
+    def _known(self, stage, key):
+        """A sample or digest already known for ``key``'s path or one of its hardlinks."""
+        side, rel_path = key
+        store = self._store(stage)
+        known = store.get(self.files[side][rel_path])
+        if not known and self.physical[key] is not None:
+            known = self.by_physical[stage].get(self.physical[key])
+        return known
+
+    def _submit(self, stage, key, hasher):
+        side, rel_path = key
+        self.outstanding += 1
+        self.submitted += 1
+        if stage == "sample":
+            self.outstanding_samples += 1
+        shared = (stage, self.physical[key] or key)
+        if shared in self.in_flight:
+            # A hardlink to the same file is already being read.
+            self.in_flight[shared].append(key)
+            return
+        self.in_flight[shared] = [key]
+        size = self.sizes[side][rel_path]
+        if stage == "sample":
+            size = min(size, 2 * SAMPLE_SIZE)
+        self.scheduler.submit((stage, side, rel_path), self.files[side][rel_path], hasher, size, self.physical[key])
+
+    def on_hashed(self, job_key, digest, cached=False):
+        stage, side, rel_path = job_key
+        physical = self.physical[(side, rel_path)]
+        if digest and physical is not None:
+            self.by_physical[stage][physical] = digest
+        size = self.sizes[side][rel_path]
+        if stage == "sample":
+            size = min(size, 2 * SAMPLE_SIZE)
+        if cached:
+            self.result.bytes_cached += size
+        else:
+            self.result.bytes_read += size
+        for key in self.in_flight.pop((stage, physical or (side, rel_path))):
+            self.outstanding -= 1
+            self.completed += 1
+            if stage == "sample":
+                self.outstanding_samples -= 1
+                self._sampled(key, digest)
+            elif stage == "confirm":
+                self._confirmed(key, digest)
+            else:
+                self._hashed(key, digest)
+        self._check_settled()
+
+    # -- stage 1: size -------------------------------------------------
+
+    def add_entry(self, side, entry):
+        rel_path = entry.rel_path
+        self.files[side][rel_path] = entry.full_path
+        self.sizes[side][rel_path] = entry.size
+        self.result.stats[entry.full_path] = entry.stat_key
+        self.physical[(side, rel_path)] = entry.physical_key
+        self.order[side][rel_path] = len(self.order[side])
+        previous = self.previous
+        if previous is not None and previous.stats.get(entry.full_path) == entry.stat_key:
+            for known, result_store in ((previous.samples, self.result.samples), (previous.digests, self.result.digests)):
+                if entry.full_path in known:
+                    result_store[entry.full_path] = known[entry.full_path]
+            fingerprint = previous.fingerprints.get(entry.full_path)
+            if fingerprint and fingerprint.startswith(FINGERPRINT_ALGORITHM + ":"):
+                self.result.fingerprints[entry.full_path] = fingerprint
+        same_size = self.by_size[side].setdefault(entry.size, [])
+        same_size.append(rel_path)
+
+        if entry.size in self.shared_sizes:
+            self._candidate((side, rel_path))
+        elif any(entry.size in self.by_size[other] for other in self._others(side)):
+            self.shared_sizes.add(entry.size)
+            for other in self._others(side):
+                for other_rel_path in self.by_size[other].get(entry.size, ()):
+                    self._candidate((other, other_rel_path))
+            self._candidate((side, rel_path))
+
+    def _is_large(self, key):
+        side, rel_path = key
+        return self.sizes[side][rel_path] > 2 * SAMPLE_SIZE
+
+    # -- stage 2: sample -----------------------------------------------
+
+    def _candidate(self, key):
+        """``key`` shares its size with a file in another folder."""
+        if not self._is_large(key):
+            # A sample of a small file would read as much as the full hash.
+            self._sampled(key, None)
+            return
+        known = self._known("sample", key)
+        if known:
+            self._sampled(key, known)
+        else:
+            self._submit("sample", key, calculate_sample_sha256)
+
+    def _sampled(self, key, sample):
+        side, rel_path = key
+        self.samples[key] = sample
+        if sample:
+            full_path = self.files[side][rel_path]
+            self.result.samples[full_path] = sample
+            if self.checkpoint is not None:
+                self.checkpoint.add_file(full_path, self.result.stats[full_path], sample=sample)
+        elif self._is_large(key):
+            return  # sample could not be read; the file gets no row
+
+        match_key = (self.sizes[side][rel_path], sample)
+        self.by_match[side].setdefault(match_key, []).append(rel_path)
+        if match_key in self.groups:
+            self._full_hash(key, match_key)
+        elif any(match_key in self.by_match[other] for other in self._others(side)):
+            self.groups[match_key] = _MatchGroup()
+            for other in self._others(side):
+                for other_rel_path in self.by_match[other].get(match_key, ()):
+                    self._full_hash((other, other_rel_path), match_key)
+            self._full_hash(key, match_key)
+
+    # -- stage 3: full hash --------------------------------------------
+
+    def _full_hash(self, key, match_key):
+        side = key[0]
+        group = self.groups[match_key]
+        group.pending += 1
+        if side == "preserve":
+            group.preserve_pending += 1
+        known = self._known("full", key)
+        if known:
+            self._hashed(key, known)
+        else:
+            self._submit("full", key, calculate_fingerprint if self.prefilter else calculate_sha256)
+
+    def _hashed(self, key, digest):
+        side, rel_path = key
+        self.digests[key] = digest
+        if digest:
+            full_path = self.files[side][rel_path]
+            self._store("full")[full_path] = digest
+            if self.checkpoint is not None:
+                if self.prefilter:
+                    self.checkpoint.add_file(full_path, self.result.stats[full_path], fingerprint=digest)
+                else:
+                    self.checkpoint.add_file(full_path, self.result.stats[full_path], digest=digest)
+        group = self.groups[(self.sizes[side][rel_path], self.samples[key])]
+        group.pending -= 1
+        if side == "preserve":
+            group.preserve_pending -= 1
+            if digest:
+                candidate = (self.order[side][rel_path], rel_path)
+                group.first_preserve[digest] = min(group.first_preserve.get(digest, candidate), candidate)
+                self._finish(key, digest)
+        elif digest:
+            if self.cross:
+                candidate = (self.side_index[side], self.order[side][rel_path], key)
+                group.first_cleanup[digest] = min(group.first_cleanup.get(digest, candidate), candidate)
+            group.waiting.append((key, digest))
+        if self.settled and self._ready(group):
+            self._release(group)
+
+    def _ready(self, group):
+        """Whether the group's cleanup files can be decided."""
+        return group.preserve_pending == 0 and (not self.cross or group.pending == 0)
+
+    def _release(self, group):
+        for key, digest in group.waiting:
+            self._finish_cleanup(key, digest, group)
+        group.waiting = []
+
+    def _finish_cleanup(self, key, digest, group):
+        first = group.first_preserve.get(digest)
+        if first and self.prefilter:
+            self._confirm(key, digest, first[1])
+            return
+        if first:
+            self._finish(key, digest, first[1])
+            return
+        # Only a copy in an earlier cleanup folder makes this one redundant;
+        # copies within one folder are moved like with a single folder.
+        first = group.first_cleanup.get(digest)
+        if first and first[0] < self.side_index[key[0]]:
+            self._finish(key, digest, copy_of=first[2])
+        else:
+            self._finish(key, digest)
+
+    # -- confirm: SHA256 of prefilter matches ----------------------------
+
+    def _confirm(self, key, fingerprint, duplicate_of):
+        """Read the SHA256 of ``key`` and its preserve copy before deciding it."""
+        self.confirming[key] = (fingerprint, duplicate_of)
+        for needed in (key, ("preserve", duplicate_of)):
+            if needed in self.sha256:
+                continue
+            if needed in self.confirm_waiting:
+                self.confirm_waiting[needed].append(key)
+                continue
+            self.confirm_waiting[needed] = [key]
+            known = self._known("confirm", needed)
+            if known:
+                self._confirmed(needed, known)
+            else:
+                self._submit("confirm", needed, calculate_sha256)
+        if key in self.confirming:
+            self._check_confirmed(key)
+
+    def _confirmed(self, key, digest):
+        side, rel_path = key
+        self.sha256[key] = digest
+        if digest:
+            full_path = self.files[side][rel_path]
+            self.result.digests[full_path] = digest
+            if self.checkpoint is not None:
+                self.checkpoint.add_file(full_path, self.result.stats[full_path], digest=digest)
+            if side == "preserve" and key in self.rows:
+                # Its row went out with the fingerprint; show the SHA256 now.
+                self._finish(key, self.digests[key])
+        for waiting in self.confirm_waiting.pop(key, ()):
+            self._check_confirmed(waiting)
+
+    def _check_confirmed(self, key):
+        fingerprint, duplicate_of = self.confirming[key]
+        preserve_key = ("preserve", duplicate_of)
+        if key not in self.sha256 or preserve_key not in self.sha256:
+            return
+        del self.confirming[key]
+        digest = self.sha256[key]
+        if digest and digest == self.sha256[preserve_key]:
+            self._finish(key, fingerprint, duplicate_of)
+        else:
+            # Fingerprints collided, or a file could not be read again.
+            self._finish(key, fingerprint)
+
+    # -- rows ----------------------------------------------------------
+
+    def _display_hash(self, key, digest):
+        """Digest for the table, or why the file was never fully hashed.
+
+        In prefilter mode, SHA256 digests are shown as ``"sha256:hex"`` next
+        to fingerprints, which carry their algorithm already.
+        """
+        side, rel_path = key
+        if self.prefilter:
+            full_path = self.files[side][rel_path]
+            confirmed = self.sha256.get(key) or self.result.digests.get(full_path)
+            if confirmed:
+                return f"sha256:{confirmed}"
+            fingerprint = digest or self.result.fingerprints.get(full_path)
+            if fingerprint:
+                return fingerprint
+        elif digest:
+            return digest
+        else:
+            known = self.result.digests.get(self.files[side][rel_path])
+            if known:
+                return known
+        if self.sizes[side][rel_path] not in self.shared_sizes:
+            return NOT_HASHED_UNIQUE_SIZE
+        return NOT_HASHED_SAMPLE_DIFFERS
+
+    def _finish(self, key, digest=None, duplicate_of=None, copy_of=None):
+        """Fix the row for ``key``.
+
+        ``duplicate_of`` is the matching preserve path; ``copy_of`` the key
+        of an identical file in an earlier cleanup folder.
+        """
+        side, rel_path = key
+        shown = self._display_hash(key, digest)
+        path = self._shown_path(key)
+        if side == "preserve":
+            row = (path, shown, ACTION_REFERENCE)
+        elif duplicate_of is not None:
+            self.decisions[key] = "delete"
+            self.duplicates[key] = duplicate_of
+            row = (path, shown, ACTION_DELETE.format(duplicate_of))
+        elif copy_of is not None:
+            self.decisions[key] = "copy"
+            row = (path, shown, ACTION_CLEANUP_COPY.format(self._shown_path(copy_of)))
+        else:
+            # A file at the same path in an earlier cleanup folder may be
+            # moved there as well.
+            rank = sum(rel_path in self.cleanup_paths[other] for other in self.sides[1:self.side_index[side]])
+            target = self.targets[key] = move_target(rel_path, rank, self.preserve_paths.__contains__)
+            if target != rel_path:
+                self.decisions[key] = "mismatch"
+                row = (path, shown, ACTION_MOVE_MISMATCH)
+            else:
+                self.decisions[key] = "new"
+                row = (path, shown, ACTION_MOVE_NEW)
+        self.rows[key] = row
+        if self.checkpoint is not None:
+            self.checkpoint.add_row(key, row)
+        if self.on_row:
+            self.on_row(key, row)
+
+    def finish_walk(self):
+        """No more entries: sizes that are still unique stay unique."""
+        self.walk_done = True
+        for side in self.sizes:
+            for rel_path, size in self.sizes[side].items():
+                if size not in self.shared_sizes:
+                    self._finish((side, rel_path))
+        self._check_settled()
+
+    def _check_settled(self):
+        """Once every sample is known, no group can gain new members."""
+        if self.settled or not self.walk_done or self.outstanding_samples:
+            return
+        self.settled = True
+        for side in self.by_match:
+            for match_key, rel_paths in self.by_match[side].items():
+                if match_key not in self.groups:
+                    for rel_path in rel_paths:
+                        self._finish((side, rel_path))
+        for group in self.groups.values():
+            if self._ready(group):
+                self._release(group)
+
+    def assemble(self):
+        """Fill in rows and plans in scan order, independent of completion order."""
+        result = self.result
+        for rel_path in self.sizes["preserve"]:
+            key = ("preserve", rel_path)
+            if key not in self.rows:
+                continue
+            hash_value = self.digests.get(key)
+            if hash_value:
+                result.preserve_hashes.setdefault(hash_value, []).append(rel_path)
+                result.file_hashes[rel_path] = hash_value
+            result.preserve_path_to_hash[rel_path] = hash_value
+            result.rows[key] = self.rows[key]
+
+        for side in self.sides[1:]:
+            for rel_path in self.sizes[side]:
+                key = (side, rel_path)
+                if key not in self.rows:
+                    continue
+                cleanup_fullpath = self.files[side][rel_path]
+                hash_value = self.digests.get(key)
+                if hash_value:
+                    result.file_hashes[self._shown_path(key)] = hash_value
+                result.rows[key] = self.rows[key]
+
+                decision = self.decisions[key]
+                if decision == "delete":
+                    result.delete_plan.append(cleanup_fullpath)
+                    duplicate_of = self.duplicates[key]
+                    result.duplicates[cleanup_fullpath] = self.files["preserve"][duplicate_of]
+                    physical = self.physical[key]
+                    if physical is None or physical != self.physical[("preserve", duplicate_of)]:
+                        result.link_plan.append((cleanup_fullpath, self.files["preserve"][duplicate_of]))
+                elif decision == "mismatch":
+                    result.move_mismatch_plan.append((cleanup_fullpath, os.path.join(self.preserve_folder, self.targets[key])))
+                elif decision == "new":
+                    result.move_new_plan.append((cleanup_fullpath, os.path.join(self.preserve_folder, rel_path)))
+        return result
+
+
+def _compare(
+    preserve_folder,
+    sources,
+    workers,
+    progress,
+    previous,
+    on_row,
+    queue_depth,
+    telemetry,
+    checkpoint,
+    labels=None,
+    prefilter=False,
+    preserve_paths=None,
+    roots=None,
+    cleanup_paths=None,
+):
+    """Run a comparison over ``{"preserve": entries, "cleanup": entries}``.
+
+    With several cleanup folders there is one source per side in ``labels``.
+    ``roots`` is stored in the result as is.
+
+    Each side's entries are produced on their own thread. At most
+    ``queue_depth`` entries are buffered between the walk and the hashing
+    pool: while the hash backlog is longer than that, the walk waits.
+    A ``telemetry`` records the "walk", "hash" and "assemble" phases and
+    every file read; a ``checkpoint`` is sent every sample, digest and row.
+    """
+    comparison = _Comparison(preserve_folder, previous, on_row, checkpoint, labels, prefilter, preserve_paths, cleanup_paths)
+    comparison.result.roots = dict(roots or {})
+    events = queue.Queue()
+    queue_depth = max(1, queue_depth)
+    slots = threading.Semaphore(queue_depth)
+    stop = threading.Event()
+    scheduler = comparison.scheduler = HashScheduler(events, workers, telemetry=telemetry)
+    if telemetry is not None:
+        telemetry.begin("walk")
+        telemetry.begin("hash")
+    for side, entries in sources.items():
+        threading.Thread(target=_produce, args=(side, entries, events, slots, stop), daemon=True).start()
+
+    scanning = len(sources)
+    found = 0
+    held = 0
+    finished = False
+    try:
+        while scanning or comparison.outstanding:
+            event = events.get()
+            kind = event[0]
+            if kind == "entry":
+                found += 1
+                comparison.add_entry(event[1], event[2])
+                held += 1
+            elif kind == "scanned":
+                scanning -= 1
+                if not scanning:
+                    if telemetry is not None:
+                        telemetry.end("walk")
+                    comparison.finish_walk()
+            else:
+                comparison.on_hashed(event[1], event[3], event[4])
+            while held and scheduler.backlog <= queue_depth:
+                held -= 1
+                slots.release()
+
+            if checkpoint is not None:
+                checkpoint.maybe_flush()
+            if progress:
+                if scanning:
+                    progress("Scanning", found)
+                else:
+                    progress("Hashing", comparison.completed, comparison.submitted)
+        finished = True
+    finally:
+        stop.set()
+        scheduler.close()
+        if telemetry is not None:
+            telemetry.end("walk")
+            telemetry.end("hash")
+        if checkpoint is not None:
+            checkpoint.close(finished)
+
+    if telemetry is None:
+        return comparison.assemble()
+    with telemetry.phase("assemble"):
+        return comparison.assemble()
+
+
+def _merge_previous(base, newer):
+    """``base`` with every file known to ``newer`` taken from ``newer``."""
+    if newer is None:
+        return base
+    for full_path, stat_key in newer.stats.items():
+        base.stats[full_path] = stat_key
+        for known, merged in (
+            (newer.samples, base.samples),
+            (newer.digests, base.digests),
+            (newer.fingerprints, base.fingerprints),
+        ):
+            if full_path in known:
+                merged[full_path] = known[full_path]
+            else:
+                merged.pop(full_path, None)
+    return base
+
+
+def cleanup_sides(cleanup_folders):
+    """``{side: label}`` for a list of cleanup folders, in order.
+
+    A single folder is the ``"cleanup"`` side and keeps unprefixed rows.
+    With several, the sides are ``"cleanup"``, ``"cleanup2"``, ... and rows
+    are shown under each folder's name, numbered where names repeat.
+    """
+    if len(cleanup_folders) == 1:
+        return {"cleanup": None}
+    names = [os.path.basename(os.path.normpath(folder)) or folder for folder in cleanup_folders]
+    sides = {}
+    for index, name in enumerate(names):
+        label = name if names.count(name) == 1 else f"{name} ({names[:index + 1].count(name)})"
+        sides["cleanup" if index == 0 else f"cleanup{index + 1}"] = label
+    return sides
+
+
+def compare_trees(
+    preserve_folder,
+    cleanup_folder,
+    workers=None,
+    progress=None,
+    on_row=None,
+    queue_depth=SCAN_QUEUE_DEPTH,
+    manifest=None,
+    telemetry=None,
+    previous=None,
+    checkpoint=None,
+    prefilter=False,
+):
+    """Walk both folders and classify cleanup files against the preserve folder.
+
+    ``cleanup_folder`` may also be a list of folders. They are all walked and
+    hashed side by side in one pass, their files are matched against each
+    other as well, and a file whose content already is in an earlier cleanup
+    folder is marked to be skipped rather than moved a second time.
+
+    Files are sampled and hashed while the walk is still running.
+    ``progress(stage, done, total)`` is called on the calling thread: first
+    ``("Scanning", files_found)``, then ``("Hashing", done, total)`` once both
+    walks have finished.
+
+    With a ``manifest`` of the preserve folder, its files are only stat'ed
+    instead of walked, and indexed digests are reused for unchanged files.
+    A ``telemetry`` (telemetry.RunTelemetry) records phase times and reads.
+    Samples and digests from a ``previous`` result are reused for files
+    whose size, mtime and inode are unchanged, and everything learnt is
+    recorded in a ``checkpoint`` (checkpoint.Checkpoint) as it comes in.
+    With ``prefilter``, files are matched on a fast fingerprint and only
+    candidate duplicates get a SHA256.
+
+    ``on_row(key, row)`` is called as soon as a file's row is final; with
+    ``prefilter``, a preserve row is reported again once its SHA256 is read.
+    The returned result lists rows and plans in scan order regardless.
+    """
+    if manifest is not None:
+        preserve = entries_from_files(manifest.files())
+        previous = _merge_previous(manifest.as_previous(), previous)
+    else:
+        preserve = scan_entries(preserve_folder)
+    cleanup_folders = [cleanup_folder] if isinstance(cleanup_folder, str) else list(cleanup_folder)
+    labels = cleanup_sides(cleanup_folders)
+    sources = {"preserve": preserve}
+    for side, folder in zip(labels, cleanup_folders):
+        sources[side] = scan_entries(folder)
+    roots = {"preserve": preserve_folder, **dict(zip(labels, cleanup_folders))}
+    return _compare(
+        preserve_folder, sources, workers, progress, previous, on_row, queue_depth, telemetry, checkpoint, labels, prefilter,
+        roots=roots,
+    )
+
+
+def compare_folders(
+    preserve_folder,
+    preserve_files,
+    cleanup_files,
+    workers=None,
+    progress=None,
+    previous=None,
+    on_row=None,
+    telemetry=None,
+    checkpoint=None,
+    labels=None,
+    prefilter=False,
+    roots=None,
+):
+    """Classify already known files against the preserve folder.
+
+    ``preserve_files`` and ``cleanup_files`` map relative to full paths, as
+    in ``ComparisonResult.files``. With ``labels`` (see cleanup_sides),
+    ``cleanup_files`` maps each cleanup side to its files instead. Samples
+    and digests from a ``previous`` result are reused for files whose size,
+    mtime and inode are unchanged. ``roots`` (``{side: folder}``) is kept
+    in the result. Otherwise this behaves like compare_trees.
+    """
+    if labels is None:
+        labels = {"cleanup": None}
+        cleanup_files = {"cleanup": cleanup_files}
+    entries = {"preserve": entries_from_files(preserve_files)}
+    for side in labels:
+        entries[side] = entries_from_files(cleanup_files[side])
+    return compare_entries(
+        preserve_folder, entries, workers, progress, previous, on_row, telemetry, checkpoint, labels, prefilter, roots=roots,
+    )
+
+
+def compare_entries(
+    preserve_folder,
+    entries,
+    workers=None,
+    progress=None,
+    previous=None,
+    on_row=None,
+    telemetry=None,
+    checkpoint=None,
+    labels=None,
+    prefilter=False,
+    preserve_paths=None,
+    roots=None,
+    cleanup_paths=None,
+):
+    """Classify files that were already stat'ed.
+
+    ``entries`` maps ``"preserve"`` and each cleanup side in ``labels`` (by
+    default just ``"cleanup"``) to scanner.FileEntry objects. No file is
+    stat'ed again, so a caller that tracks changes itself only pays for
+    reading the files that are new or changed since ``previous``. Otherwise
+    this behaves like compare_folders.
+
+    To compare only some files, such as those of the sizes a change touched,
+    pass every relative path in the preserve folder as ``preserve_paths``:
+    a cleanup file without a match is then still told apart as a mismatch
+    or new file. With several cleanup folders, pass each side's relative
+    paths as ``cleanup_paths`` too, so files at one path get distinct move
+    targets. ``roots`` is kept in the result, as in compare_folders.
+    """
+    return _compare(
+        preserve_folder, entries, workers, progress, previous, on_row, SCAN_QUEUE_DEPTH, telemetry, checkpoint, labels, prefilter,
+        preserve_paths, roots, cleanup_paths,
+    )
@@ -0,0 +1,169 @@
+"""Per-device read limits and read order for the hashing pool.
+
+Files are grouped by the device they are on (``st_dev``). Each folder's
+device is an ``"hdd"`` or an ``"ssd"``, detected from
+``/sys/dev/block/*/queue/rotational`` on Linux or set per folder in
+CONFIG_PATH. A rotational device gets HDD_READERS concurrent reads at most,
+and its queued files are read in physical order (the first extent from
+FIEMAP, or the inode number where FIEMAP is not available) so the head
+sweeps across the disk instead of seeking back and forth. Solid-state
+devices are read with the full pool, in the order files are found.
+
+apply sets ``limits``, which hash_pool.HashScheduler reads.
+"""
+
+import json
+import os
+import struct
+import sys
+
+import hash_cache
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+CONFIG_PATH = os.path.join(hash_cache.CACHE_DIR, "devices.json")
+
+DEVICE_KINDS = ("auto", "hdd", "ssd")
+
+# Concurrent reads on a rotational device unless a folder sets ``readers``.
+HDD_READERS = 1
+
+# ``{st_dev: (readers, ordered)}``; readers None means no limit of its own.
+limits = {}
+
+_FS_IOC_FIEMAP = 0xC020660B
+# struct fiemap with room for one struct fiemap_extent.
+_FIEMAP = struct.Struct("=QQIIII")
+_FIEMAP_EXTENT = struct.Struct("=QQQQQIIII")
+
+# Devices whose file system does not support FIEMAP.
+_no_fiemap = set()
+
+
+def load_config(path=CONFIG_PATH):
+    """The saved device settings, or an empty dict if there are none."""
+    try:
+        with open(path, encoding="utf-8") as handle:
+            config = json.load(handle)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as exc:
+        print(f"Ignoring device config {path}: {exc}")
+        return {}
+    return config if isinstance(config, dict) else {}
+
+
+def save_config(config, path=CONFIG_PATH):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    partial = path + ".partial"
+    with open(partial, "w", encoding="utf-8") as handle:
+        json.dump(config, handle, indent=2)
+    os.replace(partial, path)
+
+
+def detect_kind(folder):
+    """``"hdd"`` or ``"ssd"`` for the device holding ``folder``, or None if unknown."""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        device = os.stat(folder).st_dev
+        block = os.path.realpath(f"/sys/dev/block/{os.major(device)}:{os.minor(device)}")
+    except OSError:
+        return None
+    # A partition's queue belongs to the disk it is on.
+    for candidate in (block, os.path.dirname(block)):
+        try:
+            with open(os.path.join(candidate, "queue", "rotational"), encoding="ascii") as handle:
+                return "hdd" if handle.read().strip() == "1" else "ssd"
+        except OSError:
+            continue
+    return None
+
+
+def folder_setting(folder, config=None):
+    """``(kind, readers)`` saved for ``folder``; kind is ``"auto"`` if none is."""
+    if config is None:
+        config = load_config()
+    setting = config.get("folders", {}).get(os.path.abspath(folder), {})
+    kind = setting.get("kind")
+    readers = setting.get("readers")
+    return (kind if kind in DEVICE_KINDS else "auto"), (readers if isinstance(readers, int) and readers > 0 else None)
+
+
+def set_folder(folder, kind, readers=None, path=CONFIG_PATH):
+    """Save ``folder``'s device kind and read limit; ``"auto"`` with no limit forgets it."""
+    config = load_config(path)
+    folders = config.setdefault("folders", {})
+    folder = os.path.abspath(folder)
+    if kind == "auto" and not readers:
+        folders.pop(folder, None)
+    else:
+        folders[folder] = {"kind": kind, "readers": readers}
+    save_config(config, path)
+    return config
+
+
+def apply(folders, path=CONFIG_PATH):
+    """Set ``limits`` for the devices holding ``folders``; returns ``{folder: (kind, readers)}``.
+
+    Folders on the same device share its limit; if any of them is an hdd,
+    the device is treated as one.
+    """
+    config = load_config(path)
+    chosen = {}
+    new_limits = {}
+    for folder in folders:
+        if not folder:
+            continue
+        kind, readers = folder_setting(folder, config)
+        if kind == "auto":
+            kind = detect_kind(folder) or "ssd"
+        try:
+            device = os.stat(folder).st_dev
+        except OSError as exc:
+            print(f"Error reading {folder}: {exc}")
+            continue
+        if kind == "hdd":
+            readers = readers or HDD_READERS
+        chosen[folder] = kind, readers
+        old_readers, old_ordered = new_limits.get(device, (None, False))
+        if old_readers is not None:
+            readers = min(old_readers, readers) if readers is not None else old_readers
+        new_limits[device] = readers, old_ordered or kind == "hdd"
+    limits.clear()
+    limits.update(new_limits)
+    return chosen
+
+
+def physical_order(filepath, physical):
+    """A key that sorts files on one device by where their data starts.
+
+    ``physical`` is the file's ``(device, inode)``. The key is ``(0,
+    offset)`` with the offset of the first extent where the file system
+    reports it (Linux FIEMAP), else ``(1, inode)``: most file systems
+    allocate inodes near the data, but inode numbers and byte offsets do
+    not compare, so those files are read as a group of their own.
+    """
+    device, inode = physical
+    if fcntl is None or device in _no_fiemap or not sys.platform.startswith("linux"):
+        return 1, inode
+    request = bytearray(_FIEMAP.size + _FIEMAP_EXTENT.size)
+    _FIEMAP.pack_into(request, 0, 0, 0xFFFFFFFFFFFFFFFF, 0, 0, 1, 0)
+    try:
+        fd = os.open(filepath, os.O_RDONLY)
+    except OSError:
+        return 1, inode
+    try:
+        fcntl.ioctl(fd, _FS_IOC_FIEMAP, request)
+    except OSError:
+        _no_fiemap.add(device)
+        return 1, inode
+    finally:
+        os.close(fd)
+    if not _FIEMAP.unpack_from(request, 0)[3]:
+        return 1, inode  # empty, or data kept inline
+    return 0, _FIEMAP_EXTENT.unpack_from(request, _FIEMAP.size)[1]
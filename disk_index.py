@@ -0,0 +1,686 @@
+"""Disk-backed comparison for trees larger than memory.
+
+compare_on_disk classifies files like comparison.compare_trees, but the
+stat, sample, digest, plan decision and table row of every file live in
+an SQLite database instead of Python dicts and lists. Memory stays bounded
+by the hashing pool and one batch of rows, whatever the size of the trees.
+
+The database is filled in passes rather than while walking: every folder
+is walked into it, then the head/tail samples and full hashes are read for
+files whose size and sample occur in more than one folder, then each file
+is decided. The resulting DiskIndex answers "is this digest in preserve?"
+and "does this path exist in preserve?" from its indexes, and streams rows
+to the table and to CSV a page at a time.
+
+Unless given a path, each index is a file of its own in the cache folder
+that is removed again when it is closed, so runs never share one.
+"""
+
+import os
+import queue
+import sqlite3
+import tempfile
+import weakref
+from contextlib import nullcontext
+
+import hash_cache
+from comparison import (
+    ACTION_CLEANUP_COPY,
+    ACTION_DELETE,
+    ACTION_MOVE_MISMATCH,
+    ACTION_MOVE_NEW,
+    ACTION_REFERENCE,
+    NOT_HASHED_SAMPLE_DIFFERS,
+    NOT_HASHED_UNIQUE_SIZE,
+    cleanup_sides,
+    move_target,
+    unprimed_paths,
+)
+from hash_pool import HashScheduler
+from result_table import ResultRow
+from scanner import entries_from_files, scan_entries
+from sha256_tools import SAMPLE_SIZE, calculate_sample_sha256, calculate_sha256
+
+# Rows read or written per statement while streaming over the database.
+BATCH_ROWS = 2000
+
+# SQLite page cache, in KiB; the rest of the index stays on disk.
+CACHE_KIB = 64 * 1024
+
+_SCHEMA = """
+CREATE TABLE files (
+    id INTEGER PRIMARY KEY,
+    side INTEGER NOT NULL,
+    rel_path TEXT NOT NULL,
+    full_path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER,
+    inode INTEGER,
+    device INTEGER,
+    sample TEXT,
+    digest TEXT,
+    -- Set by plan_file.verify_plan for files changed since a plan was saved.
+    checked TEXT,
+    stale INTEGER NOT NULL DEFAULT 0,
+    shared INTEGER NOT NULL DEFAULT 0,
+    grouped INTEGER NOT NULL DEFAULT 0,
+    decision TEXT,
+    match_path TEXT,
+    target TEXT,
+    shown_path TEXT,
+    shown_hash TEXT,
+    action TEXT,
+    path_key TEXT,
+    hash_key TEXT,
+    action_key TEXT
+);
+CREATE UNIQUE INDEX files_path ON files (side, rel_path);
+CREATE INDEX files_size ON files (size, side);
+CREATE INDEX files_rel_path ON files (rel_path, side);
+CREATE INDEX files_digest ON files (digest, side, id) WHERE digest IS NOT NULL;
+CREATE INDEX files_inode ON files (device, inode, id) WHERE inode;
+"""
+
+_INSERT = (
+    "INSERT INTO files (side, rel_path, full_path, size, mtime_ns, inode, device, sample, digest) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+_ADD_ROW = (
+    "INSERT INTO files (side, rel_path, full_path, size, mtime_ns, inode, device, digest, decision, match_path, "
+    "target, shown_path, shown_hash, action, path_key, hash_key, action_key) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+_MOVED = (
+    "INSERT OR REPLACE INTO files (side, rel_path, full_path, size, mtime_ns, inode, device, sample, digest, "
+    "shared, grouped, shown_path, shown_hash, action, path_key, hash_key, action_key) "
+    "VALUES (0, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+_DECIDE = (
+    "UPDATE files SET decision = ?, match_path = ?, target = ?, shown_path = ?, shown_hash = ?, action = ?, "
+    "path_key = ?, hash_key = ?, action_key = ? WHERE id = ?"
+)
+
+# Sort columns of result_table.COLUMNS. Sides are inserted one after the
+# other, so id order is scan order; ties keep it, as a stable sort does.
+_SORT_KEYS = {"Path": "path_key", "SHA256": "hash_key", "Action": "action_key"}
+
+# The files of each plan. A duplicate that already is a hardlink of its
+# preserve copy is left out of the link plan.
+_PLANS = {
+    "delete": "decision = 'delete'",
+    "link": (
+        "decision = 'delete' AND (NOT IFNULL(inode, 0) OR device || ':' || inode IS NOT "
+        "(SELECT p.device || ':' || p.inode FROM files AS p WHERE p.side = 0 AND p.rel_path = files.match_path))"
+    ),
+    "mismatch": "decision = 'mismatch'",
+    "new": "decision = 'new'",
+}
+
+# The same test as ResultRow.matches.
+_FILTER = "(instr(py_lower(shown_path), ?) OR instr(hash_key, ?) OR instr(action_key, ?))"
+
+
+class DiskRows:
+    """A sorted, filtered view of a DiskIndex's rows, read a page at a time.
+
+    Stands in for the list of ResultRow objects ResultTable renders and
+    save_csv writes: it supports ``len()``, slicing and iteration without
+    holding the rows.
+
+    A slice that starts within or just after the one read before is sought
+    from the sort key of the row before it, as scrolling does, rather than
+    by skipping every row up to it with OFFSET.
+    """
+
+    def __init__(self, index, sort_column=None, reverse=False, filter_text="", db=None):
+        self._index = index
+        self._db = db or index.db
+        self._order = "id"
+        self._key = "NULL"
+        self._after = "id > ?"
+        if sort_column is not None:
+            self._key = _SORT_KEYS[sort_column]
+            self._order = f"{self._key}{' DESC' if reverse else ''}, id"
+            # Written so the range on the sort column can use its index.
+            compare = "<" if reverse else ">"
+            self._after = f"{self._key} {compare}= ? AND ({self._key} {compare} ? OR id > ?)"
+        self._where = "WHERE action IS NOT NULL"
+        self._params = ()
+        if filter_text:
+            self._where += f" AND {_FILTER}"
+            self._params = (filter_text,) * 3
+        self._length = None
+        # (position, [(sort key, id), ...]) of the rows read last.
+        self._seen = (0, [])
+
+    def __len__(self):
+        if self._length is None:
+            sql = f"SELECT COUNT(*) FROM files {self._where}"
+            self._length = self._db.execute(sql, self._params).fetchone()[0]
+        return self._length
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            rows = self[item:item + 1]
+            if not rows:
+                raise IndexError(item)
+            return rows[0]
+        start, stop, _ = item.indices(len(self))
+        if stop <= start:
+            return []
+        where, params = self._where, self._params
+        seen_start, seen = self._seen
+        before = None
+        if seen_start < start <= seen_start + len(seen):
+            before = seen[start - seen_start - 1]
+            key, file_id = before
+            where += f" AND {self._after}"
+            params += (file_id,) if self._key == "NULL" else (key, key, file_id)
+        sql = f"SELECT shown_path, shown_hash, action, {self._key}, id FROM files {where} ORDER BY {self._order} LIMIT ? OFFSET ?"
+        rows = self._db.execute(sql, params + (stop - start, 0 if before else start)).fetchall()
+        keys = [(key, file_id) for *_, key, file_id in rows]
+        self._seen = (start - 1, [before, *keys]) if before else (start, keys)
+        return [ResultRow(*values[:3]) for values in rows]
+
+    def __iter__(self):
+        for values in self._select("shown_path, shown_hash, action"):
+            yield ResultRow(*values)
+
+    def records(self):
+        """``(path, digest, action, side, rel_path, size, mtime_ns, inode, decision, target)`` per row.
+
+        ``side`` is the side's name, as in ComparisonResult.files.
+        """
+        sides = self._index.sides
+        for path, digest, action, side, *rest in self._select(
+            "shown_path, shown_hash, action, side, rel_path, size, mtime_ns, inode, decision, target"
+        ):
+            yield (path, digest, action, sides[side], *rest)
+
+    def _select(self, columns):
+        # One query rather than pages, so the rows are only sorted once.
+        sql = f"SELECT {columns} FROM files {self._where} ORDER BY {self._order}"
+        cursor = self._db.execute(sql, self._params)
+        while True:
+            batch = cursor.fetchmany(BATCH_ROWS)
+            if not batch:
+                return
+            yield from batch
+
+
+class DiskIndex:
+    """The files, digests, plans and rows of one comparison, in SQLite.
+
+    ``labels`` maps each cleanup side to the name its rows are shown under,
+    as in ComparisonResult, and ``roots`` maps every side to its folder.
+    Plans are read from disk each time they are used; the ``*_plan``
+    properties are DiskPlan views for execution to stream.
+
+    With ``path`` None, the index is a new file in the cache folder that
+    is removed when the index is closed or garbage collected; an index
+    left at a given ``path`` is replaced.
+    """
+
+    def __init__(self, path, preserve_folder, labels, cleanup_folders=()):
+        if path is None:
+            os.makedirs(hash_cache.CACHE_DIR, exist_ok=True)
+            handle, path = tempfile.mkstemp(prefix="comparison-index-", suffix=".sqlite3", dir=hash_cache.CACHE_DIR)
+            os.close(handle)
+            self._remove = weakref.finalize(self, _remove_index, path)
+        else:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            _remove_index(path)
+            self._remove = None
+        self.path = path
+        self.preserve_folder = preserve_folder
+        self.labels = labels
+        self.sides = ["preserve", *labels]
+        self.roots = {"preserve": preserve_folder, **dict(zip(labels, cleanup_folders))}
+        self.bytes_read = 0
+        self.bytes_cached = 0
+        self.db = self.connect()
+        self.db.executescript(_SCHEMA)
+
+    def connect(self):
+        """A new connection to the index, for reading it on another thread."""
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=OFF")
+        db.execute("PRAGMA temp_store=FILE")
+        db.execute(f"PRAGMA cache_size=-{CACHE_KIB}")
+        db.create_function("py_lower", 1, _lower, deterministic=True)
+        return db
+
+    def close(self):
+        self.db.close()
+        if self._remove is not None:
+            self._remove()
+
+    # -- lookups -------------------------------------------------------
+
+    def has_digest(self, digest):
+        """Whether a preserve file has this SHA256 (among the files hashed)."""
+        return self.preserve_path(digest) is not None
+
+    def preserve_path(self, digest):
+        """The first preserve rel_path with this SHA256, or None."""
+        row = self.db.execute(
+            "SELECT rel_path FROM files WHERE digest = ? AND side = 0 ORDER BY id LIMIT 1",
+            (digest,),
+        ).fetchone()
+        return row[0] if row else None
+
+    def has_path(self, rel_path, db=None):
+        """Whether ``rel_path`` exists in the preserve folder."""
+        row = (db or self.db).execute("SELECT 1 FROM files WHERE side = 0 AND rel_path = ?", (rel_path,)).fetchone()
+        return row is not None
+
+    def _key(self, full_path):
+        """``(side, rel_path)`` of a cleanup file's full path, or None."""
+        for side, folder in enumerate(self.roots.values()):
+            prefix = os.path.join(folder, "")
+            if side and full_path.startswith(prefix):
+                return side, full_path[len(prefix):]
+        return None
+
+    def count(self, decision=None, side=None):
+        """Files with a row, or with the plan ``decision``, on one side or all."""
+        sql = "SELECT COUNT(*) FROM files WHERE action IS NOT NULL"
+        params = ()
+        if decision is not None:
+            sql += " AND decision = ?"
+            params += (decision,)
+        if side is not None:
+            sql += " AND side = ?"
+            params += (self.sides.index(side),)
+        return self.db.execute(sql, params).fetchone()[0]
+
+    # -- rows and plans ------------------------------------------------
+
+    def rows(self, sort_column=None, reverse=False, filter_text="", db=None):
+        """The table rows as a DiskRows view; see ResultTable.set_source.
+
+        ``db`` is a connection from connect() to read them through instead.
+        """
+        return DiskRows(self, sort_column, reverse, filter_text, db)
+
+    def add_rows(self, rows):
+        """Write files that are already decided, e.g. read from a saved plan.
+
+        Each row is ``(side, rel_path, full_path, size, mtime_ns, inode,
+        device, digest, decision, match_path, target, shown_path,
+        shown_hash, action)``, with ``side`` an index into ``sides``.
+        """
+        batch = []
+        for row in rows:
+            shown_path, shown_hash, action = row[-3:]
+            batch.append((*row, os.path.basename(shown_path.lower()), shown_hash.lower(), action.lower()))
+            if len(batch) >= BATCH_ROWS:
+                self.db.executemany(_ADD_ROW, batch)
+                batch = []
+        self.db.executemany(_ADD_ROW, batch)
+        self.db.commit()
+
+    def finish(self):
+        """Index the rows once they are all written, so the table can page
+        through a sorted view without sorting it each time."""
+        for column in _SORT_KEYS.values():
+            self.db.execute(f"CREATE INDEX IF NOT EXISTS files_{column} ON files ({column}, id) WHERE action IS NOT NULL")
+        self.db.commit()
+
+    def record_executed(self, deleted=(), moved=(), linked=(), db=None):
+        """Update the index after plans were carried out, without comparing again.
+
+        Deleted and moved cleanup files lose their rows, and a moved file is
+        added as a preserve file at its new path with its digest carried
+        over. Only the cleanup files sharing a digest or a path with a
+        deleted or moved file are decided again; files that were never hashed are not read.
+        Linked files are stat'ed again, so they leave the link plan. ``db``
+        is a connection from connect() to write through instead.
+        """
+        db = db or self.db
+        db.execute("CREATE TEMP TABLE IF NOT EXISTS executed (digest TEXT, rel_path TEXT)")
+        db.execute("DELETE FROM temp.executed")
+        for full_path in deleted:
+            key = self._key(full_path)
+            if key is not None:
+                db.execute("DELETE FROM files WHERE side = ? AND rel_path = ?", key)
+                # Files at the same path in later folders move up in line.
+                db.execute("INSERT INTO temp.executed VALUES (NULL, ?)", key[1:])
+        for src, dst in moved:
+            key = self._key(src)
+            row = key and db.execute("SELECT sample, digest, shown_hash FROM files WHERE side = ? AND rel_path = ?", key).fetchone()
+            if row is None:
+                continue
+            db.execute("DELETE FROM files WHERE side = ? AND rel_path = ?", key)
+            try:
+                stat_result = os.stat(dst)
+            except OSError:
+                continue
+            sample, digest, shown_hash = row
+            rel_path = os.path.relpath(dst, self.preserve_folder)
+            db.execute(_MOVED, (
+                rel_path, dst, stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino, stat_result.st_dev,
+                sample, digest, 1 if digest else 0, rel_path, shown_hash, ACTION_REFERENCE,
+                os.path.basename(rel_path.lower()), shown_hash.lower(), ACTION_REFERENCE.lower(),
+            ))
+            db.execute("INSERT INTO temp.executed VALUES (?, ?)", (digest, key[1]))
+            db.executemany("INSERT INTO temp.executed VALUES (?, ?)", ((digest, path) for path in unprimed_paths(rel_path)))
+        for path, _ in linked:
+            key = self._key(path)
+            try:
+                stat_result = os.stat(path)
+            except OSError:
+                continue
+            if key is not None:
+                db.execute(
+                    "UPDATE files SET mtime_ns = ?, inode = ?, device = ? WHERE side = ? AND rel_path = ?",
+                    (stat_result.st_mtime_ns, stat_result.st_ino, stat_result.st_dev, *key),
+                )
+        db.commit()
+        _decide(
+            self,
+            "side > 0 AND (digest IN (SELECT digest FROM temp.executed) OR rel_path IN (SELECT rel_path FROM temp.executed))",
+            db,
+        )
+        db.execute("DELETE FROM temp.executed")
+        db.commit()
+
+    def iter_rows(self):
+        """``(key, row)`` for every file in scan order, as in ComparisonResult.rows."""
+        for _, side, rel_path, *row in self._stream(
+            "SELECT id, side, rel_path, shown_path, shown_hash, action FROM files WHERE action IS NOT NULL"
+        ):
+            yield (self.sides[side], rel_path), tuple(row)
+
+    def _stream(self, sql, params=(), db=None):
+        """Rows of ``SELECT id, ... FROM files WHERE ...`` in id order, one batch in memory."""
+        db = db or self.db
+        last = 0
+        while True:
+            batch = db.execute(f"{sql} AND id > ? ORDER BY id LIMIT ?", params + (last, BATCH_ROWS)).fetchall()
+            if not batch:
+                return
+            yield from batch
+            last = batch[-1][0]
+
+    def plan(self, decision, db=None):
+        """Stream a plan in scan order.
+
+        ``"delete"`` yields full paths; ``"link"``, ``"mismatch"`` and
+        ``"new"`` yield ``(src, dst)`` pairs as in the ComparisonResult plans.
+        """
+        if decision == "delete":
+            for _, full_path in self._stream(f"SELECT id, full_path FROM files WHERE {_PLANS[decision]}", db=db):
+                yield full_path
+        else:
+            for _, src, dst in self._stream(f"SELECT id, full_path, target FROM files WHERE {_PLANS[decision]}", db=db):
+                yield src, dst
+
+    @property
+    def delete_plan(self):
+        return DiskPlan(self, "delete")
+
+    @property
+    def link_plan(self):
+        return DiskPlan(self, "link")
+
+    @property
+    def move_mismatch_plan(self):
+        return DiskPlan(self, "mismatch")
+
+    @property
+    def move_new_plan(self):
+        return DiskPlan(self, "new")
+
+
+class DiskPlan:
+    """One plan of a DiskIndex, read a page at a time whenever it is iterated.
+
+    Stands in for a plan list of ComparisonResult, for execution to stream
+    through: ``len()`` is counted once, when the plan is made (through
+    ``db`` if given), and each iteration reads through a connection of its
+    own, so it may run on any thread.
+    """
+
+    def __init__(self, index, decision, db=None):
+        self._index = index
+        self._decision = decision
+        self._count = (db or index.db).execute(f"SELECT COUNT(*) FROM files WHERE {_PLANS[decision]}").fetchone()[0]
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        db = self._index.connect()
+        try:
+            yield from self._index.plan(self._decision, db)
+        finally:
+            db.close()
+
+
+def _lower(text):
+    return text.lower() if text is not None else None
+
+
+def _remove_index(path):
+    for name in (path, path + "-wal", path + "-shm"):
+        try:
+            os.remove(name)
+        except FileNotFoundError:
+            pass
+        except OSError as exc:
+            print(f"Could not remove {name}: {exc}")
+
+
+def _shown_path(index, side, rel_path):
+    label = index.labels.get(index.sides[side]) if side else None
+    return os.path.join(label, rel_path) if label else rel_path
+
+
+def _insert(index, side, entries, manifest, progress, found):
+    """Write scanner entries to the index; returns the running file count.
+
+    Samples and digests of a ``manifest`` are kept for unchanged files.
+    """
+    batch = []
+    for entry in entries:
+        sample = digest = None
+        known = manifest.entries.get(entry.rel_path) if manifest is not None else None
+        if known is not None and known.stat_key == entry.stat_key:
+            digest = known.digest
+            if entry.size > 2 * SAMPLE_SIZE:
+                sample = known.sample
+        batch.append((side, entry.rel_path, entry.full_path, entry.size, entry.mtime_ns, entry.inode, entry.device, sample, digest))
+        found += 1
+        if len(batch) >= BATCH_ROWS:
+            index.db.executemany(_INSERT, batch)
+            batch = []
+            if progress:
+                progress("Scanning", found)
+    index.db.executemany(_INSERT, batch)
+    index.db.commit()
+    return found
+
+
+def hash_pass(index, stage, where, workers, progress, telemetry, column=None):
+    """Read the sample or full hash of the files matching ``where`` and store them.
+
+    They go in the ``sample`` or ``digest`` column, or in ``column`` if given.
+    """
+    db = index.db
+    hasher = calculate_sample_sha256 if stage == "sample" else calculate_sha256
+    column = column or ("sample" if stage == "sample" else "digest")
+    # Hardlinks to one inode are read once, through their first row; the rest copy its hash afterwards.
+    first_link = (
+        f"(NOT IFNULL(inode, 0) OR id = (SELECT MIN(link.id) FROM files AS link "
+        f"WHERE link.device = files.device AND link.inode = files.inode AND {where}))"
+    )
+    total = db.execute(f"SELECT COUNT(*) FROM files WHERE {where} AND {first_link}").fetchone()[0]
+    if not total:
+        return
+    jobs = index._stream(f"SELECT id, full_path, size, device, inode FROM files WHERE {where} AND {first_link}")
+    results = queue.Queue()
+    scheduler = HashScheduler(results, workers, telemetry=telemetry)
+    # Enough jobs queued to keep every worker and tool batch busy, no more.
+    limit = scheduler.max_in_flight * scheduler.batch_size * 2
+    outstanding = done = 0
+    updates = []
+    try:
+        while True:
+            while outstanding < limit:
+                job = next(jobs, None)
+                if job is None:
+                    break
+                file_id, full_path, size, device, inode = job
+                read = min(size, 2 * SAMPLE_SIZE) if stage == "sample" else size
+                scheduler.submit((file_id, read), full_path, hasher, read, (device, inode) if inode else None)
+                outstanding += 1
+            if not outstanding:
+                break
+            _, (file_id, read), _, digest, cached = results.get()
+            outstanding -= 1
+            done += 1
+            if cached:
+                index.bytes_cached += read
+            else:
+                index.bytes_read += read
+            if digest:
+                updates.append((digest, file_id))
+            if len(updates) >= BATCH_ROWS:
+                db.executemany(f"UPDATE files SET {column} = ? WHERE id = ?", updates)
+                updates = []
+            if progress:
+                progress("Hashing", done, total)
+    finally:
+        scheduler.close()
+    db.executemany(f"UPDATE files SET {column} = ? WHERE id = ?", updates)
+    db.execute(
+        f"UPDATE files SET {column} = (SELECT link.{column} FROM files AS link "
+        f"WHERE link.device = files.device AND link.inode = files.inode AND link.{column} IS NOT NULL) "
+        f"WHERE {where} AND inode AND {column} IS NULL"
+    )
+    db.commit()
+
+
+def _decide(index, where="1", db=None):
+    """Decide the files matching ``where`` and fill in their rows, by the rules of comparison._Comparison."""
+    db = db or index.db
+    cross = len(index.labels) > 1
+    updates = []
+    for file_id, side, rel_path, size, sample, digest, shared, grouped in index._stream(
+        f"SELECT id, side, rel_path, size, sample, digest, shared, grouped FROM files WHERE {where}", db=db
+    ):
+        if (shared and size > 2 * SAMPLE_SIZE and not sample) or (grouped and not digest):
+            continue  # the file could not be read; it gets no row
+        shown_path = _shown_path(index, side, rel_path)
+        if digest:
+            shown_hash = digest
+        else:
+            shown_hash = NOT_HASHED_SAMPLE_DIFFERS if shared else NOT_HASHED_UNIQUE_SIZE
+        decision = match_path = target = copy_of = None
+        if side and digest:
+            row = db.execute(
+                "SELECT rel_path FROM files WHERE digest = ? AND side = 0 AND grouped = 1 ORDER BY id LIMIT 1",
+                (digest,),
+            ).fetchone()
+            match_path = row[0] if row else None
+            if match_path is None and cross:
+                copy_of = db.execute(
+                    "SELECT id, side, rel_path FROM files WHERE digest = ? AND side > 0 ORDER BY side, id LIMIT 1",
+                    (digest,),
+                ).fetchone()
+        if side == 0:
+            action = ACTION_REFERENCE
+        elif match_path is not None:
+            decision, target = "delete", os.path.join(index.preserve_folder, match_path)
+            action = ACTION_DELETE.format(match_path)
+        elif copy_of is not None and copy_of[1] < side:
+            decision = "copy"
+            action = ACTION_CLEANUP_COPY.format(_shown_path(index, copy_of[1], copy_of[2]))
+        else:
+            rank = db.execute(
+                "SELECT COUNT(*) FROM files WHERE rel_path = ? AND side BETWEEN 1 AND ?", (rel_path, side - 1)
+            ).fetchone()[0]
+            moved_to = move_target(rel_path, rank, lambda path: index.has_path(path, db))
+            target = os.path.join(index.preserve_folder, moved_to)
+            if moved_to != rel_path:
+                decision, action = "mismatch", ACTION_MOVE_MISMATCH
+            else:
+                decision, action = "new", ACTION_MOVE_NEW
+        updates.append((
+            decision,
+            match_path,
+            target,
+            shown_path,
+            shown_hash,
+            action,
+            os.path.basename(shown_path.lower()),
+            shown_hash.lower(),
+            action.lower(),
+            file_id,
+        ))
+        if len(updates) >= BATCH_ROWS:
+            db.executemany(_DECIDE, updates)
+            updates = []
+    db.executemany(_DECIDE, updates)
+    db.commit()
+
+
+def compare_on_disk(
+    preserve_folder,
+    cleanup_folder,
+    path=None,
+    workers=None,
+    progress=None,
+    manifest=None,
+    telemetry=None,
+):
+    """Compare like compare_trees, keeping everything in a DiskIndex at ``path``.
+
+    The rows and plans are those compare_trees would produce. By default
+    the index is a file of its own, removed when it is closed. With a ``manifest`` of
+    the preserve folder, its files are stat'ed rather than walked and its
+    digests are reused for unchanged files. ``progress`` and ``telemetry``
+    are used as in compare_trees.
+    """
+    cleanup_folders = [cleanup_folder] if isinstance(cleanup_folder, str) else list(cleanup_folder)
+    index = DiskIndex(path, preserve_folder, cleanup_sides(cleanup_folders), cleanup_folders)
+    db = index.db
+
+    def phase(name):
+        return telemetry.phase(name) if telemetry is not None else nullcontext()
+
+    with phase("walk"):
+        if manifest is not None:
+            found = _insert(index, 0, entries_from_files(manifest.files()), manifest, progress, 0)
+        else:
+            found = _insert(index, 0, scan_entries(preserve_folder), None, progress, 0)
+        for side, folder in enumerate(cleanup_folders, 1):
+            found = _insert(index, side, scan_entries(folder), None, progress, found)
+
+    with phase("hash"):
+        # Sizes, then sizes and samples, found in more than one folder.
+        db.execute("UPDATE files SET shared = 1 WHERE size IN (SELECT size FROM files GROUP BY size HAVING COUNT(DISTINCT side) > 1)")
+        hash_pass(index, "sample", f"shared = 1 AND size > {2 * SAMPLE_SIZE} AND sample IS NULL", workers, progress, telemetry)
+        db.execute(
+            "CREATE TEMP TABLE groups AS SELECT size, IFNULL(sample, '') AS sample FROM files "
+            f"WHERE shared = 1 AND (size <= {2 * SAMPLE_SIZE} OR sample IS NOT NULL) "
+            "GROUP BY size, IFNULL(sample, '') HAVING COUNT(DISTINCT side) > 1"
+        )
+        db.execute("CREATE UNIQUE INDEX temp.groups_key ON groups (size, sample)")
+        db.execute(
+            "UPDATE files SET grouped = 1 WHERE shared = 1 AND EXISTS "
+            "(SELECT 1 FROM groups WHERE groups.size = files.size AND groups.sample = IFNULL(files.sample, ''))"
+        )
+        db.execute("DROP TABLE temp.groups")
+        db.commit()
+        hash_pass(index, "full", "grouped = 1 AND digest IS NULL", workers, progress, telemetry)
+
+    with phase("assemble"):
+        _decide(index)
+        index.finish()
+    return index
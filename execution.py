@@ -0,0 +1,473 @@
+"""Crash-safe execution of delete and move plans.
+
+Every run is recorded in an append-only journal under JOURNAL_DIR: the whole
+plan first, then one line per finished file. A run that was interrupted can
+be resumed or rolled back from its journal without rescanning either folder.
+
+Moves are tried as an atomic os.rename first. Only a rename across devices
+falls back to copy-then-unlink; those copies and all deletes run in a
+bounded thread pool. Destination directories are created once per run, and
+no move replaces an existing file or shares its destination with another.
+
+Instead of being deleted, duplicates can be replaced by a hardlink or, where
+the file system supports it, a copy-on-write reflink of their preserve copy.
+"""
+
+import errno
+import filecmp
+import json
+import os
+import shutil
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import hash_cache
+from worker import TaskCancelled
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+JOURNAL_DIR = os.path.join(hash_cache.CACHE_DIR, "journals")
+
+# Threads for cross-device copies and deletes.
+COPY_WORKERS = 4
+
+# Journal lines written between fsyncs. Files done after the last sync are
+# recognised from the file system when the run is resumed.
+SYNC_INTERVAL = 100
+
+# Finished journals kept for a later rollback; older ones are removed.
+JOURNAL_KEEP = 20
+
+# A cross-device copy is written here and renamed into place when complete.
+PARTIAL_SUFFIX = ".partial"
+
+# "auto" reflinks where the file system supports it and hardlinks elsewhere.
+LINK_MODES = ("auto", "hardlink", "reflink")
+link_mode = "auto"
+
+# Linux ioctl that makes one file share another's extents.
+_FICLONE = 0x40049409
+_NO_REFLINK = {errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EXDEV, errno.EPERM}
+
+
+def _open_for_append(path):
+    """Open ``path`` to add records to; the Journal closes it."""
+    return open(path, "a", encoding="utf-8")
+
+
+class Journal:
+    """Append-only record of one delete or move run.
+
+    ``entries`` holds ``(op, src, dst)`` tuples, with ``dst`` None for a
+    delete and the preserve copy to link to for a link, and ``status`` maps
+    an entry's index to ``"done"``, ``"failed"``, ``"undone"`` or
+    ``"undo failed"``; both are only filled in by load, as a new run reads
+    its entries back from the file. ``count`` is the number of entries and
+    ``repeated`` the moves to a destination an earlier entry moves to.
+    ``finished`` is set once the run ended without being interrupted.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.stage = None
+        self.entries = []
+        self.status = {}
+        self.count = 0
+        self.repeated = set()
+        self.finished = None
+        self._handle = None
+        self._unsynced = 0
+        self._claimed = set()
+
+    @classmethod
+    def create(cls, stage, entries):
+        """Write a new journal for ``entries``, which may be any iterable."""
+        os.makedirs(JOURNAL_DIR, exist_ok=True)
+        _prune_journals()
+        journal = cls(os.path.join(JOURNAL_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{time.time_ns()}.jsonl"))
+        journal.stage = stage
+        journal._write({"begin": stage, "time": time.time()})
+        for op, src, dst in entries:
+            journal._write({"id": journal.count, "op": op, "src": src, "dst": dst})
+            journal._add(op, dst)
+        journal._claimed = set()
+        journal.sync()
+        return journal
+
+    def _add(self, op, dst):
+        # Two moves to one destination would leave only one of the files.
+        if op == "move":
+            dst = os.path.abspath(dst)
+            if dst in self._claimed:
+                self.repeated.add(self.count)
+            self._claimed.add(dst)
+        self.count += 1
+
+    def iter_entries(self):
+        """``(index, (op, src, dst))`` for every entry, read back from the file unless loaded."""
+        if self.entries:
+            yield from enumerate(self.entries)
+            return
+        with open(self.path, encoding="utf-8") as handle:
+            for line in handle:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if "op" in record:
+                    yield record["id"], (record["op"], record["src"], record["dst"])
+
+    @classmethod
+    def load(cls, path):
+        """Read a journal; a line cut short by a crash is ignored."""
+        journal = cls(path)
+        with open(path, encoding="utf-8") as handle:
+            for line in handle:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if "begin" in record:
+                    journal.stage = record["begin"]
+                elif "op" in record:
+                    journal.entries.append((record["op"], record["src"], record["dst"]))
+                    journal._add(record["op"], record["dst"])
+                elif "status" in record:
+                    journal.status[record["id"]] = record["status"]
+                elif "end" in record:
+                    journal.finished = record["end"]
+        journal._claimed = set()
+        return journal
+
+    def _write(self, record):
+        if self._handle is None:
+            self._handle = _open_for_append(self.path)
+        self._handle.write(json.dumps(record) + "\n")
+        self._unsynced += 1
+        if self._unsynced >= SYNC_INTERVAL:
+            self.sync()
+
+    def sync(self):
+        if self._handle is not None:
+            self._handle.flush()
+            os.fsync(self._handle.fileno())
+            self._unsynced = 0
+
+    def record(self, index, status, error=None):
+        record = {"id": index, "status": status}
+        if error:
+            record["error"] = error
+        self._write(record)
+
+    def finish(self, outcome):
+        self.finished = outcome
+        self._write({"end": outcome})
+        self.close()
+
+    def close(self):
+        if self._handle is not None:
+            self.sync()
+            self._handle.close()
+            self._handle = None
+
+
+def _is_finished(path):
+    """Check the last line for an end record without reading the whole journal."""
+    try:
+        with open(path, "rb") as handle:
+            handle.seek(max(0, os.fstat(handle.fileno()).st_size - 4096))
+            last = handle.read().splitlines()[-1:]
+        return bool(last) and "end" in json.loads(last[0])
+    except (OSError, ValueError):
+        return False
+
+
+def _prune_journals():
+    finished = [path for path in sorted(_journal_paths()) if _is_finished(path)]
+    for path in finished[:-JOURNAL_KEEP] if JOURNAL_KEEP else finished:
+        try:
+            os.remove(path)
+        except OSError as exc:
+            print(f"Error removing journal {path}: {exc}")
+
+
+def _journal_paths():
+    try:
+        names = os.listdir(JOURNAL_DIR)
+    except OSError:
+        return []
+    return [os.path.join(JOURNAL_DIR, name) for name in names if name.endswith(".jsonl")]
+
+
+def interrupted_journals():
+    """Journals of runs that stopped without finishing, oldest first."""
+    return [path for path in sorted(_journal_paths()) if not _is_finished(path)]
+
+
+def _make_dir(folder, made):
+    """Create a destination directory once per run."""
+    if folder and folder not in made:
+        made.add(folder)
+        try:
+            os.makedirs(folder, exist_ok=True)
+        except OSError as exc:
+            print(f"Error creating {folder}: {exc}")
+
+
+def _rename(src, dst):
+    """Move with os.rename; False if src and dst are on different devices."""
+    # os.rename silently replaces an existing file on POSIX.
+    if os.path.lexists(dst):
+        raise FileExistsError(errno.EEXIST, "Destination already exists", dst)
+    try:
+        os.rename(src, dst)
+    except OSError as exc:
+        if exc.errno != errno.EXDEV:
+            raise
+        return False
+    return True
+
+
+def _publish(partial, dst):
+    """Give the finished copy ``partial`` the name ``dst``, unless ``dst`` exists by now."""
+    try:
+        os.link(partial, dst)
+    except FileExistsError:
+        raise
+    except OSError:
+        # No hardlinks here: claim the name first, then replace the claim.
+        os.close(os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL))
+        os.replace(partial, dst)
+        return
+    os.remove(partial)
+
+
+def _copy_then_unlink(src, dst):
+    partial = dst + PARTIAL_SUFFIX
+    try:
+        shutil.copy2(src, partial)
+        _publish(partial, dst)
+    except BaseException:
+        if os.path.lexists(partial):
+            os.remove(partial)
+        raise
+    os.remove(src)
+
+
+def _reflink(target, path):
+    with open(target, "rb") as source, open(path, "wb") as copy:
+        fcntl.ioctl(copy.fileno(), _FICLONE, source.fileno())
+
+
+def _replace_with(path, make):
+    """Build a replacement for ``path`` with ``make(partial)`` and swap it in."""
+    partial = path + PARTIAL_SUFFIX
+    try:
+        make(partial)
+        os.replace(partial, path)
+    except BaseException:
+        if os.path.lexists(partial):
+            os.remove(partial)
+        raise
+
+
+def _link(path, target):
+    """Replace the duplicate ``path`` by a reflink or hardlink of ``target``."""
+
+    def make(partial):
+        if link_mode != "hardlink" and fcntl is not None:
+            try:
+                _reflink(target, partial)
+                shutil.copystat(path, partial)
+                return
+            except OSError as exc:
+                if link_mode == "reflink" or exc.errno not in _NO_REFLINK:
+                    raise
+                os.remove(partial)
+        elif link_mode == "reflink":
+            raise OSError(errno.EOPNOTSUPP, "Reflinks are not supported on this platform", path)
+        os.link(target, partial)
+
+    _replace_with(path, make)
+
+
+def _unshare(path, target):
+    """Give ``path`` its own copy of ``target``'s content again."""
+    _replace_with(path, lambda partial: shutil.copy2(target, partial))
+
+
+def _already_done(op, src, dst):
+    """Whether an entry a crashed run did not record was in fact carried out."""
+    if op == "delete":
+        return not os.path.lexists(src)
+    if op in ("link", "unshare"):
+        partial = src + PARTIAL_SUFFIX
+        if os.path.lexists(partial):
+            os.remove(partial)
+        if not os.path.exists(src):
+            return False
+        # A reflink cannot be told from a copy; linking it again is harmless.
+        return os.path.samefile(src, dst) == (op == "link")
+    partial = dst + PARTIAL_SUFFIX
+    if os.path.lexists(partial):
+        os.remove(partial)
+    if not os.path.lexists(src):
+        return os.path.lexists(dst)
+    if os.path.lexists(dst) and filecmp.cmp(src, dst, shallow=False):
+        # Copied across devices; only the unlink was missing.
+        os.remove(src)
+        return True
+    return False
+
+
+_VERBS = {"delete": "deleting", "link": "linking", "unshare": "unlinking"}
+
+
+def _run(journal, entries, total, stage, progress, workers, undo=False, reconcile=False):
+    """Carry out journal entries; returns (done entries, errors, cancelled).
+
+    ``entries`` yields ``(index, (op, src, dst))`` and is read as the run
+    goes, so it may stream a journal of any length. With ``undo`` each move
+    is reversed. With ``reconcile`` entries that a crashed run already
+    completed are only recorded, not repeated.
+    """
+    status = "undone" if undo else "done"
+    done = []
+    errors = 0
+    count = 0
+
+    def target(entry):
+        op, src, dst = entry
+        if op == "link":
+            return ("unshare" if undo else op), src, dst
+        return (op, dst, src) if undo else (op, src, dst)
+
+    def finish(index, entry, error=None):
+        nonlocal errors, count
+        count += 1
+        if error is None:
+            journal.record(index, status)
+            done.append(entry)
+        else:
+            errors += 1
+            journal.record(index, "undo failed" if undo else "failed", str(error))
+            op, src, _ = target(entry)
+            print(f"Error {_VERBS.get(op, 'moving')} {src}: {error}")
+
+    def collect(futures, block):
+        if not futures:
+            return
+        finished, _ = wait(futures, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+        for future in finished:
+            index, entry = futures.pop(future)
+            if not future.cancelled():
+                finish(index, entry, future.exception())
+
+    made = set()
+    workers = max(1, workers or COPY_WORKERS)
+    cancelled = False
+    futures = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        try:
+            for index, entry in entries:
+                if progress:
+                    progress(stage, count, total)
+                op, src, dst = target(entry)
+                try:
+                    if reconcile and _already_done(op, src, dst):
+                        finish(index, entry)
+                    elif op == "delete":
+                        futures[pool.submit(os.remove, src)] = index, entry
+                    elif op in ("link", "unshare"):
+                        futures[pool.submit(_link if op == "link" else _unshare, src, dst)] = index, entry
+                    elif not undo and index in journal.repeated:
+                        raise FileExistsError(errno.EEXIST, "Another file of this run is moved there", dst)
+                    else:
+                        _make_dir(os.path.dirname(dst), made)
+                        if _rename(src, dst):
+                            finish(index, entry)
+                        else:
+                            futures[pool.submit(_copy_then_unlink, src, dst)] = index, entry
+                except OSError as exc:
+                    finish(index, entry, exc)
+                collect(futures, block=len(futures) >= workers * 4)
+            while futures:
+                collect(futures, block=True)
+                if progress:
+                    progress(stage, count, total)
+        except TaskCancelled:
+            cancelled = True
+            for future in futures:
+                future.cancel()
+            while futures:
+                collect(futures, block=True)
+
+    journal.finish("cancelled" if cancelled else ("rolled back" if undo else "completed"))
+    return done, errors, cancelled
+
+
+def delete_files(paths, progress=None, workers=None):
+    """Delete ``paths``; returns (deleted, errors, cancelled).
+
+    ``paths`` may be any iterable, such as a plan streamed from a
+    disk_index.DiskIndex, here and in move_files and link_files. Stops
+    early, with ``cancelled`` set, if ``progress`` raises TaskCancelled.
+    """
+    journal = Journal.create("Deleting", (("delete", path, None) for path in paths))
+    done, errors, cancelled = _run(journal, journal.iter_entries(), journal.count, "Deleting", progress, workers)
+    return [src for _, src, _ in done], errors, cancelled
+
+
+def move_files(moves, stage="Moving", progress=None, workers=None):
+    """Move ``(src, dst)`` pairs; returns (moved, errors, cancelled).
+
+    Stops early, with ``cancelled`` set, if ``progress`` raises TaskCancelled.
+    """
+    journal = Journal.create(stage, (("move", src, dst) for src, dst in moves))
+    done, errors, cancelled = _run(journal, journal.iter_entries(), journal.count, stage, progress, workers)
+    return [(src, dst) for _, src, dst in done], errors, cancelled
+
+
+def link_files(links, progress=None, workers=None):
+    """Replace duplicates by links to their preserve copy; returns (linked, errors, cancelled).
+
+    ``links`` holds ``(path, preserve_path)`` pairs; ``link_mode`` picks
+    reflinks, hardlinks or the best available. Stops early, with
+    ``cancelled`` set, if ``progress`` raises TaskCancelled.
+    """
+    journal = Journal.create("Linking", (("link", path, target) for path, target in links))
+    done, errors, cancelled = _run(journal, journal.iter_entries(), journal.count, "Linking", progress, workers)
+    return [(src, dst) for _, src, dst in done], errors, cancelled
+
+
+def resume_journal(path, progress=None, workers=None):
+    """Carry out what an interrupted run left undone.
+
+    Returns (done entries, errors, cancelled); entries are ``(op, src, dst)``.
+    """
+    journal = Journal.load(path)
+    entries = [(index, entry) for index, entry in enumerate(journal.entries) if journal.status.get(index) != "done"]
+    return _run(journal, entries, len(entries), f"Resuming: {journal.stage}", progress, workers, reconcile=True)
+
+
+def rollback_journal(path, progress=None, workers=None):
+    """Move the files of a run back where they came from.
+
+    Linked files get their own copy of the content again. Deleted files
+    cannot be restored and are only reported; moves that failed are left
+    alone. Returns (undone entries, errors, cancelled).
+    """
+    journal = Journal.load(path)
+    deleted = sum(1 for index, (op, _, _) in enumerate(journal.entries) if op == "delete" and journal.status.get(index) == "done")
+    if deleted:
+        print(f"{deleted} deleted files cannot be restored.")
+    entries = [
+        (index, journal.entries[index])
+        for index in reversed(range(len(journal.entries)))
+        if journal.entries[index][0] in ("move", "link") and journal.status.get(index) in ("done", "undo failed", None)
+    ]
+    return _run(journal, entries, len(entries), f"Rolling back: {journal.stage}", progress, workers, undo=True, reconcile=True)
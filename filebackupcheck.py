@@ -0,0 +1,540 @@
+"""Command-line entry point for running comparisons without the GUI.
+
+Usage::
+
+    python -m filebackupcheck compare PRESERVE CLEANUP [CLEANUP ...] [options]
+
+    python -m filebackupcheck index PRESERVE MANIFEST [--update]
+    python -m filebackupcheck watch PRESERVE CLEANUP [CLEANUP ...] [--execute ACTION ...]
+    python -m filebackupcheck calibrate FOLDER [FOLDER ...] [--override METHOD]
+    python -m filebackupcheck disk FOLDER [FOLDER ...] [--kind auto|hdd|ssd] [--readers N]
+    python -m filebackupcheck journals
+    python -m filebackupcheck resume|rollback JOURNAL [JOURNAL ...]
+
+Plan rows are written to stdout (or ``--output``) as CSV or JSON Lines while
+the folders are still being hashed. Nothing on disk is changed unless
+``--execute`` names the action classes to carry out. Every executed plan is
+journaled; ``journals`` lists runs that were interrupted, which ``resume``
+finishes and ``rollback`` moves back. ``index`` saves a manifest of the
+preserve folder that ``compare --index`` uses instead of rehashing it.
+``compare --checkpoint FILE`` records hashing progress so an interrupted
+comparison picks up where it stopped when run again. ``calibrate`` times the
+hashing backends again and picks the fastest for ``--hash-method auto``.
+``watch`` keeps comparing as files arrive until interrupted, reading only new
+and changed files, and can carry out the plans once the folders are quiet.
+``disk`` shows or sets whether folders are on a hard disk, which is then read
+by fewer threads and in physical order. ``compare --disk-index`` keeps the
+comparison in an SQLite file instead of memory, for trees with more files
+than fit in RAM; its rows are written once the comparison is done.
+"""
+
+import argparse
+import contextlib
+import csv
+import json
+import os
+import sys
+
+import calibration
+import checkpoint
+import comparison
+import devices
+import disk_index
+import execution
+import hash_cache
+import hash_pool
+import manifest
+import sha256_tools
+import telemetry
+import watch
+
+ACTIONS = ("delete", "link", "move-mismatch", "move-new")
+
+# "all" leaves out link: it replaces the same duplicates delete removes.
+ALL_ACTIONS = ("delete", "move-mismatch", "move-new")
+
+
+class RowWriter:
+    """Writes plan rows to a stream as they are produced."""
+
+    def __init__(self, stream, output_format):
+        self.stream = stream
+        self.output_format = output_format
+        self.count = 0
+        if output_format == "csv":
+            self._csv = csv.writer(stream)
+            self._csv.writerow(["Path", "SHA256", "Action"])
+
+    def write(self, key, row):
+        side = key[0]
+        if self.output_format == "csv":
+            self._csv.writerow(row)
+        else:
+            path, digest, action = row
+            self.stream.write(json.dumps({"side": side, "path": path, "sha256": digest, "action": action}) + "\n")
+        self.stream.flush()
+        self.count += 1
+
+
+def _add_read_options(parser):
+    parser.add_argument(
+        "--block-size",
+        type=int,
+        default=sha256_tools.BLOCK_SIZE,
+        help="read buffer size in bytes (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--mmap-threshold",
+        type=int,
+        default=sha256_tools.MMAP_THRESHOLD,
+        metavar="BYTES",
+        help="hash files of at least BYTES through mmap (default: never)",
+    )
+    parser.add_argument(
+        "--no-fadvise",
+        dest="fadvise",
+        action="store_false",
+        default=sha256_tools.FADVISE,
+        help="keep hashed files in the page cache",
+    )
+
+
+def _apply_read_options(args):
+    sha256_tools.BLOCK_SIZE = args.block_size
+    sha256_tools.MMAP_THRESHOLD = args.mmap_threshold
+    sha256_tools.FADVISE = args.fadvise
+
+
+def _build_parser():
+    parser = argparse.ArgumentParser(
+        prog="filebackupcheck",
+        description="Compare a cleanup folder against a preserve folder.",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    compare = subparsers.add_parser("compare", help="compare two folders and optionally act on the plan")
+    compare.add_argument("preserve", help="folder holding the reference copies")
+    compare.add_argument("cleanup", nargs="+", help="folders to reconcile against the preserve folder, in one pass")
+    compare.add_argument("--format", choices=("csv", "jsonl"), default="csv", help="row output format (default: csv)")
+    compare.add_argument("--output", default="-", help="file to write rows to (default: stdout)")
+    compare.add_argument("--workers", type=int, default=hash_pool.DEFAULT_WORKERS, help="files hashed concurrently")
+    compare.add_argument(
+        "--queue-depth",
+        type=int,
+        default=comparison.SCAN_QUEUE_DEPTH,
+        help="scanned files allowed to wait for hashing before the walk pauses",
+    )
+    compare.add_argument(
+        "--hash-method",
+        choices=sha256_tools.HASH_METHODS,
+        default=sha256_tools.hash_method,
+        help="hashing backend (default: %(default)s, the fastest found by calibrate)",
+    )
+    _add_read_options(compare)
+    compare.add_argument(
+        "--prefilter",
+        action="store_true",
+        help=f"match files on a fast {sha256_tools.FINGERPRINT_ALGORITHM} fingerprint, reading SHA256 only for candidate duplicates",
+    )
+    compare.add_argument("--cache", choices=hash_cache.CACHE_MODES, default=hash_cache.mode, help="hash cache mode")
+    compare.add_argument("--index", metavar="MANIFEST", help="preserve folder manifest written by the index command")
+    compare.add_argument(
+        "--checkpoint",
+        metavar="FILE",
+        help="record progress in FILE, resuming from it if it holds a comparison of the same folders",
+    )
+    compare.add_argument(
+        "--disk-index",
+        nargs="?",
+        const=True,
+        metavar="FILE",
+        help="keep files, digests and plans in an SQLite FILE rather than in memory (default: a file of this run's own)",
+    )
+    compare.add_argument("--timing", metavar="FILE", help="write a JSON timing report (phases, throughput, slowest files)")
+    compare.add_argument(
+        "--execute",
+        nargs="+",
+        choices=ACTIONS + ("all",),
+        default=[],
+        metavar="ACTION",
+        help=f"carry out these action classes after comparing: {', '.join(ACTIONS)} or all ({', '.join(ALL_ACTIONS)})",
+    )
+    compare.add_argument(
+        "--link-mode",
+        choices=execution.LINK_MODES,
+        default=execution.link_mode,
+        help="how link replaces duplicates (default: %(default)s, reflink where supported)",
+    )
+    compare.add_argument("--dry-run", action="store_true", help="report what --execute would do without doing it")
+    compare.add_argument(
+        "--copy-workers",
+        type=int,
+        default=execution.COPY_WORKERS,
+        help="concurrent cross-device copies and deletes",
+    )
+
+    index = subparsers.add_parser("index", help="save a reusable manifest of a preserve folder")
+    index.add_argument("preserve", help="folder to index")
+    index.add_argument("manifest", help="manifest file to write")
+    index.add_argument("--update", action="store_true", help="rehash only files changed since the existing manifest")
+    index.add_argument("--workers", type=int, default=hash_pool.DEFAULT_WORKERS, help="files hashed concurrently")
+    _add_read_options(index)
+
+    watcher = subparsers.add_parser("watch", help="keep comparing as files arrive, until interrupted")
+    watcher.add_argument("preserve", help="folder holding the reference copies")
+    watcher.add_argument("cleanup", nargs="+", help="folders to reconcile against the preserve folder")
+    watcher.add_argument("--workers", type=int, default=hash_pool.DEFAULT_WORKERS, help="files hashed concurrently")
+    watcher.add_argument("--cache", choices=hash_cache.CACHE_MODES, default=hash_cache.mode, help="hash cache mode")
+    watcher.add_argument("--prefilter", action="store_true", help="match files on a fast fingerprint, as in compare")
+    watcher.add_argument(
+        "--execute",
+        nargs="+",
+        choices=watch.WATCH_ACTIONS + ("all",),
+        default=[],
+        metavar="ACTION",
+        help=f"carry out these plans once nothing changed for --quiet seconds: {', '.join(watch.WATCH_ACTIONS)} or all",
+    )
+    watcher.add_argument(
+        "--quiet",
+        type=float,
+        default=watch.QUIET_PERIOD,
+        help="seconds without changes before --execute acts (default: %(default)s)",
+    )
+    watcher.add_argument(
+        "--poll-interval",
+        type=float,
+        default=watch.POLL_INTERVAL,
+        help="seconds between folder walks where inotify is not available (default: %(default)s)",
+    )
+    watcher.add_argument("--no-inotify", dest="inotify", action="store_false", help="poll even on Linux")
+
+    calibrate = subparsers.add_parser("calibrate", help="time the hashing backends and remember the fastest")
+    calibrate.add_argument("folders", nargs="+", help="folders to take sample files from")
+    calibrate.add_argument(
+        "--override",
+        choices=("auto",) + sha256_tools.CALIBRATED_METHODS,
+        help="always use this backend for --hash-method auto (auto: the fastest again)",
+    )
+
+    disk = subparsers.add_parser("disk", help="show or set the disk kind and read limit of folders")
+    disk.add_argument("folders", nargs="+", help="folders to show or set")
+    disk.add_argument("--kind", choices=devices.DEVICE_KINDS, help="hdd: few readers, physical order; auto: detect")
+    disk.add_argument("--readers", type=int, default=0, help="concurrent reads on the folder's disk (0: default)")
+
+    subparsers.add_parser("journals", help="list delete/move runs that did not finish")
+    for name, help_text in (
+        ("resume", "finish interrupted delete/move runs"),
+        ("rollback", "move the files of a delete/move run back"),
+    ):
+        journal = subparsers.add_parser(name, help=help_text)
+        journal.add_argument("journal", nargs="+", help="journal file, as listed by the journals command")
+        journal.add_argument("--copy-workers", type=int, default=execution.COPY_WORKERS)
+    return parser
+
+
+def _bytes_summary(result):
+    """Megabytes read by a comparison, and those served by the hash cache."""
+    text = f"{result.bytes_read / (1024 * 1024):.1f} MB read"
+    if result.bytes_cached:
+        text += f", {result.bytes_cached / (1024 * 1024):.1f} MB from the hash cache"
+    return text
+
+
+def _execute(result, actions, dry_run, copy_workers, run):
+    """Carry out the selected plans; returns the number of failed files."""
+    errors = 0
+    for action in ACTIONS:
+        if action not in actions:
+            continue
+        if action == "delete":
+            plan = result.delete_plan
+        elif action == "link":
+            plan = result.link_plan
+        elif action == "move-mismatch":
+            plan = result.move_mismatch_plan
+        else:
+            plan = result.move_new_plan
+
+        if dry_run:
+            for item in plan:
+                src, dst = (item, None) if action == "delete" else item
+                print(f"Would {action}: {src}" + (f" -> {dst}" if dst else ""))
+            print(f"{action}: {len(plan)} files (dry run)")
+            continue
+
+        with run.phase(action):
+            if action == "delete":
+                done, failed, _ = execution.delete_files(plan, workers=copy_workers)
+            elif action == "link":
+                done, failed, _ = execution.link_files(plan, workers=copy_workers)
+            else:
+                done, failed, _ = execution.move_files(plan, action, workers=copy_workers)
+        errors += failed
+        print(f"{action}: {len(done)} files done, {failed} failed")
+    return errors
+
+
+def _backend_ready():
+    """Whether the hashing backend can run; prints why not."""
+    try:
+        sha256_tools.check_backend()
+    except RuntimeError as exc:
+        print(exc)
+        return False
+    return True
+
+
+def run_compare(args, out):
+    sha256_tools.hash_method = args.hash_method
+    if args.hash_method == "auto":
+        calibration.ensure_calibrated([args.preserve, *args.cleanup])
+    if not _backend_ready():
+        return 2
+    devices.apply([args.preserve, *args.cleanup])
+    hash_cache.mode = args.cache
+    _apply_read_options(args)
+    execution.link_mode = args.link_mode
+    actions = set(ALL_ACTIONS) if "all" in args.execute else set(args.execute)
+    if {"delete", "link"} <= actions:
+        print("delete and link act on the same duplicates; choose one")
+        return 2
+    if args.disk_index and (args.checkpoint or args.prefilter):
+        print("--disk-index cannot be combined with --checkpoint or --prefilter")
+        return 2
+
+    index = None
+    if args.index:
+        try:
+            index = manifest.Manifest.load(args.index)
+        except (OSError, ValueError) as exc:
+            print(f"Could not load index: {exc}")
+            return 2
+        if index.root != os.path.abspath(args.preserve):
+            print(f"{args.index} indexes {index.root}, not {args.preserve}")
+            return 2
+
+    previous = None
+    tracker = None
+    if args.checkpoint:
+        folders = os.path.abspath(args.preserve), [os.path.abspath(folder) for folder in args.cleanup]
+        if os.path.exists(args.checkpoint):
+            try:
+                last = checkpoint.Checkpoint.load(args.checkpoint)
+            except (OSError, ValueError) as exc:
+                print(f"Could not load checkpoint: {exc}")
+                return 2
+            if (last.preserve_folder, last.cleanup_folders) != folders:
+                print(f"{args.checkpoint} is a comparison of other folders")
+                return 2
+            previous = last.previous
+            print(f"Resuming from {args.checkpoint}: {len(previous.digests)} digests known")
+        try:
+            tracker = checkpoint.Checkpoint.create(*folders, previous, path=args.checkpoint)
+        except OSError as exc:
+            print(f"Could not write checkpoint: {exc}")
+            return 2
+
+    run = telemetry.RunTelemetry()
+    writer = RowWriter(out, args.format)
+    if args.disk_index:
+        return _compare_on_disk(args, index, actions, writer, run)
+    try:
+        result = comparison.compare_trees(
+            args.preserve,
+            args.cleanup,
+            workers=args.workers,
+            on_row=writer.write,
+            queue_depth=args.queue_depth,
+            manifest=index,
+            telemetry=run,
+            previous=previous,
+            checkpoint=tracker,
+            prefilter=args.prefilter,
+        )
+    finally:
+        hash_cache.flush()
+
+    print(
+        f"{writer.count} rows: {len(result.delete_plan)} to delete, "
+        f"{len(result.move_mismatch_plan)} to rename and move, "
+        f"{len(result.move_new_plan)} new to move; "
+        f"{_bytes_summary(result)}"
+    )
+    if len(args.cleanup) > 1:
+        for side, folder in zip(result.labels, args.cleanup):
+            plans = result.plans_for(side)
+            print(
+                f"  {folder}: {len(plans['delete'])} to delete, "
+                f"{len(plans['move_mismatch'])} to rename and move, {len(plans['move_new'])} new to move"
+            )
+    errors = _execute(result, actions, args.dry_run, args.copy_workers, run)
+    return _finish_compare(args, run, errors)
+
+
+def _compare_on_disk(args, index, actions, writer, run):
+    """run_compare with --disk-index: rows and counts are streamed from the index."""
+    try:
+        result = disk_index.compare_on_disk(
+            args.preserve,
+            args.cleanup,
+            path=None if args.disk_index is True else args.disk_index,
+            workers=args.workers,
+            manifest=index,
+            telemetry=run,
+        )
+    finally:
+        hash_cache.flush()
+    try:
+        for key, row in result.iter_rows():
+            writer.write(key, row)
+        print(
+            f"{writer.count} rows: {result.count('delete')} to delete, "
+            f"{result.count('mismatch')} to rename and move, "
+            f"{result.count('new')} new to move; "
+            f"{_bytes_summary(result)}"
+        )
+        if len(args.cleanup) > 1:
+            for side, folder in zip(result.labels, args.cleanup):
+                print(
+                    f"  {folder}: {result.count('delete', side)} to delete, "
+                    f"{result.count('mismatch', side)} to rename and move, {result.count('new', side)} new to move"
+                )
+        errors = _execute(result, actions, args.dry_run, args.copy_workers, run)
+    finally:
+        result.close()
+    return _finish_compare(args, run, errors)
+
+
+def _finish_compare(args, run, errors):
+    run.finish()
+    if args.timing:
+        with open(args.timing, "w", encoding="utf-8") as handle:
+            json.dump(run.report(), handle, indent=2)
+    return 1 if errors else 0
+
+
+def run_index(args):
+    _apply_read_options(args)
+    calibration.ensure_calibrated([args.preserve])
+    if not _backend_ready():
+        return 2
+    devices.apply([args.preserve])
+    previous = None
+    if args.update and os.path.exists(args.manifest):
+        try:
+            previous = manifest.Manifest.load(args.manifest)
+        except (OSError, ValueError) as exc:
+            print(f"Could not load index: {exc}")
+            return 2
+    try:
+        index = manifest.build_manifest(args.preserve, args.workers, previous=previous)
+    finally:
+        hash_cache.flush()
+    index.save(args.manifest)
+    print(f"{len(index.entries)} files indexed in {args.manifest}")
+    return 0
+
+
+def run_watch(args):
+    hash_cache.mode = args.cache
+    calibration.ensure_calibrated([args.preserve, *args.cleanup])
+    if not _backend_ready():
+        return 2
+    devices.apply([args.preserve, *args.cleanup])
+    actions = watch.WATCH_ACTIONS if "all" in args.execute else args.execute
+    watcher = watch.Watch(
+        args.preserve,
+        args.cleanup,
+        workers=args.workers,
+        prefilter=args.prefilter,
+        actions=actions,
+        quiet=args.quiet,
+        poll_interval=args.poll_interval,
+        use_inotify=args.inotify,
+    )
+
+    def updated(result, changes):
+        hash_cache.flush()
+        print(
+            f"{len(result.delete_plan)} to delete, {len(result.move_mismatch_plan)} to rename and move, "
+            f"{len(result.move_new_plan)} new to move; {_bytes_summary(result)}"
+        )
+
+    def executed(action, done, failed):
+        print(f"{action}: {len(done)} files done, {failed} failed")
+
+    try:
+        watcher.run(on_update=updated, on_executed=executed)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        hash_cache.flush()
+    return 0
+
+
+def run_calibrate(args):
+    config = calibration.calibrate(args.folders)
+    if args.override:
+        config = calibration.set_override(args.override)
+    for method, seconds in sorted(config.get("timings", {}).items(), key=lambda item: item[1]):
+        print(f"{method}: {seconds:.3f}s for {config['files']} files")
+    print(f"Using {config.get('override') or config.get('method', 'hashlib')}; saved to {calibration.CONFIG_PATH}")
+    return 0
+
+
+def run_disk(args):
+    if args.kind:
+        for folder in args.folders:
+            devices.set_folder(folder, args.kind, args.readers or None)
+    config = devices.load_config()
+    for folder, (kind, readers) in devices.apply(args.folders).items():
+        setting = devices.folder_setting(folder, config)[0]
+        detail = f"at most {readers} reads at once" if readers else "reads with all workers"
+        if kind == "hdd":
+            detail += ", physical order"
+        print(f"{folder}: {kind} ({setting}), {detail}")
+    return 0
+
+
+def run_journals(args):
+    if args.command == "journals":
+        for path in execution.interrupted_journals():
+            journal = execution.Journal.load(path)
+            done = sum(1 for status in journal.status.values() if status == "done")
+            print(f"{path}: {journal.stage}, {done}/{len(journal.entries)} files done")
+        return 0
+
+    handler = execution.resume_journal if args.command == "resume" else execution.rollback_journal
+    errors = 0
+    for path in args.journal:
+        done, failed, _ = handler(path, workers=args.copy_workers)
+        errors += failed
+        print(f"{path}: {len(done)} files {'done' if args.command == 'resume' else 'moved back'}, {failed} failed")
+    return 1 if errors else 0
+
+
+def main(argv=None):
+    args = _build_parser().parse_args(argv)
+    if args.command == "index":
+        return run_index(args)
+    if args.command == "calibrate":
+        return run_calibrate(args)
+    if args.command == "watch":
+        return run_watch(args)
+    if args.command == "disk":
+        return run_disk(args)
+    if args.command != "compare":
+        return run_journals(args)
+
+    # Rows go to stdout; diagnostics printed by the core go to stderr.
+    with contextlib.ExitStack() as stack:
+        if args.output == "-":
+            out = sys.stdout
+        else:
+            out = stack.enter_context(open(args.output, "w", newline="", encoding="utf-8"))
+        stack.enter_context(contextlib.redirect_stdout(sys.stderr))
+        return run_compare(args, out)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,11 @@
+import os
 import tkinter as tk
 from tkinter import ttk
 
+import calibration
 import logic
+import sha256_tools
+from result_table import ResultTable
 
 
 def create_gui():
@@ -24,6 +28,10 @@ def create_gui():
         command=logic.browse_preserve_folder,
     )
     preserve_button.pack(side=tk.LEFT, padx=5)
+    logic.save_index_button = ttk.Button(preserve_frame, text="Save Index", command=logic.save_index)
+    logic.save_index_button.pack(side=tk.RIGHT, padx=5)
+    logic.load_index_button = ttk.Button(preserve_frame, text="Load Index", command=logic.load_index)
+    logic.load_index_button.pack(side=tk.RIGHT, padx=5)
     logic.preserve_label = ttk.Label(preserve_frame, text="Preserve Folder: Not Selected")
     logic.preserve_label.pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
 
@@ -35,29 +43,96 @@ def create_gui():
         command=logic.browse_cleanup_folder,
     )
     cleanup_button.pack(side=tk.LEFT, padx=5)
+    add_cleanup_button = ttk.Button(cleanup_frame, text="Add Cleanup Folder", command=logic.add_cleanup_folder)
+    add_cleanup_button.pack(side=tk.RIGHT, padx=5)
+    disks_button = ttk.Button(cleanup_frame, text="Disk Settings", command=logic.edit_disk_settings)
+    disks_button.pack(side=tk.RIGHT, padx=5)
     logic.cleanup_label = ttk.Label(cleanup_frame, text="Cleanup Folder: Not Selected")
     logic.cleanup_label.pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
 
     button_frame = ttk.Frame(main_frame)
     button_frame.pack(fill=tk.X, pady=5)
 
-    prepare_button = ttk.Button(button_frame, text="Prepare Comparison", command=logic.prepare_comparison)
-    prepare_button.pack(side=tk.LEFT, padx=5)
+    logic.prepare_button = ttk.Button(button_frame, text="Prepare Comparison", command=logic.prepare_comparison)
+    logic.prepare_button.pack(side=tk.LEFT, padx=5)
 
-    logic.delete_button = ttk.Button(button_frame, text="Delete Identical", command=logic.execute_delete, state=tk.DISABLED)
+    logic.resume_button = ttk.Button(button_frame, text="Resume Comparison", command=logic.resume_comparison)
+    if not os.path.exists(logic.CHECKPOINT_PATH):
+        logic.resume_button.config(state=tk.DISABLED)
+    logic.resume_button.pack(side=tk.LEFT, padx=5)
+
+    logic.watch_button = ttk.Button(button_frame, text="Watch", command=logic.watch_folders)
+    logic.watch_button.pack(side=tk.LEFT, padx=5)
+
+    logic.save_button = ttk.Button(button_frame, text="Save CSV", command=logic.save_csv)
+    logic.save_button.pack(side=tk.RIGHT, padx=5)
+
+    logic.load_button = ttk.Button(button_frame, text="Load CSV", command=logic.load_csv)
+    logic.load_button.pack(side=tk.RIGHT, padx=5)
+
+    logic.timing_button = ttk.Button(button_frame, text="Timing Report", command=logic.save_timing_report, state=tk.DISABLED)
+    logic.timing_button.pack(side=tk.RIGHT, padx=5)
+
+    execute_frame = ttk.Frame(main_frame)
+    execute_frame.pack(fill=tk.X, pady=5)
+
+    logic.delete_button = ttk.Button(execute_frame, text="Delete Identical", command=logic.execute_delete, state=tk.DISABLED)
     logic.delete_button.pack(side=tk.LEFT, padx=5)
 
-    logic.move_mismatch_button = ttk.Button(button_frame, text="Move Mismatched", command=logic.execute_move_mismatch, state=tk.DISABLED)
+    logic.link_button = ttk.Button(execute_frame, text="Link Identical", command=logic.execute_link, state=tk.DISABLED)
+    logic.link_button.pack(side=tk.LEFT, padx=5)
+
+    logic.move_mismatch_button = ttk.Button(execute_frame, text="Move Mismatched", command=logic.execute_move_mismatch, state=tk.DISABLED)
     logic.move_mismatch_button.pack(side=tk.LEFT, padx=5)
 
-    logic.move_new_button = ttk.Button(button_frame, text="Move New", command=logic.execute_move_new, state=tk.DISABLED)
+    logic.move_new_button = ttk.Button(execute_frame, text="Move New", command=logic.execute_move_new, state=tk.DISABLED)
     logic.move_new_button.pack(side=tk.LEFT, padx=5)
 
-    save_button = ttk.Button(button_frame, text="Save CSV", command=logic.save_csv)
-    save_button.pack(side=tk.LEFT, padx=5)
-
-    load_button = ttk.Button(button_frame, text="Load CSV", command=logic.load_csv)
-    load_button.pack(side=tk.LEFT, padx=5)
+    options_frame = ttk.LabelFrame(main_frame, text="Options", padding=5)
+    options_frame.pack(fill=tk.X, pady=5)
+
+    logic.disk_index_var = tk.BooleanVar(value=False)
+    disk_index_check = ttk.Checkbutton(options_frame, text="Disk index", variable=logic.disk_index_var)
+    disk_index_check.pack(side=tk.LEFT, padx=5)
+
+    logic.prefilter_var = tk.BooleanVar(value=False)
+    prefilter_check = ttk.Checkbutton(options_frame, text="Fast prefilter", variable=logic.prefilter_var)
+    prefilter_check.pack(side=tk.LEFT, padx=5)
+
+    logic.auto_execute_var = tk.BooleanVar(value=False)
+    auto_execute_check = ttk.Checkbutton(options_frame, text="Auto-execute", variable=logic.auto_execute_var)
+    auto_execute_check.pack(side=tk.LEFT, padx=5)
+
+    logic.workers_var = tk.IntVar(value=logic.DEFAULT_WORKERS)
+    workers_spinbox = ttk.Spinbox(options_frame, from_=1, to=64, width=4, textvariable=logic.workers_var)
+    workers_spinbox.pack(side=tk.RIGHT, padx=5)
+    workers_label = ttk.Label(options_frame, text="Hash workers:")
+    workers_label.pack(side=tk.RIGHT)
+
+    logic.cache_mode_var = tk.StringVar(value=logic.hash_cache.mode)
+    cache_combobox = ttk.Combobox(
+        options_frame,
+        values=logic.hash_cache.CACHE_MODES,
+        width=7,
+        state="readonly",
+        textvariable=logic.cache_mode_var,
+    )
+    cache_combobox.pack(side=tk.RIGHT, padx=5)
+    cache_label = ttk.Label(options_frame, text="Hash cache:")
+    cache_label.pack(side=tk.RIGHT)
+
+    logic.hash_method_var = tk.StringVar(value=calibration.load_config().get("override") or "auto")
+    hash_method_combobox = ttk.Combobox(
+        options_frame,
+        values=("auto",) + sha256_tools.CALIBRATED_METHODS,
+        width=9,
+        state="readonly",
+        textvariable=logic.hash_method_var,
+    )
+    hash_method_combobox.bind("<<ComboboxSelected>>", logic.set_hash_method)
+    hash_method_combobox.pack(side=tk.RIGHT, padx=5)
+    hash_method_label = ttk.Label(options_frame, text="Hashing:")
+    hash_method_label.pack(side=tk.RIGHT)
 
     progress_frame = ttk.Frame(main_frame)
     progress_frame.pack(fill=tk.X, pady=5)
@@ -65,6 +140,12 @@ def create_gui():
     logic.progress_label = ttk.Label(progress_frame, text="")
     logic.progress_label.pack(side=tk.LEFT, padx=5)
 
+    logic.cancel_button = ttk.Button(progress_frame, text="Cancel", command=logic.cancel_task, state=tk.DISABLED)
+    logic.cancel_button.pack(side=tk.RIGHT, padx=5)
+
+    logic.pause_button = ttk.Button(progress_frame, text="Pause", command=logic.toggle_pause, state=tk.DISABLED)
+    logic.pause_button.pack(side=tk.RIGHT, padx=5)
+
     logic.progress_var = tk.IntVar()
     progress_bar = ttk.Progressbar(
         progress_frame,
@@ -75,6 +156,15 @@ def create_gui():
     )
     progress_bar.pack(side=tk.RIGHT, fill=tk.X, expand=True, padx=5)
 
+    filter_frame = ttk.Frame(main_frame)
+    filter_frame.pack(fill=tk.X, pady=2)
+    filter_label = ttk.Label(filter_frame, text="Filter:")
+    filter_label.pack(side=tk.LEFT, padx=5)
+    filter_var = tk.StringVar()
+    filter_var.trace_add("write", lambda *args: logic.filter_rows(filter_var.get()))
+    filter_entry = ttk.Entry(filter_frame, textvariable=filter_var)
+    filter_entry.pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
+
     tree_frame = ttk.Frame(main_frame)
     tree_frame.pack(fill=tk.BOTH, expand=True, pady=5)
 
@@ -87,11 +177,11 @@ def create_gui():
         tree_frame,
         columns=("Path", "SHA256", "Action"),
         show="headings",
-        yscrollcommand=vsb.set,
         xscrollcommand=hsb.set,
     )
 
-    vsb.config(command=logic.tree.yview)
+    # The vertical scrollbar scrolls the result model, not the Treeview.
+    logic.table = ResultTable(logic.tree, vsb)
     hsb.config(command=logic.tree.xview)
 
     logic.tree.heading("Path", text="Path", command=lambda: logic.sort_by_column("Path"))
@@ -107,4 +197,5 @@ def create_gui():
     root.geometry("1000x600")
     root.minsize(800, 500)
 
+    root.after(0, logic.check_interrupted_runs)
     root.mainloop()
@@ -0,0 +1,130 @@
+"""Persistent SHA256 cache keyed on (path, size, mtime_ns, inode).
+
+Digests are stored in a small SQLite database so that rerunning a comparison
+over an unchanged folder does not read its files again.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".filebackupcheck")
+CACHE_PATH = os.path.join(CACHE_DIR, "hash_cache.sqlite3")
+
+# "use" reuses digests whose stat is unchanged, "verify" rehashes every file
+# and reports cached digests that turn out to be wrong, "ignore" bypasses the
+# cache entirely.
+CACHE_MODES = ("use", "verify", "ignore")
+mode = "use"
+
+# Least recently used entries beyond this count are evicted on flush().
+MAX_ENTRIES = 1000000
+COMMIT_INTERVAL = 1000
+
+_lock = threading.Lock()
+_connection = None
+_disabled = False
+_pending_writes = 0
+
+
+def _connect():
+    """Open the cache database on first use; None if it is unavailable."""
+    global _connection, _disabled
+    if _connection is not None or _disabled:
+        return _connection
+    try:
+        os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+        connection = sqlite3.connect(CACHE_PATH, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+            "inode INTEGER, digest TEXT, last_used REAL)"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS hashes_last_used ON hashes (last_used)")
+        _connection = connection
+    except sqlite3.Error as exc:
+        print(f"Hash cache disabled, cannot open {CACHE_PATH}: {exc}")
+        _disabled = True
+    return _connection
+
+
+def _note_write(connection):
+    global _pending_writes
+    _pending_writes += 1
+    if _pending_writes >= COMMIT_INTERVAL:
+        connection.commit()
+        _pending_writes = 0
+
+
+def _lookup_locked(connection, path, stat_result):
+    row = connection.execute(
+        "SELECT digest FROM hashes WHERE path = ? AND size = ? AND mtime_ns = ? AND inode = ?",
+        (path, stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino),
+    ).fetchone()
+    return row[0] if row else None
+
+
+def lookup(filepath, stat_result):
+    """Return the cached digest for ``filepath`` if its stat is unchanged."""
+    if mode != "use":
+        return None
+    path = os.path.abspath(filepath)
+    with _lock:
+        connection = _connect()
+        if connection is None:
+            return None
+        try:
+            digest = _lookup_locked(connection, path, stat_result)
+            if digest:
+                connection.execute("UPDATE hashes SET last_used = ? WHERE path = ?", (time.time(), path))
+                _note_write(connection)
+            return digest
+        except sqlite3.Error as exc:
+            print(f"Hash cache lookup failed for {filepath}: {exc}")
+            return None
+
+
+def store(filepath, stat_result, digest):
+    """Remember ``digest`` for ``filepath`` as it was when ``stat_result`` was taken."""
+    if mode == "ignore":
+        return
+    path = os.path.abspath(filepath)
+    with _lock:
+        connection = _connect()
+        if connection is None:
+            return
+        try:
+            if mode == "verify":
+                cached = _lookup_locked(connection, path, stat_result)
+                if cached and cached != digest:
+                    print(f"Warning: cached hash for {filepath} was stale ({cached} != {digest})")
+            connection.execute(
+                "INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?)",
+                (path, stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino, digest, time.time()),
+            )
+            _note_write(connection)
+        except sqlite3.Error as exc:
+            print(f"Hash cache update failed for {filepath}: {exc}")
+
+
+def flush():
+    """Commit pending writes and evict least recently used entries."""
+    global _pending_writes
+    with _lock:
+        if _connection is None:
+            return
+        try:
+            count = _connection.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+            if count > MAX_ENTRIES:
+                _connection.execute(
+                    "DELETE FROM hashes WHERE path IN "
+                    "(SELECT path FROM hashes ORDER BY last_used LIMIT ?)",
+                    (count - MAX_ENTRIES,),
+                )
+            _connection.commit()
+            _pending_writes = 0
+        except sqlite3.Error as exc:
+            print(f"Hash cache flush failed: {exc}")
+
@@ -0,0 +1,293 @@
+"""Concurrent hashing of many files with a bounded number in flight."""
+
+import itertools
+import os
+import queue
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import devices
+import hash_cache
+from sha256_tools import (
+    calculate_sha256,
+    calculate_sha256_batch,
+    check_backend,
+    supports_batching,
+)
+
+# hashlib and file reads release the GIL, so threads keep both the disk queue
+# and the CPU cores busy without the pickling cost of a process pool.
+DEFAULT_WORKERS = min(8, os.cpu_count() or 1)
+
+# Most files handed to one external hashing process at a time.
+BATCH_SIZE = 256
+
+
+def _cached_digest(filepath, hasher):
+    """The hash cache's digest of ``filepath``, if ``hasher`` would use it."""
+    if hasher is not calculate_sha256 or hash_cache.mode != "use":
+        return None
+    try:
+        return hash_cache.lookup(filepath, os.stat(filepath))
+    except OSError:
+        return None
+
+
+class _DeviceBacklog:
+    """Files waiting to be read from one device.
+
+    With ``ordered``, files are taken in physical order like an elevator:
+    the next one at or after the last position, wrapping around at the end.
+    Otherwise they are taken in the order submitted. ``active`` counts the
+    files of this device being read, at most ``readers`` if that is set.
+    """
+
+    def __init__(self, readers, ordered):
+        self.readers = readers
+        self.ordered = ordered
+        self.active = 0
+        self.position = (0, 0)
+        self._jobs = [] if ordered else deque()
+        self._count = itertools.count()
+
+    def __len__(self):
+        return len(self._jobs)
+
+    @property
+    def ready(self):
+        return bool(self._jobs) and (self.readers is None or self.active < self.readers)
+
+    def add(self, job, order=None):
+        if self.ordered:
+            insort(self._jobs, (order, next(self._count), job))
+        else:
+            self._jobs.append(job)
+
+    def _next_index(self):
+        index = bisect_left(self._jobs, (self.position,))
+        return index if index < len(self._jobs) else 0
+
+    def peek(self):
+        return self._jobs[self._next_index()][2] if self.ordered else self._jobs[0]
+
+    def pop(self):
+        if not self.ordered:
+            return self._jobs.popleft()
+        order, _, job = self._jobs.pop(self._next_index())
+        self.position = order
+        return job
+
+    def clear(self):
+        self._jobs.clear()
+
+
+class HashScheduler:
+    """Hash files on a thread pool as they are submitted.
+
+    At most ``max_in_flight`` tasks (default: four per worker) are handed to
+    the pool at once; the rest wait in a backlog. Each finished file is put
+    on ``results`` as ``("hashed", key, filepath, digest, cached)``, in
+    completion order; ``cached`` is true when a full SHA256 came from the
+    hash cache without reading the file.
+
+    With an external hashing tool, a task is a batch of up to ``batch_size``
+    full-hash jobs run through one tool process. Only one task per worker is
+    in flight then, so jobs gather in the backlog while the tools run and
+    the next batches share them out.
+
+    Files submitted with their ``physical`` ``(device, inode)`` wait in one
+    backlog per device, and the devices take turns. ``device_limits``
+    (default: devices.limits) maps a device to ``(readers, ordered)``: at
+    most ``readers`` of its files are read at once, and with ``ordered``
+    they are read in physical order (see devices.physical_order).
+
+    A ``telemetry`` (telemetry.RunTelemetry) is told about every file queued
+    and read or served from the hash cache, with the ``size`` given to submit.
+    """
+
+    def __init__(self, results, workers=None, max_in_flight=None, batch_size=None, telemetry=None, device_limits=None):
+        check_backend()
+        self.results = results
+        self.telemetry = telemetry
+        self.workers = max(1, workers or DEFAULT_WORKERS)
+        if batch_size is None:
+            batch_size = BATCH_SIZE if supports_batching() else 1
+        self.batch_size = max(1, batch_size)
+        if self.batch_size > 1:
+            self.max_in_flight = self.workers
+        else:
+            self.max_in_flight = max(self.workers, max_in_flight or self.workers * 4)
+        self.device_limits = dict(devices.limits if device_limits is None else device_limits)
+        self._backlogs = {}
+        self._turns = deque()
+        self._waiting = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+
+    @property
+    def backlog(self):
+        """Files submitted but not yet handed to the pool."""
+        return self._waiting
+
+    def submit(self, key, filepath, hasher=calculate_sha256, size=0, physical=None):
+        if self.telemetry is not None:
+            self.telemetry.planned(size)
+        device = physical[0] if physical is not None else None
+        job = (key, filepath, hasher, size)
+        with self._lock:
+            self._waiting += 1
+        if physical is not None and self.device_limits.get(device, (None, False))[1]:
+            # Finding the order may read the file system's extent map, so a
+            # pool thread does it rather than the caller's.
+            self._executor.submit(self._locate, device, job, physical)
+        else:
+            self._add(device, job, (1, 0))
+
+    def _locate(self, device, job, physical):
+        self._add(device, job, devices.physical_order(job[1], physical))
+
+    def _add(self, device, job, order):
+        with self._lock:
+            if self._closed:
+                return
+            backlog = self._backlogs.get(device)
+            if backlog is None:
+                backlog = self._backlogs[device] = _DeviceBacklog(*self.device_limits.get(device, (None, False)))
+                self._turns.append(device)
+            backlog.add(job, order)
+            self._fill()
+
+    def _next_backlog(self):
+        """The next device, in turn, with a file waiting and a reader free."""
+        for _ in range(len(self._turns)):
+            device = self._turns[0]
+            self._turns.rotate(-1)
+            if self._backlogs[device].ready:
+                return self._backlogs[device]
+        return None
+
+    def _fill(self):
+        while not self._closed and self._in_flight < self.max_in_flight:
+            backlog = self._next_backlog()
+            if backlog is None:
+                break
+            job = backlog.pop()
+            self._waiting -= 1
+            self._in_flight += 1
+            backlog.active += 1
+            if self.batch_size > 1 and job[2] is calculate_sha256:
+                # Share the backlog out over the workers rather than handing
+                # all of it to whichever becomes free first.
+                readers = min(self.workers, backlog.readers or self.workers)
+                size = min(self.batch_size, -(-(len(backlog) + 1) // readers))
+                batch = [job]
+                while len(batch) < size and backlog and backlog.peek()[2] is calculate_sha256:
+                    batch.append(backlog.pop())
+                    self._waiting -= 1
+                self._executor.submit(self._run_batch, backlog, batch)
+            else:
+                self._executor.submit(self._run, backlog, *job)
+
+    def _done(self, backlog):
+        with self._lock:
+            self._in_flight -= 1
+            backlog.active -= 1
+            self._fill()
+
+    def _run(self, backlog, key, filepath, hasher, size):
+        started = time.perf_counter()
+        digest = _cached_digest(filepath, hasher)
+        cached = digest is not None
+        if not cached:
+            try:
+                # The cache was just looked up; don't look again.
+                digest = calculate_sha256(filepath, lookup=False) if hasher is calculate_sha256 else hasher(filepath)
+            except Exception as exc:  # pragma: no cover - defensive
+                print(f"Exception hashing {filepath}: {exc}")
+                digest = None
+        if self.telemetry is not None:
+            if cached:
+                self.telemetry.file_cached(size)
+            else:
+                self.telemetry.file_done(filepath, size, time.perf_counter() - started)
+        self._done(backlog)
+        self.results.put(("hashed", key, filepath, digest, cached))
+
+    def _run_batch(self, backlog, batch):
+        started = time.perf_counter()
+        cached = {}
+        for _, filepath, hasher, _ in batch:
+            digest = _cached_digest(filepath, hasher)
+            if digest is not None:
+                cached[filepath] = digest
+        unread = [filepath for _, filepath, _, _ in batch if filepath not in cached]
+        try:
+            digests = calculate_sha256_batch(unread, lookup=False) if unread else {}
+        except Exception as exc:  # pragma: no cover - defensive
+            print(f"Exception hashing a batch of {len(unread)} files: {exc}")
+            digests = {}
+        digests.update(cached)
+        if self.telemetry is not None:
+            # The tool reports no per-file time; share the batch's out.
+            seconds = (time.perf_counter() - started) / max(1, len(unread))
+            for _, filepath, _, size in batch:
+                if filepath in cached:
+                    self.telemetry.file_cached(size)
+                else:
+                    self.telemetry.file_done(filepath, size, seconds)
+        self._done(backlog)
+        for key, filepath, _, _ in batch:
+            self.results.put(("hashed", key, filepath, digests.get(filepath), filepath in cached))
+
+    def close(self):
+        """Drop the backlog and wait for files already being hashed."""
+        with self._lock:
+            self._closed = True
+            for backlog in self._backlogs.values():
+                backlog.clear()
+            self._waiting = 0
+        self._executor.shutdown(wait=True)
+
+
+def interleave(*iterables):
+    """Round-robin over several job iterables so they are hashed side by side."""
+    iterators = [iter(iterable) for iterable in iterables]
+    while iterators:
+        for iterator in list(iterators):
+            try:
+                yield next(iterator)
+            except StopIteration:
+                iterators.remove(iterator)
+
+
+def hash_files(jobs, workers=None, max_in_flight=None, hasher=calculate_sha256):
+    """Hash ``(key, filepath)`` jobs concurrently.
+
+    Yields ``(key, filepath, digest)`` tuples in completion order. Jobs are
+    pulled from ``jobs`` only as capacity frees up, so it may be a lazy
+    iterator over an arbitrarily large tree.
+    """
+    results = queue.Queue()
+    scheduler = HashScheduler(results, workers, max_in_flight)
+    outstanding = 0
+    jobs = iter(jobs)
+    try:
+        while True:
+            while outstanding < scheduler.max_in_flight * scheduler.batch_size:
+                job = next(jobs, None)
+                if job is None:
+                    break
+                scheduler.submit(job[0], job[1], hasher)
+                outstanding += 1
+            if not outstanding:
+                break
+            _, key, filepath, digest, _ = results.get()
+            outstanding -= 1
+            yield key, filepath, digest
+    finally:
+        scheduler.close()
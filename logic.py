@@ -1,10 +1,23 @@
 import os
-import shutil
-import csv
+import json
+import time
 import tkinter as tk
-from tkinter import filedialog, messagebox
+from tkinter import filedialog, messagebox, ttk
 
-from sha256_tools import calculate_sha256
+import calibration
+from checkpoint import CHECKPOINT_PATH, Checkpoint, load_checkpoint
+from comparison import compare_folders, compare_trees
+import devices
+from disk_index import DiskPlan, compare_on_disk
+from execution import delete_files, interrupted_journals, link_files, move_files, resume_journal, rollback_journal
+import hash_cache
+from hash_pool import DEFAULT_WORKERS
+from manifest import Manifest, build_manifest
+from plan_file import index_records, load_plan, result_records, verify_plan, write_plan
+from sha256_tools import prepare_backend
+from telemetry import RunTelemetry
+from watch import QUIET_PERIOD, WATCH_ACTIONS, Watch
+from worker import BackgroundTask
 
 # GUI components will be assigned by gui_framework
 root = None
@@ -13,146 +26,746 @@ cleanup_label = None
 progress_var = None
 progress_label = None
 tree = None
+table = None
 delete_button = None
 move_mismatch_button = None
 move_new_button = None
+link_button = None
+prepare_button = None
+resume_button = None
+watch_button = None
+save_button = None
+load_button = None
+load_index_button = None
+save_index_button = None
+timing_button = None
+cancel_button = None
+pause_button = None
+workers_var = None
+cache_mode_var = None
+prefilter_var = None
+hash_method_var = None
+auto_execute_var = None
+disk_index_var = None
 
-# Data tracking
+# Data tracking. The plans are lists, or disk_index.DiskPlan views of a
+# disk index; both are replaced rather than changed in place.
 preserve_folder = ""
-cleanup_folder = ""
+cleanup_folders = []
 delete_plan = []
 move_mismatch_plan = []
 move_new_plan = []
+link_plan = []
 file_hashes = {}
+comparison_result = None
+disk_result = None
+# Set while the plans shown were loaded from a CSV file without checking the
+# files; Delete and Link stay disabled until they come from a comparison.
+unverified_plan = False
+current_task = None
+preserve_manifest = None
+run_telemetry = None
+# Why the running comparison is not checkpointed, shown with its progress.
+checkpoint_warning = None
 
-# Sorting
-sort_column = "Path"
-sort_reverse = False
+# Stages whose progress bar follows bytes read rather than files done.
+_READ_STAGES = ("Hashing", "Indexing")
+
+
+def _show_preserve_folder():
+    if preserve_label is None:
+        return
+    text = f"Preserve Folder: {preserve_folder}"
+    if _active_manifest() is not None and preserve_manifest.scan_time:
+        text += f" (index of {time.strftime('%Y-%m-%d %H:%M', time.localtime(preserve_manifest.scan_time))})"
+    preserve_label.config(text=text)
+
+
+def _active_manifest():
+    """The loaded preserve index, if it belongs to the selected preserve folder."""
+    if preserve_manifest is not None and preserve_folder and preserve_manifest.root == os.path.abspath(preserve_folder):
+        return preserve_manifest
+    return None
+
+
+def _prepare_hashing():
+    """Settle the hashing backend on the Tk thread, before a worker hashes.
+
+    7z.exe is asked for if it was chosen but cannot be found. Timing the
+    backends on the first run reads files, so it is left to the worker (see
+    calibration.ensure_calibrated), which only picks backends it finds.
+    Returns False, after telling the user, if hashing cannot run.
+    """
+    if cache_mode_var is not None:
+        hash_cache.mode = cache_mode_var.get()
+    config = calibration.load_config()
+    if calibration.needs_calibration(config):
+        return True
+    calibration.apply_config(config)
+    try:
+        prepare_backend()
+    except RuntimeError as exc:
+        progress_label.config(text="Failed")
+        messagebox.showerror("Hashing Backend", str(exc))
+        return False
+    return True
 
 
 def browse_preserve_folder():
     """Select Preserve Folder."""
     global preserve_folder
     preserve_folder = filedialog.askdirectory(title="Select Preserve Folder (Folder A)")
-    if preserve_label is not None:
-        preserve_label.config(text=f"Preserve Folder: {preserve_folder}")
+    _show_preserve_folder()
+
+
+def load_index():
+    """Use a saved preserve index instead of walking and hashing the preserve folder."""
+    global preserve_folder, preserve_manifest
+    path = filedialog.askopenfilename(
+        title="Load Preserve Index",
+        filetypes=[("Preserve index", "*.fbcidx"), ("All files", "*.*")],
+    )
+    if not path:
+        return
+    try:
+        preserve_manifest = Manifest.load(path)
+    except (OSError, ValueError) as exc:
+        messagebox.showerror("Error", f"Could not load index: {exc}")
+        return
+    preserve_folder = preserve_manifest.root
+    _show_preserve_folder()
+
+
+def save_index():
+    """Index the preserve folder and save it; a loaded index is only updated."""
+    if not preserve_folder:
+        messagebox.showwarning("Folder Not Selected", "Please select the preserve folder.")
+        return
+    path = filedialog.asksaveasfilename(
+        title="Save Preserve Index",
+        defaultextension=".fbcidx",
+        filetypes=[("Preserve index", "*.fbcidx"), ("All files", "*.*")],
+    )
+    if not path:
+        return
+
+    if not _prepare_hashing():
+        return
+    workers = get_hash_workers()
+    folder, previous = preserve_folder, _active_manifest()
+
+    run = RunTelemetry()
+
+    def work(task):
+        calibration.ensure_calibrated([folder])
+        devices.apply([folder])
+        try:
+            manifest = build_manifest(folder, workers, task.report, previous, run)
+        finally:
+            hash_cache.flush()
+        manifest.save(path)
+        return manifest
+
+    def done(manifest):
+        global preserve_manifest
+        preserve_manifest = manifest
+        progress_var.set(100)
+        progress_label.config(text=f"Indexed {len(manifest.entries)} files")
+        _show_preserve_folder()
+        messagebox.showinfo("Index Saved", f"Indexed {len(manifest.entries)} files in\n{path}")
+
+    _start_task(work, done, phase="index", telemetry=run)
+
+
+def _set_plans(plans=None):
+    """Replace the delete, move mismatch, move new and link plans; by default, with none."""
+    global delete_plan, move_mismatch_plan, move_new_plan, link_plan
+    delete_plan, move_mismatch_plan, move_new_plan, link_plan = plans or ([], [], [], [])
+
+
+def _show_cleanup_folders():
+    if cleanup_label is None:
+        return
+    if len(cleanup_folders) > 1:
+        cleanup_label.config(text=f"Cleanup Folders ({len(cleanup_folders)}): {'; '.join(cleanup_folders)}")
+    else:
+        cleanup_label.config(text=f"Cleanup Folder: {cleanup_folders[0] if cleanup_folders else ''}")
 
 
 def browse_cleanup_folder():
     """Select Cleanup Folder."""
-    global cleanup_folder
-    cleanup_folder = filedialog.askdirectory(title="Select Cleanup Folder (Folder B)")
-    if cleanup_label is not None:
-        cleanup_label.config(text=f"Cleanup Folder: {cleanup_folder}")
+    folder = filedialog.askdirectory(title="Select Cleanup Folder (Folder B)")
+    cleanup_folders[:] = [folder] if folder else []
+    _show_cleanup_folders()
+
+
+def add_cleanup_folder():
+    """Add another cleanup folder, compared in the same pass."""
+    folder = filedialog.askdirectory(title="Add Cleanup Folder")
+    if folder and folder not in cleanup_folders:
+        cleanup_folders.append(folder)
+    _show_cleanup_folders()
+
+
+def edit_disk_settings():
+    """Let the user say per folder whether it is on a hard disk or an SSD.
+
+    Hard disks get one reader at a time (or the number set) and are read in
+    physical order; "auto" detects the kind where the system reports it.
+    """
+    folders = [folder for folder in (preserve_folder, *cleanup_folders) if folder]
+    if not folders:
+        messagebox.showwarning("Folders Not Selected", "Please select the folders first.")
+        return
+
+    dialog = tk.Toplevel(root)
+    dialog.title("Disk Settings")
+    dialog.transient(root)
+    frame = ttk.Frame(dialog, padding=10)
+    frame.pack(fill=tk.BOTH, expand=True)
+    ttk.Label(frame, text="Folder").grid(row=0, column=0, sticky=tk.W)
+    ttk.Label(frame, text="Disk").grid(row=0, column=1, sticky=tk.W)
+    ttk.Label(frame, text="Readers (0: default)").grid(row=0, column=2, sticky=tk.W)
+
+    config = devices.load_config()
+    choices = []
+    for row, folder in enumerate(folders, 1):
+        kind, readers = devices.folder_setting(folder, config)
+        detected = devices.detect_kind(folder) or "unknown"
+        ttk.Label(frame, text=f"{folder} (detected: {detected})").grid(row=row, column=0, sticky=tk.W, padx=(0, 10))
+        kind_var = tk.StringVar(value=kind)
+        ttk.Combobox(frame, values=devices.DEVICE_KINDS, width=6, state="readonly", textvariable=kind_var).grid(row=row, column=1, padx=5)
+        readers_var = tk.IntVar(value=readers or 0)
+        ttk.Spinbox(frame, from_=0, to=64, width=4, textvariable=readers_var).grid(row=row, column=2, padx=5)
+        choices.append((folder, kind_var, readers_var))
+
+    def save():
+        try:
+            for folder, kind_var, readers_var in choices:
+                try:
+                    readers = max(0, int(readers_var.get()))
+                except (tk.TclError, ValueError):
+                    readers = 0
+                devices.set_folder(folder, kind_var.get(), readers or None)
+        except OSError as exc:
+            messagebox.showerror("Error", f"Failed to save disk settings: {exc}", parent=dialog)
+            return
+        dialog.destroy()
+
+    buttons = ttk.Frame(frame)
+    buttons.grid(row=len(folders) + 1, column=0, columnspan=3, sticky=tk.E, pady=(10, 0))
+    ttk.Button(buttons, text="Cancel", command=dialog.destroy).pack(side=tk.RIGHT, padx=5)
+    ttk.Button(buttons, text="Save", command=save).pack(side=tk.RIGHT, padx=5)
+
+
+def get_hash_workers():
+    """Number of files hashed concurrently, as chosen in the GUI."""
+    if workers_var is None:
+        return DEFAULT_WORKERS
+    try:
+        return max(1, int(workers_var.get()))
+    except (tk.TclError, ValueError):
+        return DEFAULT_WORKERS
+
+
+def set_hash_method(*args):
+    """Save the selected hashing backend as the override of the calibrated one."""
+    try:
+        calibration.set_override(hash_method_var.get())
+    except OSError as exc:
+        messagebox.showerror("Error", f"Failed to save hashing backend: {exc}")
+
+
+def _format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
 
+def _bytes_summary(result):
+    """Megabytes read by a comparison, and those served by the hash cache."""
+    text = f"{result.bytes_read / (1024 * 1024):.1f} MB read"
+    if result.bytes_cached:
+        text += f", {result.bytes_cached / (1024 * 1024):.1f} MB from the hash cache"
+    return text
 
-def scan_files(base_folder):
-    """Recursively scan all files inside a folder."""
-    file_dict = {}
-    for root_dir, _, files in os.walk(base_folder):
-        for filename in files:
-            full_path = os.path.join(root_dir, filename)
-            rel_path = os.path.relpath(full_path, base_folder)
-            file_dict[rel_path] = full_path
-    return file_dict
+
+def _show_progress(stage, done, total):
+    """Progress callback for background tasks; runs on the Tk thread.
+
+    While files are read the bar and the ETA follow bytes, not file counts,
+    so a few large files do not make the estimate jump.
+    """
+    text = f"{stage}: {done}/{total}" if total else f"{stage}: {done}"
+    fraction = done / total if total else 0
+    run = run_telemetry
+    if run is not None and run.files_done:
+        files_per_second, bytes_per_second = run.rates()
+        text += f" - {bytes_per_second / (1024 * 1024):.1f} MB/s, {files_per_second:.0f} files/s"
+        if stage in _READ_STAGES and run.bytes_total:
+            fraction = run.bytes_done / run.bytes_total
+            eta = run.eta()
+            if eta is not None:
+                text += f", ETA {_format_duration(eta)}"
+    if checkpoint_warning:
+        text += f" ({checkpoint_warning})"
+    progress_var.set(int(100 * fraction))
+    progress_label.config(text=text)
+
+
+def _update_action_buttons():
+    """Enable the buttons that make sense for the current state."""
+    busy = current_task is not None
+    idle_state = tk.DISABLED if busy else tk.NORMAL
+    for button in (prepare_button, watch_button, save_button, load_button, load_index_button, save_index_button):
+        if button is not None:
+            button.config(state=idle_state)
+    if resume_button is not None:
+        resume_button.config(state=tk.NORMAL if os.path.exists(CHECKPOINT_PATH) and not busy else tk.DISABLED)
+    delete_button.config(state=tk.NORMAL if delete_plan and not busy and not unverified_plan else tk.DISABLED)
+    move_mismatch_button.config(state=tk.NORMAL if move_mismatch_plan and not busy else tk.DISABLED)
+    move_new_button.config(state=tk.NORMAL if move_new_plan and not busy else tk.DISABLED)
+    if link_button is not None:
+        link_button.config(state=tk.NORMAL if link_plan and not busy and not unverified_plan else tk.DISABLED)
+    if cancel_button is not None:
+        cancel_button.config(state=tk.NORMAL if busy else tk.DISABLED)
+    if pause_button is not None:
+        pause_button.config(state=tk.NORMAL if busy else tk.DISABLED, text="Pause")
+    if timing_button is not None:
+        timing_button.config(state=tk.NORMAL if run_telemetry is not None and not busy else tk.DISABLED)
+
+
+def _start_task(work, on_done, on_cancel=None, phase=None, telemetry=None):
+    """Run ``work(task)`` on a worker thread; ``on_done(result)`` runs on the Tk thread.
+
+    The run is timed by ``telemetry`` (a new RunTelemetry by default), with
+    the whole of ``work`` counted as ``phase`` if one is given.
+    """
+    global current_task, run_telemetry
+    run = run_telemetry = telemetry or RunTelemetry()
+    if phase is not None:
+        timed = work
+
+        def work(task):
+            with run.phase(phase):
+                return timed(task)
+
+    def finish(handler):
+        def finished(*args):
+            global current_task
+            current_task = None
+            _update_action_buttons()
+            handler(*args)
+            run.finish()
+        return finished
+
+    def show_error(exc):
+        progress_label.config(text="Failed")
+        messagebox.showerror("Error", f"Operation failed: {exc}")
+
+    def show_cancelled():
+        progress_label.config(text="Cancelled")
+
+    current_task = BackgroundTask(
+        root,
+        work,
+        on_done=finish(on_done),
+        on_progress=_show_progress,
+        on_error=finish(show_error),
+        on_cancel=finish(on_cancel or show_cancelled),
+    )
+    _update_action_buttons()
+    current_task.start()
+
+
+def cancel_task():
+    """Cancel the running background task."""
+    if current_task is not None:
+        current_task.cancel()
+        progress_label.config(text="Cancelling...")
+
+
+def toggle_pause():
+    """Pause or resume the running background task."""
+    if current_task is None:
+        return
+    if current_task.paused:
+        current_task.resume()
+        pause_button.config(text="Pause")
+    else:
+        current_task.pause()
+        pause_button.config(text="Resume")
+        progress_label.config(text="Paused")
+
+
+def _start_comparison(on_done, preserve_files=None, cleanup_files=None, previous=None, carried=()):
+    """Run a comparison with the GUI's settings in the background.
+
+    The settings are read here, on the Tk thread. Folders are walked by the
+    worker, hashing as it goes, when no file maps are given. Progress is
+    checkpointed to CHECKPOINT_PATH for resume_comparison; comparing known
+    files again extends the checkpoint, with the ``carried`` paths whose
+    digests ``previous`` took over.
+    """
+    global checkpoint_warning
+    if not _prepare_hashing():
+        return
+    checkpoint_warning = None
+    workers = get_hash_workers()
+    prefilter = prefilter_var is not None and prefilter_var.get()
+    folders = preserve_folder, list(cleanup_folders)
+    manifest = _active_manifest()
+    run = RunTelemetry()
+
+    def work(task):
+        calibration.ensure_calibrated([folders[0], *folders[1]])
+        devices.apply([folders[0], *folders[1]])
+        try:
+            if preserve_files is None:
+                checkpoint = Checkpoint.create(folders[0], folders[1], previous)
+            else:
+                checkpoint = Checkpoint.extend(folders[0], folders[1], previous, carried)
+        except OSError as exc:
+            task.post(_checkpoint_failed, exc)
+            checkpoint = None
+        try:
+            if preserve_files is None:
+                return compare_trees(
+                    folders[0],
+                    folders[1],
+                    workers=workers,
+                    progress=task.report,
+                    manifest=manifest,
+                    telemetry=run,
+                    previous=previous,
+                    checkpoint=checkpoint,
+                    prefilter=prefilter,
+                )
+            return compare_folders(
+                folders[0],
+                preserve_files,
+                cleanup_files,
+                workers=workers,
+                progress=task.report,
+                previous=previous,
+                telemetry=run,
+                checkpoint=checkpoint,
+                labels=previous.labels,
+                prefilter=prefilter,
+                roots=previous.roots,
+            )
+        finally:
+            hash_cache.flush()
+
+    _start_task(work, on_done, telemetry=run)
+
+
+def _checkpoint_failed(exc):
+    global checkpoint_warning
+    checkpoint_warning = f"no checkpoint: {exc}"
+    progress_label.config(text=f"Could not create checkpoint: {exc}")
+
+
+def apply_result(result):
+    """Show a comparison result; unchanged rows keep their table records."""
+    global comparison_result
+    if run_telemetry is not None:
+        with run_telemetry.phase("table"):
+            table.set_rows(result.rows.items())
+    else:
+        table.set_rows(result.rows.items())
+
+    comparison_result = result
+    _set_plans((result.delete_plan, result.move_mismatch_plan, result.move_new_plan, result.link_plan))
+    file_hashes.clear()
+    file_hashes.update(result.file_hashes)
+
+    total_files = sum(len(files) for files in result.files.values())
+    progress_var.set(100)
+    text = f"Completed: {total_files} files, {_bytes_summary(result)}"
+    if run_telemetry is not None:
+        text += f" in {_format_duration(time.monotonic() - run_telemetry.started)}"
+    if checkpoint_warning:
+        text += f" ({checkpoint_warning})"
+    progress_label.config(text=text)
+    _update_action_buttons()
+
+
+def _close_disk_index():
+    """Let go of the disk index the table was showing, if any."""
+    global disk_result, unverified_plan
+    unverified_plan = False
+    if disk_result is not None:
+        table.clear()
+        disk_result.close()
+        disk_result = None
 
 
 def prepare_comparison():
     """Prepare comparison between Preserve and Cleanup folder."""
-    if not preserve_folder or not cleanup_folder:
+    global comparison_result
+    if not preserve_folder or not cleanup_folders:
         messagebox.showwarning("Folders Not Selected", "Please select both folders.")
         return
 
-    for item in tree.get_children():
-        tree.delete(item)
-    delete_plan.clear()
-    move_mismatch_plan.clear()
-    move_new_plan.clear()
+    _close_disk_index()
+    table.clear()
+    comparison_result = None
+    _set_plans()
     file_hashes.clear()
 
-    preserve_files = scan_files(preserve_folder)
-    cleanup_files = scan_files(cleanup_folder)
+    progress_var.set(0)
+    progress_label.config(text="Scanning: 0")
+    if disk_index_var is not None and disk_index_var.get():
+        _start_disk_comparison()
+    else:
+        _start_comparison(_comparison_ready)
 
-    total_files = len(preserve_files) + len(cleanup_files)
-    files_processed = 0
 
-    progress_var.set(0)
-    progress_label.config(text=f"Building hash tables: 0/{total_files}")
-    root.update()
+def _start_disk_comparison():
+    """Run a comparison that keeps its index, plans and rows in an SQLite file.
 
-    preserve_hashes = {}
-    preserve_path_to_hash = {}
+    The table pages its rows in from the index. Plans are read from it once
+    the comparison is done, and again after they were carried out; see
+    DiskIndex.record_executed.
+    """
+    if not _prepare_hashing():
+        return
+    workers = get_hash_workers()
+    folders = preserve_folder, list(cleanup_folders)
+    manifest = _active_manifest()
+    run = RunTelemetry()
 
-    for index, (rel_path, preserve_fullpath) in enumerate(preserve_files.items(), 1):
-        files_processed += 1
-        progress_var.set(int(100 * files_processed / total_files))
-        progress_label.config(text=f"Hashing preserve: {index}/{len(preserve_files)}")
+    def work(task):
+        calibration.ensure_calibrated([folders[0], *folders[1]])
+        devices.apply([folders[0], *folders[1]])
+        try:
+            index = compare_on_disk(folders[0], folders[1], workers=workers, progress=task.report, manifest=manifest, telemetry=run)
+        finally:
+            hash_cache.flush()
+        # Counted here, off the Tk thread.
+        plans = index.delete_plan, index.move_mismatch_plan, index.move_new_plan, index.link_plan
+        return index, plans
 
-        if index % 5 == 0:
-            root.update()
+    _start_task(work, _disk_comparison_ready, telemetry=run)
 
-        hash_value = calculate_sha256(preserve_fullpath)
-        if not hash_value:
-            continue
-        if hash_value not in preserve_hashes:
-            preserve_hashes[hash_value] = []
-        preserve_hashes[hash_value].append(rel_path)
-        preserve_path_to_hash[rel_path] = hash_value
-        file_hashes[rel_path] = hash_value
-        tree.insert("", "end", values=(rel_path, hash_value, "Reference Copy"))
-
-    for index, (rel_path, cleanup_fullpath) in enumerate(cleanup_files.items(), 1):
-        files_processed += 1
-        progress_var.set(int(100 * files_processed / total_files))
-        progress_label.config(text=f"Processing cleanup: {index}/{len(cleanup_files)}")
-
-        if index % 5 == 0:
-            root.update()
-
-        hash_value = calculate_sha256(cleanup_fullpath)
-        if not hash_value:
-            continue
-        file_hashes[rel_path] = hash_value
 
-        if hash_value in preserve_hashes:
-            delete_plan.append(cleanup_fullpath)
-            matching_preserve_paths = preserve_hashes[hash_value]
-            tree.insert("", "end", values=(rel_path, hash_value, f"Delete (duplicate of {matching_preserve_paths[0]})"))
-        else:
-            if rel_path in preserve_path_to_hash:
-                new_rel_path = add_prime_to_filename(rel_path)
-                move_mismatch_plan.append((cleanup_fullpath, os.path.join(preserve_folder, new_rel_path)))
-                tree.insert("", "end", values=(rel_path, hash_value, "MOVE WITH RENAME (path exists but content differs)"))
-            else:
-                move_new_plan.append((cleanup_fullpath, os.path.join(preserve_folder, rel_path)))
-                tree.insert("", "end", values=(rel_path, hash_value, "MOVE - New file to preserve folder"))
+def _disk_comparison_ready(outcome):
+    global disk_result
+    disk_result, plans = outcome
+    table.set_source(disk_result)
+    _set_plans(plans)
 
     progress_var.set(100)
-    progress_label.config(text=f"Completed: {files_processed}/{total_files}")
+    text = f"Completed: {disk_result.count()} files, {_bytes_summary(disk_result)}"
+    if run_telemetry is not None:
+        text += f" in {_format_duration(time.monotonic() - run_telemetry.started)}"
+    progress_label.config(text=text)
+    _update_action_buttons()
+    messagebox.showinfo(
+        "Comparison Ready",
+        f"Ready to process:\n"
+        f"• {len(delete_plan)} files to delete (content exists in preserve)\n"
+        f"• {len(move_mismatch_plan)} files to rename and move\n"
+        f"• {len(move_new_plan)} new files to move\n"
+        f"• {disk_result.count(side='preserve')} reference files in preserve folder"
+    )
 
-    delete_button.config(state=tk.NORMAL if delete_plan else tk.DISABLED)
-    move_mismatch_button.config(state=tk.NORMAL if move_mismatch_plan else tk.DISABLED)
-    move_new_button.config(state=tk.NORMAL if move_new_plan else tk.DISABLED)
 
+def _comparison_ready(result):
+    apply_result(result)
     messagebox.showinfo(
         "Comparison Ready",
         f"Ready to process:\n"
         f"• {len(delete_plan)} files to delete (content exists in preserve)\n"
         f"• {len(move_mismatch_plan)} files to rename and move\n"
         f"• {len(move_new_plan)} new files to move\n"
-        f"• {len(preserve_files)} reference files in preserve folder"
+        f"• {len(result.files['preserve'])} reference files in preserve folder"
+    )
+
+
+def resume_comparison():
+    """Compare the folders of the last checkpoint again, reusing its hashes.
+
+    Rows that were final are shown straight away; only files not hashed
+    before, or changed since, are read. The plans are rebuilt when the
+    comparison completes.
+    """
+    global preserve_folder, comparison_result
+    try:
+        checkpoint = load_checkpoint()
+    except (OSError, ValueError) as exc:
+        messagebox.showerror("Error", f"Failed to load checkpoint: {exc}")
+        return
+    if checkpoint is None:
+        messagebox.showwarning("No Checkpoint", "There is no comparison to resume.")
+        return
+
+    preserve_folder = checkpoint.preserve_folder
+    cleanup_folders[:] = checkpoint.cleanup_folders
+    _show_preserve_folder()
+    _show_cleanup_folders()
+
+    _close_disk_index()
+    table.set_rows(checkpoint.rows.items())
+    comparison_result = None
+    _set_plans()
+    file_hashes.clear()
+
+    progress_var.set(0)
+    progress_label.config(text="Scanning: 0")
+    _start_comparison(_comparison_ready, previous=checkpoint.previous)
+
+
+def watch_folders():
+    """Keep the comparison current while files arrive, until cancelled.
+
+    Only new, changed and removed files are looked at again. With
+    "Auto-execute" checked, the delete and move plans are carried out once
+    nothing has changed for QUIET_PERIOD seconds.
+    """
+    global comparison_result, checkpoint_warning
+    if not preserve_folder or not cleanup_folders:
+        messagebox.showwarning("Folders Not Selected", "Please select both folders.")
+        return
+    if not _prepare_hashing():
+        return
+    auto_execute = auto_execute_var is not None and auto_execute_var.get()
+    watcher = Watch(
+        preserve_folder,
+        list(cleanup_folders),
+        workers=get_hash_workers(),
+        prefilter=prefilter_var is not None and prefilter_var.get(),
+        actions=WATCH_ACTIONS if auto_execute else (),
     )
 
+    def work(task):
+        calibration.ensure_calibrated(list(watcher.roots.values()))
+        devices.apply(list(watcher.roots.values()))
+        try:
+            watcher.run(
+                on_update=lambda result, changes: task.post(_watch_updated, result, changes),
+                progress=task.report,
+                check=task.check,
+                on_executed=lambda action, done, failed: task.post(_watch_executed, action, done, failed),
+                on_message=lambda text: task.post(_watch_message, text),
+            )
+        finally:
+            hash_cache.flush()
+
+    def stopped():
+        progress_label.config(text="Stopped watching")
+
+    _close_disk_index()
+    table.clear()
+    comparison_result = None
+    checkpoint_warning = None
+    _set_plans()
+    file_hashes.clear()
+    progress_var.set(0)
+    progress_label.config(text="Scanning: 0")
+    _start_task(work, lambda result: None, on_cancel=stopped)
+
 
-def add_prime_to_filename(path):
-    """Add prime (') before file extension."""
-    dir_name, filename = os.path.split(path)
-    if '.' in filename:
-        name, ext = os.path.splitext(filename)
-        new_filename = name + "'" + ext
+def _watch_updated(result, changes):
+    """Show a watch update; with ``changes``, only those rows are touched."""
+    global comparison_result
+    if changes is None:
+        apply_result(result)
     else:
-        new_filename = filename + "'"
-    return os.path.join(dir_name, new_filename)
+        table.update_rows(changes)
+        comparison_result = result
+        _set_plans((result.delete_plan, result.move_mismatch_plan, result.move_new_plan, result.link_plan))
+        file_hashes.clear()
+        file_hashes.update(result.file_hashes)
+        progress_var.set(100)
+        _update_action_buttons()
+    text = (
+        f"Watching: {len(delete_plan)} to delete, {len(move_mismatch_plan)} to rename and move, "
+        f"{len(move_new_plan)} new to move"
+    )
+    if auto_execute_var is not None and auto_execute_var.get():
+        text += f" - carried out after {QUIET_PERIOD:g}s without changes"
+    progress_label.config(text=text)
+
+
+def _watch_message(text):
+    progress_label.config(text=text)
+
+
+def _watch_executed(action, done, failed):
+    text = f"{action}: {len(done)} files done"
+    if failed:
+        text += f", {failed} failed"
+    progress_label.config(text=text)
+
+
+def refresh_comparison(deleted=(), moved=(), linked=()):
+    """Update plans and table in place after files were deleted, moved or linked.
+
+    Neither folder is walked again: deleted files are dropped, moved files
+    are re-rooted into the preserve folder with their known hashes, linked
+    files keep theirs, and only files whose stat changed since the last
+    comparison are read. A disk index updates the rows of those files.
+    """
+    if disk_result is not None:
+        _refresh_disk_index(deleted, moved, linked)
+        return
+    previous = comparison_result
+    if previous is None:
+        prepare_comparison()
+        return
+
+    preserve_files = dict(previous.files["preserve"])
+    cleanup_files = {side: dict(previous.files[side]) for side in previous.labels}
+    cleanup_keys = {
+        full_path: (side, rel_path)
+        for side, files in cleanup_files.items()
+        for rel_path, full_path in files.items()
+    }
+
+    for full_path in deleted:
+        key = cleanup_keys.get(full_path)
+        if key is not None:
+            del cleanup_files[key[0]][key[1]]
+
+    for src, dst in moved:
+        key = cleanup_keys.get(src)
+        if key is None:
+            continue
+        del cleanup_files[key[0]][key[1]]
+        new_rel_path = os.path.relpath(dst, preserve_folder)
+        preserve_files[new_rel_path] = dst
+        previous.carry_over(src, dst)
+
+    for path, _ in linked:
+        previous.carry_over(path, path)
+
+    carried = [dst for _, dst in moved] + [path for path, _ in linked]
+    _start_comparison(apply_result, preserve_files, cleanup_files, previous, carried)
+
+
+def _refresh_disk_index(deleted, moved, linked):
+    index = disk_result
+
+    def work(task):
+        # Its own connection, as the table keeps reading through the other.
+        db = index.connect()
+        try:
+            index.record_executed(deleted, moved, linked, db=db)
+            return tuple(DiskPlan(index, decision, db) for decision in ("delete", "mismatch", "new", "link"))
+        finally:
+            db.close()
+
+    def done(plans):
+        if disk_result is not index:
+            return
+        table.set_source(index)
+        _set_plans(plans)
+        progress_label.config(text=f"Updated: {index.count()} files")
+        _update_action_buttons()
+
+    _start_task(work, done)
 
 
 def execute_delete():
@@ -161,25 +774,42 @@ def execute_delete():
         messagebox.showwarning("Nothing to Delete", "No identical files to delete.")
         return
 
-    errors = 0
-    for idx, filepath in enumerate(delete_plan):
-        try:
-            progress_var.set(int(100 * (idx + 1) / len(delete_plan)))
-            progress_label.config(text=f"Deleting: {idx+1}/{len(delete_plan)}")
-            if idx % 5 == 0:
-                root.update()
-            os.remove(filepath)
-        except Exception as e:
-            errors += 1
-            print(f"Error deleting {filepath}: {str(e)}")
+    def done(outcome):
+        deleted, errors, cancelled = outcome
+        progress_var.set(100)
+        result_msg = f"Deleted {len(deleted)} identical files."
+        if errors:
+            result_msg += f"\n{errors} files could not be deleted due to errors."
+        if cancelled:
+            result_msg += "\nCancelled before all files were processed."
 
-    progress_var.set(100)
-    result_msg = f"Deleted {len(delete_plan) - errors} identical files."
-    if errors:
-        result_msg += f"\n{errors} files could not be deleted due to errors."
+        messagebox.showinfo("Delete Operation Completed", result_msg)
+        refresh_comparison(deleted=deleted)
 
-    messagebox.showinfo("Delete Operation Completed", result_msg)
-    prepare_comparison()
+    paths = delete_plan
+    _start_task(lambda task: delete_files(paths, task.report), done, phase="delete")
+
+
+def execute_link():
+    """Replace identical files in the cleanup folder by links to their preserve copy."""
+    if not link_plan:
+        messagebox.showwarning("Nothing to Link", "No identical files to link.")
+        return
+
+    def done(outcome):
+        linked, errors, cancelled = outcome
+        progress_var.set(100)
+        result_msg = f"Linked {len(linked)} identical files."
+        if errors:
+            result_msg += f"\n{errors} files could not be linked due to errors."
+        if cancelled:
+            result_msg += "\nCancelled before all files were processed."
+
+        messagebox.showinfo("Link Operation Completed", result_msg)
+        refresh_comparison(linked=linked)
+
+    links = link_plan
+    _start_task(lambda task: link_files(links, task.report), done, phase="link")
 
 
 def execute_move_mismatch():
@@ -188,28 +818,20 @@ def execute_move_mismatch():
         messagebox.showwarning("Nothing to Move", "No mismatched files to move.")
         return
 
-    errors = 0
-    for idx, (src, dst) in enumerate(move_mismatch_plan):
-        try:
-            progress_var.set(int(100 * (idx + 1) / len(move_mismatch_plan)))
-            progress_label.config(text=f"Moving mismatched: {idx+1}/{len(move_mismatch_plan)}")
-            if idx % 5 == 0:
-                root.update()
-            dst_folder = os.path.dirname(dst)
-            if not os.path.exists(dst_folder):
-                os.makedirs(dst_folder, exist_ok=True)
-            shutil.move(src, dst)
-        except Exception as e:
-            errors += 1
-            print(f"Error moving {src}: {str(e)}")
+    def done(outcome):
+        moved, errors, cancelled = outcome
+        progress_var.set(100)
+        result_msg = f"Moved {len(moved)} mismatched files with rename."
+        if errors:
+            result_msg += f"\n{errors} files could not be moved due to errors."
+        if cancelled:
+            result_msg += "\nCancelled before all files were processed."
 
-    progress_var.set(100)
-    result_msg = f"Moved {len(move_mismatch_plan) - errors} mismatched files with rename."
-    if errors:
-        result_msg += f"\n{errors} files could not be moved due to errors."
+        messagebox.showinfo("Move Mismatch Operation Completed", result_msg)
+        refresh_comparison(moved=moved)
 
-    messagebox.showinfo("Move Mismatch Operation Completed", result_msg)
-    prepare_comparison()
+    moves = move_mismatch_plan
+    _start_task(lambda task: move_files(moves, "Moving mismatched", task.report), done, phase="move")
 
 
 def execute_move_new():
@@ -218,118 +840,235 @@ def execute_move_new():
         messagebox.showwarning("Nothing to Move", "No new files to move.")
         return
 
-    errors = 0
-    for idx, (src, dst) in enumerate(move_new_plan):
-        try:
-            progress_var.set(int(100 * (idx + 1) / len(move_new_plan)))
-            progress_label.config(text=f"Moving new: {idx+1}/{len(move_new_plan)}")
-            if idx % 5 == 0:
-                root.update()
-            dst_folder = os.path.dirname(dst)
-            if not os.path.exists(dst_folder):
-                os.makedirs(dst_folder, exist_ok=True)
-            shutil.move(src, dst)
-        except Exception as e:
-            errors += 1
-            print(f"Error moving {src}: {str(e)}")
+    def done(outcome):
+        moved, errors, cancelled = outcome
+        progress_var.set(100)
+        result_msg = f"Moved {len(moved)} new files."
+        if errors:
+            result_msg += f"\n{errors} files could not be moved due to errors."
+        if cancelled:
+            result_msg += "\nCancelled before all files were processed."
 
-    progress_var.set(100)
-    result_msg = f"Moved {len(move_new_plan) - errors} new files."
-    if errors:
-        result_msg += f"\n{errors} files could not be moved due to errors."
+        messagebox.showinfo("Move New Operation Completed", result_msg)
+        refresh_comparison(moved=moved)
 
-    messagebox.showinfo("Move New Operation Completed", result_msg)
-    prepare_comparison()
+    moves = move_new_plan
+    _start_task(lambda task: move_files(moves, "Moving new", task.report), done, phase="move")
 
 
-def sort_by_column(column):
-    """Sort treeview content when a column header is clicked."""
-    global sort_column, sort_reverse
+def check_interrupted_runs():
+    """Offer to resume or roll back delete/move runs that did not finish."""
+    journals = interrupted_journals()
+    if not journals or current_task is not None:
+        return
 
-    if sort_column == column:
-        sort_reverse = not sort_reverse
-    else:
-        sort_column = column
-        sort_reverse = False
-
-    item_list = [(
-        tree.set(item, "Path"),
-        tree.set(item, "SHA256"),
-        tree.set(item, "Action"),
-        item
-    ) for item in tree.get_children("")]
-
-    if column == "Path":
-        item_list.sort(key=lambda x: os.path.basename(x[0].lower()), reverse=sort_reverse)
-    elif column == "SHA256":
-        item_list.sort(key=lambda x: x[1].lower(), reverse=sort_reverse)
-    else:
-        item_list.sort(key=lambda x: x[2].lower(), reverse=sort_reverse)
+    resume = messagebox.askyesnocancel(
+        "Interrupted Operation",
+        f"{len(journals)} delete or move operation(s) did not finish.\n"
+        "Yes: resume them\nNo: move the files back\nCancel: decide later",
+    )
+    if resume is None:
+        return
+    handler = resume_journal if resume else rollback_journal
+
+    def work(task):
+        entries = []
+        errors = 0
+        for path in journals:
+            done, failed, cancelled = handler(path, task.report)
+            entries.extend(done)
+            errors += failed
+            if cancelled:
+                return entries, errors, True
+        return entries, errors, False
 
-    for index, (path, sha256, action, item) in enumerate(item_list):
-        tree.move(item, "", index)
+    def done(outcome):
+        entries, errors, cancelled = outcome
+        progress_var.set(100)
+        result_msg = f"{'Completed' if resume else 'Rolled back'} {len(entries)} file operations."
+        if errors:
+            result_msg += f"\n{errors} files could not be processed due to errors."
+        if cancelled:
+            result_msg += "\nCancelled before all files were processed."
 
-    for col in ["Path", "SHA256", "Action"]:
-        if col == column:
-            direction = "▼" if sort_reverse else "▲"
-            tree.heading(col, text=f"{col} {direction}")
+        messagebox.showinfo("Interrupted Operation", result_msg)
+        if comparison_result is None:
+            return
+        if resume:
+            refresh_comparison(
+                deleted=[src for op, src, _ in entries if op == "delete"],
+                moved=[(src, dst) for op, src, dst in entries if op == "move"],
+                linked=[(src, dst) for op, src, dst in entries if op == "link"],
+            )
         else:
-            tree.heading(col, text=col)
+            prepare_comparison()
+
+    _start_task(work, done)
+
+
+def sort_by_column(column):
+    """Sort the table when a column header is clicked."""
+    table.sort_by(column)
+
+
+def filter_rows(text):
+    """Show only rows containing ``text``."""
+    table.set_filter(text)
 
 
 def save_csv():
-    """Save the current tree contents to a CSV file."""
-    if not tree.get_children():
+    """Save every row of the table, with their plans, to a CSV file.
+
+    The folder roots, stats and plans are saved too, so load_csv can restore
+    a comparison that can be carried out; rows are written in the table's
+    sort order, but not filtered, so no duplicate loses its preserve row.
+    Rows are streamed to the file on a worker thread; a name ending in
+    ".gz" is gzip-compressed.
+    """
+    if not len(table):
         messagebox.showwarning("No Data", "There is no data to save.")
         return
 
     file_path = filedialog.asksaveasfilename(
         title="Save CSV",
         defaultextension=".csv",
-        filetypes=[("CSV Files", "*.csv")],
+        filetypes=[("CSV Files", "*.csv"), ("Compressed CSV Files", "*.csv.gz")],
     )
     if not file_path:
         return
 
-    try:
-        with open(file_path, "w", newline="", encoding="utf-8") as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(["Path", "SHA256", "Action"])
-            for item in tree.get_children():
-                writer.writerow(tree.item(item)["values"])
+    index = disk_result
+    result = comparison_result
+    rows = table.sorted_rows()
+    sort = table.sort_column, table.sort_reverse
+
+    def work(task):
+        if index is None:
+            roots = list(result.roots.items()) if result is not None else []
+            return write_plan(file_path, roots, result_records(result, rows), task.report)
+        # Its own connection, as the table keeps reading through the other.
+        db = index.connect()
+        try:
+            index_rows = index.rows(*sort, db=db)
+            if not index.preserve_folder:
+                return write_plan(file_path, [], result_records(None, index_rows), task.report)
+            return write_plan(file_path, list(index.roots.items()), index_records(index_rows), task.report)
+        finally:
+            db.close()
+
+    def done(written):
+        progress_label.config(text=f"Saved {written} rows")
         messagebox.showinfo("Save Completed", f"Data saved to {file_path}")
+
+    progress_label.config(text="Saving: 0")
+    _start_task(work, done, phase="save")
+
+
+def save_timing_report():
+    """Save the timing report of the last run as JSON."""
+    if run_telemetry is None:
+        messagebox.showwarning("No Data", "There is no run to report on.")
+        return
+
+    file_path = filedialog.asksaveasfilename(
+        title="Save Timing Report",
+        defaultextension=".json",
+        filetypes=[("JSON Files", "*.json")],
+    )
+    if not file_path:
+        return
+
+    try:
+        with open(file_path, "w", encoding="utf-8") as report_file:
+            json.dump(run_telemetry.report(), report_file, indent=2)
+        messagebox.showinfo("Save Completed", f"Timing report saved to {file_path}")
     except Exception as exc:
-        messagebox.showerror("Error", f"Failed to save CSV: {exc}")
+        messagebox.showerror("Error", f"Failed to save timing report: {exc}")
 
 
 def load_csv():
-    """Load tree contents from a CSV file."""
+    """Load a CSV file saved by save_csv and restore its folders and plans.
+
+    The rows go into the disk index, so the file is never held in memory.
+    Optionally every file is stat'ed first, and only those that changed
+    since the file was saved are read again; see plan_file.verify_plan.
+    Without that check, the delete and link plans are shown but cannot be
+    carried out.
+    """
+    global comparison_result
     file_path = filedialog.askopenfilename(
         title="Load CSV",
-        filetypes=[("CSV Files", "*.csv")],
+        filetypes=[("CSV Files", "*.csv *.csv.gz"), ("All Files", "*.*")],
     )
     if not file_path:
         return
+    verify = messagebox.askyesno(
+        "Check Files",
+        "Check the files against the folders before restoring the plans?\n\n"
+        "Files changed since the CSV was saved are read again; plans are dropped "
+        "for files that are gone or no longer match.\n\n"
+        "Without the check, files cannot be deleted or linked from the loaded plan.",
+    )
 
-    try:
-        for item in tree.get_children():
-            tree.delete(item)
-        delete_plan.clear()
-        move_mismatch_plan.clear()
-        move_new_plan.clear()
-        file_hashes.clear()
+    if verify and not _prepare_hashing():
+        return
 
-        with open(file_path, newline="", encoding="utf-8") as csvfile:
-            reader = csv.reader(csvfile)
-            header = next(reader, None)
-            for row in reader:
-                if len(row) >= 3:
-                    tree.insert("", "end", values=(row[0], row[1], row[2]))
-        delete_button.config(state=tk.DISABLED)
-        move_mismatch_button.config(state=tk.DISABLED)
-        move_new_button.config(state=tk.DISABLED)
-        progress_var.set(0)
-        progress_label.config(text="")
-        messagebox.showinfo("Load Completed", f"Data loaded from {file_path}")
-    except Exception as exc:
-        messagebox.showerror("Error", f"Failed to load CSV: {exc}")
+    _close_disk_index()
+    table.clear()
+    comparison_result = None
+    _set_plans()
+    file_hashes.clear()
+    workers = get_hash_workers()
+    run = RunTelemetry()
+
+    def work(task):
+        index = load_plan(file_path, progress=task.report)
+        dropped = 0
+        try:
+            if verify and index.preserve_folder:
+                calibration.ensure_calibrated(list(index.roots.values()))
+                devices.apply(list(index.roots.values()))
+                try:
+                    dropped = verify_plan(index, workers, task.report, run)
+                finally:
+                    hash_cache.flush()
+            plans = index.delete_plan, index.move_mismatch_plan, index.move_new_plan, index.link_plan
+        except BaseException:
+            index.close()
+            raise
+        return index, plans, dropped
+
+    def done(outcome):
+        global disk_result, preserve_folder, unverified_plan
+        disk_result, plans, dropped = outcome
+        unverified_plan = bool(disk_result.preserve_folder) and not verify
+        if disk_result.preserve_folder:
+            preserve_folder = disk_result.preserve_folder
+            cleanup_folders[:] = list(disk_result.roots.values())[1:]
+            _show_preserve_folder()
+            _show_cleanup_folders()
+        table.set_source(disk_result)
+        _set_plans(plans)
+        progress_var.set(100)
+        status = f"Loaded {disk_result.count()} rows"
+        if unverified_plan:
+            status += " - not checked, Delete and Link disabled"
+        progress_label.config(text=status)
+        _update_action_buttons()
+        text = f"Data loaded from {file_path}"
+        if disk_result.preserve_folder:
+            text += (
+                f"\n\nReady to process:\n"
+                f"• {len(delete_plan)} files to delete (content exists in preserve)\n"
+                f"• {len(move_mismatch_plan)} files to rename and move\n"
+                f"• {len(move_new_plan)} new files to move"
+            )
+            if verify:
+                text += f"\n• {dropped} files changed or gone since it was saved"
+            else:
+                text += "\n\nThe files were not checked, so Delete and Link are disabled; load it again with the check to use them."
+        messagebox.showinfo("Load Completed", text)
+
+    progress_var.set(0)
+    progress_label.config(text="Loading: 0")
+    _start_task(work, done, telemetry=run)
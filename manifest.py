@@ -0,0 +1,202 @@
+"""Reusable index of a preserve folder.
+
+A manifest stores the full SHA256, the head/tail sample and the stat of
+every file below a preserve folder, so comparing many cleanup folders
+against the same preserve folder does not rehash it each time.
+
+File layout: an 8 byte magic, a length-prefixed JSON header holding the
+root and scan time, then one fixed-size record plus UTF-8 path per file,
+sorted by digest.
+"""
+
+import json
+import os
+import queue
+import struct
+import time
+
+from comparison import ComparisonResult
+from hash_pool import HashScheduler
+from scanner import scan_entries
+from sha256_tools import SAMPLE_SIZE, calculate_sample_sha256, calculate_sha256
+
+MAGIC = b"FBCIDX1\n"
+
+# digest, sample, size, mtime_ns, inode, device, path length
+_RECORD = struct.Struct("<32s32sQqQQH")
+_HEADER_LENGTH = struct.Struct("<I")
+_NO_SAMPLE = bytes(32)
+
+
+class ManifestEntry:
+    """Digest, sample and stat of one preserve file."""
+
+    __slots__ = ("device", "digest", "inode", "mtime_ns", "sample", "size")
+
+    def __init__(self, digest, sample, size, mtime_ns, inode, device):
+        self.digest = digest
+        self.sample = sample
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.inode = inode
+        self.device = device
+
+    @property
+    def stat_key(self):
+        return self.size, self.mtime_ns, self.inode
+
+
+class Manifest:
+    """Index of a preserve folder; ``entries`` maps rel_path to ManifestEntry."""
+
+    def __init__(self, root, scan_time=None, entries=None):
+        self.root = os.path.abspath(root)
+        self.scan_time = scan_time
+        self.entries = entries if entries is not None else {}
+
+    def full_path(self, rel_path):
+        return os.path.join(self.root, rel_path)
+
+    def files(self):
+        """``rel_path -> full_path`` for every indexed file, as in ComparisonResult.files."""
+        return {rel_path: self.full_path(rel_path) for rel_path in self.entries}
+
+    def as_previous(self):
+        """A ComparisonResult that lets compare_folders reuse the indexed digests.
+
+        Only files whose size, mtime and inode still match are reused; the
+        rest are read as usual.
+        """
+        result = ComparisonResult()
+        for rel_path, entry in self.entries.items():
+            full_path = self.full_path(rel_path)
+            result.stats[full_path] = entry.stat_key
+            result.digests[full_path] = entry.digest
+            if entry.sample:
+                result.samples[full_path] = entry.sample
+        return result
+
+    def save(self, path):
+        """Write the manifest; the file is replaced only once fully written."""
+        header = json.dumps({"root": self.root, "scan_time": self.scan_time, "count": len(self.entries)}).encode("utf-8")
+        partial = path + ".partial"
+        with open(partial, "wb") as handle:
+            handle.write(MAGIC)
+            handle.write(_HEADER_LENGTH.pack(len(header)))
+            handle.write(header)
+            for rel_path, entry in sorted(self.entries.items(), key=lambda item: (item[1].digest, item[0])):
+                encoded = os.fsencode(rel_path)
+                handle.write(_RECORD.pack(
+                    bytes.fromhex(entry.digest),
+                    bytes.fromhex(entry.sample) if entry.sample else _NO_SAMPLE,
+                    entry.size,
+                    entry.mtime_ns,
+                    entry.inode,
+                    entry.device,
+                    len(encoded),
+                ))
+                handle.write(encoded)
+        os.replace(partial, path)
+
+    @classmethod
+    def load(cls, path):
+        """Read a manifest; raises ValueError if the file is not a whole one."""
+        with open(path, "rb") as handle:
+            if handle.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a preserve folder manifest")
+            (length,) = _HEADER_LENGTH.unpack(_read(handle, _HEADER_LENGTH.size, path))
+            try:
+                header = json.loads(_read(handle, length, path).decode("utf-8"))
+                root, count = header["root"], header["count"]
+                if not isinstance(root, str) or not isinstance(count, int):
+                    raise TypeError("root must be a str and count an int")
+            except (ValueError, KeyError, TypeError):
+                raise ValueError(f"{path} is truncated or corrupt") from None
+            manifest = cls(root, header.get("scan_time"))
+            for _ in range(count):
+                digest, sample, size, mtime_ns, inode, device, path_length = _RECORD.unpack(_read(handle, _RECORD.size, path))
+                rel_path = os.fsdecode(_read(handle, path_length, path))
+                manifest.entries[rel_path] = ManifestEntry(
+                    digest.hex(),
+                    sample.hex() if sample != _NO_SAMPLE else None,
+                    size,
+                    mtime_ns,
+                    inode,
+                    device,
+                )
+        return manifest
+
+
+def _read(handle, size, path):
+    """Exactly ``size`` bytes of a manifest file."""
+    data = handle.read(size)
+    if len(data) != size:
+        raise ValueError(f"{path} is truncated or corrupt")
+    return data
+
+
+def build_manifest(root, workers=None, progress=None, previous=None, telemetry=None):
+    """Walk ``root`` and index every file.
+
+    Entries of a ``previous`` manifest for the same root are kept without
+    reading the file when its size, mtime and inode are unchanged; only new
+    and changed files are hashed, and hardlinks to one file only once.
+    ``progress(stage, done, total)`` is called
+    as files are found and hashed; a ``telemetry`` records the reads.
+    """
+    scan_time = time.time()
+    manifest = Manifest(root, scan_time)
+    known = previous.entries if previous is not None and previous.root == manifest.root else {}
+
+    changed = []
+    for found, entry in enumerate(scan_entries(manifest.root), 1):
+        if progress:
+            progress("Scanning", found)
+        old = known.get(entry.rel_path)
+        if old is not None and old.stat_key == entry.stat_key:
+            manifest.entries[entry.rel_path] = old
+        else:
+            changed.append(entry)
+
+    results = queue.Queue()
+    scheduler = HashScheduler(results, workers, telemetry=telemetry)
+    outstanding = 0
+    # Index of the entry actually read for each changed entry.
+    readers = {}
+    first_link = {}
+    try:
+        for index, entry in enumerate(changed):
+            physical = entry.physical_key
+            readers[index] = index if physical is None else first_link.setdefault(physical, index)
+            if readers[index] != index:
+                continue
+            scheduler.submit(("full", index), entry.full_path, calculate_sha256, entry.size, physical)
+            outstanding += 1
+            if entry.size > 2 * SAMPLE_SIZE:
+                scheduler.submit(("sample", index), entry.full_path, calculate_sample_sha256, 2 * SAMPLE_SIZE, physical)
+                outstanding += 1
+
+        total = outstanding
+        digests = {}
+        samples = {}
+        while outstanding:
+            _, (stage, index), _, digest, _ = results.get()
+            outstanding -= 1
+            (digests if stage == "full" else samples)[index] = digest
+            if progress:
+                progress("Indexing", total - outstanding, total)
+    finally:
+        scheduler.close()
+
+    for index, entry in enumerate(changed):
+        reader = readers[index]
+        if digests.get(reader):
+            manifest.entries[entry.rel_path] = ManifestEntry(
+                digests[reader],
+                samples.get(reader),
+                entry.size,
+                entry.mtime_ns,
+                entry.inode,
+                entry.device,
+            )
+    return manifest
@@ -0,0 +1,275 @@
+"""Saved comparison results that can be loaded back and carried out.
+
+A plan file is a CSV file, gzip-compressed when its name ends in ".gz".
+After the header come one "root" row per side, naming the folder it was
+read from, then one row per file: the table's Path, SHA256 and Action,
+followed by the file's side, path within that folder, size, mtime and
+inode when compared, and its plan (``reference``, ``delete``, ``copy``,
+``mismatch`` or ``new``) with the path it is a duplicate of or moves to.
+
+Both directions stream: rows are written as they are read from the table's
+source, and loaded into a disk_index.DiskIndex that the table pages from
+and the plans are read from, so neither needs memory for the whole file.
+Files saved with only the Path, SHA256 and Action columns still load, as
+rows without plans.
+
+verify_plan checks a loaded plan against the folders as they are now:
+only files whose stat changed since they were compared are read again,
+and a plan is dropped for any file that is gone or no longer matches.
+"""
+
+import csv
+import gzip
+import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+
+from comparison import cleanup_sides
+from disk_index import BATCH_ROWS, DiskIndex, hash_pass
+from hash_pool import DEFAULT_WORKERS
+
+PLAN_COLUMNS = ("Path", "SHA256", "Action", "Side", "Relative Path", "Size", "Mtime ns", "Inode", "Plan", "Target")
+
+PLANS = ("delete", "copy", "mismatch", "new")
+
+ACTION_CHANGED = "CHANGED since the plan was saved - compare again"
+ACTION_MISSING = "MISSING since the plan was saved"
+ACTION_MATCH_CHANGED = "SKIP - Preserve copy changed since the plan was saved"
+
+
+def _open(path, mode, compressed=None):
+    if compressed is None:
+        compressed = path.lower().endswith(".gz")
+    if compressed:
+        return gzip.open(path, mode + "t", newline="", encoding="utf-8")
+    return open(path, mode, newline="", encoding="utf-8")
+
+
+def _sha256(shown_hash):
+    """The SHA256 digest in a SHA256 column, or None if it holds none."""
+    shown_hash = shown_hash.removeprefix("sha256:")
+    if len(shown_hash) == 64 and all(char in "0123456789abcdef" for char in shown_hash.lower()):
+        return shown_hash.lower()
+    return None
+
+
+def _number(text):
+    return int(text) if text else None
+
+
+def result_records(result, rows):
+    """Plan file records for table ``rows`` of a ComparisonResult, in their order.
+
+    ``result`` may be None, for rows that have no comparison behind them.
+    """
+    mismatch = dict(result.move_mismatch_plan) if result is not None else {}
+    new = dict(result.move_new_plan) if result is not None else {}
+    for row in rows:
+        if result is None or row.key is None:
+            yield (*row.values, "", "", "", "", "", "", "")
+            continue
+        side, rel_path = row.key
+        full_path = result.files[side][rel_path]
+        size, mtime_ns, inode = result.stats.get(full_path, ("", "", ""))
+        plan = target = ""
+        if side == "preserve":
+            plan = "reference"
+        elif full_path in result.duplicates:
+            plan, target = "delete", result.duplicates[full_path]
+        elif full_path in mismatch:
+            plan, target = "mismatch", mismatch[full_path]
+        elif full_path in new:
+            plan, target = "new", new[full_path]
+        else:
+            plan = "copy"
+        yield (*row.values, side, rel_path, size, mtime_ns, inode, plan, target)
+
+
+def index_records(rows):
+    """Plan file records for a DiskRows view of a DiskIndex, in its order."""
+    for path, digest, action, side, rel_path, size, mtime_ns, inode, decision, target in rows.records():
+        if decision is None:
+            decision = "reference" if side == "preserve" else ""
+        yield path, digest, action, side, rel_path, size, mtime_ns, inode, decision, target or ""
+
+
+def write_plan(path, roots, records, progress=None):
+    """Write a plan file; returns the number of file rows written.
+
+    ``roots`` is ``[(side, folder), ...]`` with the preserve side first.
+    The file only replaces one at ``path`` once it is complete.
+    """
+    written = 0
+    partial = path + ".partial"
+    try:
+        with _open(partial, "w", path.lower().endswith(".gz")) as handle:
+            writer = csv.writer(handle)
+            writer.writerow(PLAN_COLUMNS)
+            for side, folder in roots:
+                writer.writerow((folder, "", "", side, "", "", "", "", "root", ""))
+            for record in records:
+                writer.writerow(record)
+                written += 1
+                if progress and written % BATCH_ROWS == 0:
+                    progress("Saving", written)
+        os.replace(partial, path)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return written
+
+
+def _read_roots(reader):
+    """``(roots, rows)``: the root rows after the header, and the rest of the reader."""
+    roots = []
+    if tuple(next(reader, ())) == PLAN_COLUMNS:
+        for row in reader:
+            if len(row) == len(PLAN_COLUMNS) and row[8] == "root":
+                roots.append((row[3], row[0]))
+                continue
+            return roots, chain([row], reader)
+    return roots, reader
+
+
+def plan_roots(path):
+    """``[(side, folder), ...]`` a plan file names, without reading its rows."""
+    with _open(path, "r") as handle:
+        return _read_roots(csv.reader(handle))[0]
+
+
+def load_plan(path, index_path=None, progress=None):
+    """Load a plan file into a DiskIndex at ``index_path``, by default one of its own.
+
+    The index's ``preserve_folder`` is "" for a file without folder roots.
+    """
+    with _open(path, "r") as handle:
+        roots, rows = _read_roots(csv.reader(handle))
+        if roots and roots[0][0] == "preserve":
+            cleanup_folders = [folder for _, folder in roots[1:]]
+            index = DiskIndex(index_path, roots[0][1], cleanup_sides(cleanup_folders), cleanup_folders)
+            sides = {side: (number, folder) for number, (side, folder) in enumerate(roots)}
+            index.add_rows(_file_rows(index, sides, rows, progress))
+        else:
+            index = DiskIndex(index_path, "", {})
+            index.add_rows(_table_rows(rows, progress))
+    index.finish()
+    return index
+
+
+def _table_rows(reader, progress):
+    """Rows of a file with only the table's columns, which have no plans."""
+    for number, row in enumerate(reader):
+        if len(row) < 3:
+            continue
+        yield 0, str(number), "", 0, None, None, None, None, None, None, None, row[0], row[1], row[2]
+        if progress and number % BATCH_ROWS == 0:
+            progress("Loading", number)
+
+
+def _file_rows(index, sides, reader, progress):
+    loaded = 0
+    for row in reader:
+        if len(row) < len(PLAN_COLUMNS):
+            continue
+        path, digest, action, side, rel_path, size, mtime_ns, inode, plan, target = row[:len(PLAN_COLUMNS)]
+        if side not in sides:
+            print(f"Skipping {path}: unknown side {side}")
+            continue
+        number, folder = sides[side]
+        decision = plan if plan in PLANS else None
+        match_path = os.path.relpath(target, index.preserve_folder) if decision == "delete" else None
+        # The device is not saved; 0 for every file keeps inodes comparable
+        # for the link plan until verify_plan stats them.
+        yield (
+            number, rel_path, os.path.join(folder, rel_path), _number(size) or 0, _number(mtime_ns), _number(inode), 0,
+            _sha256(digest), decision, match_path, target or None, path, digest, action,
+        )
+        loaded += 1
+        if progress and loaded % BATCH_ROWS == 0:
+            progress("Loading", loaded)
+
+
+def _stat(path):
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+
+def _mark(db, action, where, params=()):
+    db.execute(
+        f"UPDATE files SET decision = NULL, action = ?, action_key = ? WHERE action IS NOT NULL AND {where}",
+        (action, action.lower(), *params),
+    )
+
+
+def verify_plan(index, workers=None, progress=None, telemetry=None):
+    """Drop the plans of files that changed since a loaded plan was saved.
+
+    Every file is stat'ed, ``workers`` at a time. A file whose size, mtime
+    or inode changed is hashed again and keeps its plan only if its SHA256
+    is the same; one that was never hashed, or is gone, loses its plan, as
+    does a duplicate whose preserve copy changed. A preserve copy the plan
+    has no row for is always read again. Returns the number of files
+    marked.
+    """
+    db = index.db
+    total = db.execute("SELECT COUNT(*) FROM files WHERE action IS NOT NULL AND full_path != ''").fetchone()[0]
+    checked = 0
+    with ThreadPoolExecutor(max(1, workers or DEFAULT_WORKERS)) as pool:
+        batch = []
+        jobs = index._stream("SELECT id, full_path, size, mtime_ns, inode, digest FROM files WHERE action IS NOT NULL AND full_path != ''")
+        while True:
+            job = next(jobs, None)
+            if job is not None:
+                batch.append(job)
+                if len(batch) < BATCH_ROWS:
+                    continue
+            if not batch:
+                break
+            same, stale, changed, missing = [], [], [], []
+            for (file_id, _, size, mtime_ns, inode, digest), stat_result in zip(batch, pool.map(_stat, [row[1] for row in batch])):
+                if stat_result is None:
+                    missing.append((file_id,))
+                elif (stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino) == (size, mtime_ns, inode):
+                    same.append((stat_result.st_dev, file_id))
+                elif digest:
+                    stale.append((stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino, stat_result.st_dev, file_id))
+                else:
+                    changed.append((file_id,))
+            db.executemany("UPDATE files SET device = ? WHERE id = ?", same)
+            db.executemany("UPDATE files SET size = ?, mtime_ns = ?, inode = ?, device = ?, stale = 1 WHERE id = ?", stale)
+            for action, ids in ((ACTION_CHANGED, changed), (ACTION_MISSING, missing)):
+                db.executemany(
+                    "UPDATE files SET decision = NULL, action = ?, action_key = ? WHERE id = ?",
+                    [(action, action.lower(), file_id) for file_id, in ids],
+                )
+            db.commit()
+            checked += len(batch)
+            batch = []
+            if progress:
+                progress("Checking", checked, total)
+
+    # A plan saved without the preserve row of a duplicate, e.g. from a
+    # filtered table, has only the digest to check that copy against: add
+    # it as a file without a row and hash it again.
+    db.execute(
+        "INSERT OR IGNORE INTO files (side, rel_path, full_path, size, digest, stale) "
+        "SELECT 0, match_path, target, size, digest, 1 FROM files AS duplicate WHERE decision = 'delete' "
+        "AND NOT EXISTS (SELECT 1 FROM files WHERE side = 0 AND rel_path = duplicate.match_path)"
+    )
+    db.commit()
+    hash_pass(index, "full", "stale = 1", workers, progress, telemetry, column="checked")
+    _mark(db, ACTION_CHANGED, "stale = 1 AND IFNULL(checked, '') != digest")
+    _mark(
+        db,
+        ACTION_MATCH_CHANGED,
+        "decision = 'delete' AND match_path IN (SELECT rel_path FROM files WHERE side = 0 AND "
+        "(action IN (?, ?) OR (action IS NULL AND (digest IS NULL OR IFNULL(checked, '') != digest))))",
+        (ACTION_CHANGED, ACTION_MISSING),
+    )
+    db.commit()
+    return db.execute(
+        "SELECT COUNT(*) FROM files WHERE action IN (?, ?, ?)",
+        (ACTION_CHANGED, ACTION_MISSING, ACTION_MATCH_CHANGED),
+    ).fetchone()[0]
@@ -0,0 +1,232 @@
+"""Model-backed, virtualized results table.
+
+All rows live in a compact Python-side model; the Treeview only ever holds
+the handful of items that fit in the window. Scrolling, sorting and
+filtering work on the model and then re-render the visible slice.
+
+The model may also be a source that sorts and filters its rows itself,
+such as a disk_index.DiskIndex, so rows never need to be held in memory.
+"""
+
+import os
+from operator import attrgetter
+
+COLUMNS = ("Path", "SHA256", "Action")
+
+_SORT_KEYS = {
+    "Path": attrgetter("path_key"),
+    "SHA256": attrgetter("digest_key"),
+    "Action": attrgetter("action_key"),
+}
+
+
+class ResultRow:
+    """One table row with its sort keys computed once.
+
+    ``key`` is the ``(side, rel_path)`` the row was set under, if any.
+    """
+
+    __slots__ = ("action", "action_key", "digest", "digest_key", "key", "path", "path_key")
+
+    def __init__(self, path, digest, action, key=None):
+        self.path = path
+        self.digest = digest
+        self.action = action
+        self.key = key
+        self.path_key = os.path.basename(path.lower())
+        self.digest_key = digest.lower()
+        self.action_key = action.lower()
+
+    @property
+    def values(self):
+        return self.path, self.digest, self.action
+
+    def matches(self, text):
+        """Case-insensitive substring match against every column."""
+        return text in self.path.lower() or text in self.digest_key or text in self.action_key
+
+
+class ResultTable:
+    """Renders a window of the model into a Treeview and drives its scrollbar."""
+
+    def __init__(self, tree, scrollbar):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.rows = {}
+        self.source = None
+        self.view = []
+        self.first = 0
+        self.sort_column = None
+        self.sort_reverse = False
+        self.filter_text = ""
+        self._sorted = []
+        self._header_height = 0
+        self._row_height = None
+
+        scrollbar.config(command=self.yview)
+        tree.bind("<Configure>", lambda event: self.render())
+        tree.bind("<MouseWheel>", lambda event: self._scroll(-3 if event.delta > 0 else 3))
+        tree.bind("<Button-4>", lambda event: self._scroll(-3))
+        tree.bind("<Button-5>", lambda event: self._scroll(3))
+
+    def __len__(self):
+        if self.source is not None:
+            return len(self.source.rows())
+        return len(self.rows)
+
+    def clear(self):
+        self.rows = {}
+        self.source = None
+        self._sorted = []
+        self.view = []
+        self.first = 0
+        self.render()
+
+    def set_rows(self, rows):
+        """Replace the model with ``(key, (path, digest, action))`` pairs.
+
+        Rows whose values did not change keep their existing record.
+        """
+        previous = self.rows
+        self.rows = {}
+        self.source = None
+        for key, values in rows:
+            row = previous.get(key)
+            if row is None or row.values != tuple(values):
+                row = ResultRow(*values, key=key)
+            self.rows[key] = row
+        self._resort()
+
+    def update_rows(self, changes):
+        """Apply ``{key: (path, digest, action) or None}`` to the model.
+
+        Only the rows named are replaced or, for None, removed; the rest
+        keep their place, so sorting again is close to linear.
+        """
+        stale = set()
+        added = []
+        for key, values in changes.items():
+            row = self.rows.get(key)
+            if values is not None and row is not None and row.values == tuple(values):
+                continue
+            if row is not None:
+                stale.add(row)
+                del self.rows[key]
+            if values is not None:
+                row = self.rows[key] = ResultRow(*values, key=key)
+                added.append(row)
+        if not stale and not added:
+            return
+        self._sorted = [row for row in self._sorted if row not in stale] + added
+        if self.sort_column is not None:
+            self._sorted.sort(key=_SORT_KEYS[self.sort_column], reverse=self.sort_reverse)
+        self._refilter()
+
+    def set_source(self, source):
+        """Show the rows of ``source`` instead of a model held here.
+
+        ``source.rows(sort_column, reverse, filter_text)`` returns the view:
+        a sequence of ResultRow objects that supports ``len()`` and slicing.
+        Setting the same source again reads its rows again in place.
+        """
+        if source is not self.source:
+            self.first = 0
+        self.rows = {}
+        self._sorted = []
+        self.source = source
+        self._refilter()
+
+    def sort_by(self, column):
+        """Sort by ``column``; a second click on the same column reverses."""
+        if self.sort_column == column:
+            self.sort_reverse = not self.sort_reverse
+        else:
+            self.sort_column = column
+            self.sort_reverse = False
+        self._resort()
+
+        for col in COLUMNS:
+            if col == column:
+                direction = "▼" if self.sort_reverse else "▲"
+                self.tree.heading(col, text=f"{col} {direction}")
+            else:
+                self.tree.heading(col, text=col)
+
+    def sorted_rows(self):
+        """Every row of the model in the current sort order, whatever the filter."""
+        return self._sorted
+
+    def set_filter(self, text):
+        """Show only rows containing ``text`` in any column."""
+        self.filter_text = text.strip().lower()
+        self._refilter()
+
+    def _resort(self):
+        if self.source is not None:
+            self._refilter()
+        elif self.sort_column is None:
+            self._sorted = list(self.rows.values())
+        else:
+            self._sorted = sorted(
+                self.rows.values(),
+                key=_SORT_KEYS[self.sort_column],
+                reverse=self.sort_reverse,
+            )
+        self._refilter()
+
+    def _refilter(self):
+        if self.source is not None:
+            self.view = self.source.rows(self.sort_column, self.sort_reverse, self.filter_text)
+        elif self.filter_text:
+            self.view = [row for row in self._sorted if row.matches(self.filter_text)]
+        else:
+            self.view = self._sorted
+        self.render()
+
+    def _visible_count(self):
+        """Number of rows that fit in the Treeview's current height."""
+        height = self.tree.winfo_height()
+        items = self.tree.get_children()
+        if self._row_height is None and items:
+            bbox = self.tree.bbox(items[0])
+            if bbox:
+                self._header_height, self._row_height = bbox[1], bbox[3]
+        if self._row_height is None:
+            return max(1, height // 20)
+        return max(1, (height - self._header_height) // self._row_height)
+
+    def render(self):
+        """Materialize only the visible slice of the view."""
+        count = self._visible_count()
+        total = len(self.view)
+        self.first = max(0, min(self.first, total - count))
+        window = self.view[self.first:self.first + count]
+
+        items = self.tree.get_children()
+        for index, row in enumerate(window):
+            if index < len(items):
+                self.tree.item(items[index], values=row.values)
+            else:
+                self.tree.insert("", "end", values=row.values)
+        if len(items) > len(window):
+            self.tree.delete(*items[len(window):])
+
+        if total:
+            self.scrollbar.set(self.first / total, min(1.0, (self.first + count) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def yview(self, *args):
+        """Scrollbar command: ``moveto fraction`` or ``scroll n units|pages``."""
+        count = self._visible_count()
+        if args[0] == "moveto":
+            self.first = int(float(args[1]) * len(self.view))
+        elif args[0] == "scroll":
+            step = int(args[1])
+            self.first += step * count if args[2] == "pages" else step
+        self.render()
+
+    def _scroll(self, units):
+        # "break" keeps the Treeview's own bindings from scrolling its items.
+        self.yview("scroll", units, "units")
+        return "break"
@@ -0,0 +1,67 @@
+"""Streaming directory scanner built on os.scandir."""
+
+import os
+
+
+class FileEntry:
+    """A file found by the scanner, with the stat fields later stages need."""
+
+    __slots__ = ("device", "full_path", "inode", "mtime_ns", "rel_path", "size")
+
+    def __init__(self, rel_path, full_path, stat_result):
+        self.rel_path = rel_path
+        self.full_path = full_path
+        self.size = stat_result.st_size
+        self.mtime_ns = stat_result.st_mtime_ns
+        self.inode = stat_result.st_ino
+        self.device = stat_result.st_dev
+
+    @property
+    def stat_key(self):
+        """The fields that must match for a stored digest to be reused."""
+        return self.size, self.mtime_ns, self.inode
+
+    @property
+    def physical_key(self):
+        """``(device, inode)`` shared by all hardlinks to this file, or None if unknown."""
+        if not self.inode:
+            return None
+        return self.device, self.inode
+
+
+def scan_entries(base_folder):
+    """Yield a FileEntry for every file below ``base_folder`` as it is found.
+
+    Files are yielded in the same order as os.walk: a directory's files,
+    then each subdirectory in turn. Symlinked directories are not followed.
+    """
+    stack = [(base_folder, "")]
+    while stack:
+        folder, rel_folder = stack.pop()
+        subfolders = []
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    rel_path = os.path.join(rel_folder, entry.name) if rel_folder else entry.name
+                    try:
+                        if entry.is_dir():
+                            if not entry.is_symlink():
+                                subfolders.append((entry.path, rel_path))
+                            continue
+                        stat_result = entry.stat()
+                    except OSError as exc:
+                        print(f"Error reading {entry.path}: {exc}")
+                        continue
+                    yield FileEntry(rel_path, entry.path, stat_result)
+        except OSError as exc:
+            print(f"Error scanning {folder}: {exc}")
+        stack.extend(reversed(subfolders))
+
+
+def entries_from_files(files):
+    """Yield a FileEntry for each ``rel_path -> full_path`` item that can be stat'ed."""
+    for rel_path, full_path in files.items():
+        try:
+            yield FileEntry(rel_path, full_path, os.stat(full_path))
+        except OSError as exc:
+            print(f"Error reading {full_path}: {exc}")
@@ -1,50 +1,116 @@
 """Utilities for calculating SHA256 hashes across platforms."""
 
-from tkinter import filedialog, messagebox
+import hashlib
+import mmap
 import os
 import platform
 import re
 import shutil
 import subprocess
+import threading
+import time
 
+import hash_cache
 
-_seven_zip_exe = None
-_windows_method = None
+try:
+    import xxhash
+except ImportError:  # optional, blake2b is used instead
+    xxhash = None
 
 
-def _choose_windows_method():
-    """Ask the user which hashing method to use on Windows."""
-    global _windows_method
-    if _windows_method:
-        return _windows_method
+# Backend used by calculate_sha256: "auto" (default) for auto_method,
+# "hashlib" (in-process), "sha256sum", "shasum", "certutil", "7zip", or
+# "system" for the platform-dependent external tool selection.
+hash_method = "auto"
 
-    use_7z = messagebox.askyesno(
-        "Hashing Method",
-        "Use 7-Zip for hashing(Faster)?\nSelect No to use certutil instead.",
-    )
-    _windows_method = "7zip" if use_7z else "certutil"
-    return _windows_method
+# What "auto" stands for; set from the calibration config (calibration.py).
+auto_method = "hashlib"
+
+# Path of each external tool, looked up once by find_tool; None if missing.
+tool_paths = {}
+
+# Read size for the hashlib backend. Larger blocks mean fewer syscalls.
+BLOCK_SIZE = 1024 * 1024
+
+# Files at least this large are hashed from a memory map instead of being
+# read into a buffer; None never maps.
+MMAP_THRESHOLD = None
+
+# Tell the kernel files are read sequentially, and drop their pages from the
+# page cache once hashed so a bulk run does not evict everything else.
+FADVISE = hasattr(os, "posix_fadvise")
+
+# Bytes read from each end of a file by calculate_sample_sha256.
+SAMPLE_SIZE = 64 * 1024
+
+# Hash behind calculate_fingerprint: xxHash where the package is installed,
+# otherwise a 128-bit BLAKE2b. xxHash is many times faster than SHA256;
+# BLAKE2b only beats it on CPUs without SHA instructions.
+if xxhash is not None:
+    FINGERPRINT_ALGORITHM = "xxh3-128"
+    _new_fingerprint = xxhash.xxh3_128
+else:
+    FINGERPRINT_ALGORITHM = "blake2b-128"
+
+    def _new_fingerprint():
+        return hashlib.blake2b(digest_size=16)
+
+_buffers = threading.local()
+
+# Program names tried on the PATH for each external backend.
+_TOOL_NAMES = {
+    "sha256sum": ("sha256sum",),
+    "shasum": ("shasum",),
+    "certutil": ("certutil",),
+    "7zip": ("7z", "7za"),
+}
+
+
+def find_tool(method):
+    """Path of the tool behind ``method``, looked up once; None if missing."""
+    if method not in tool_paths:
+        path = None
+        for name in _TOOL_NAMES.get(method, ()):
+            path = shutil.which(name)
+            if path:
+                break
+        if path is None and method == "7zip" and platform.system() == "Windows":
+            for folder in (os.environ.get("ProgramFiles"), os.environ.get("ProgramFiles(x86)")):
+                candidate = os.path.join(folder, "7-Zip", "7z.exe") if folder else None
+                if candidate and os.path.isfile(candidate):
+                    path = candidate
+                    break
+        tool_paths[method] = path
+    return tool_paths[method]
 
 
 def _get_seven_zip_exe():
-    """Prompt the user to locate 7z.exe if not already provided."""
-    global _seven_zip_exe
-    if _seven_zip_exe and os.path.isfile(_seven_zip_exe):
-        return _seven_zip_exe
+    """Path of 7z, or of the 7z.exe the user located; None if there is neither."""
+    exe = find_tool("7zip")
+    return exe if exe and os.path.isfile(exe) else None
+
+
+def _locate_seven_zip():
+    """Find 7z, or prompt the user to locate 7z.exe; only call on the Tk thread."""
+    exe = _get_seven_zip_exe()
+    if exe:
+        return exe
+
+    from tkinter import filedialog
 
     path = filedialog.askopenfilename(
         title="Locate 7z.exe",
         filetypes=[("7z executable", "7z.exe"), ("Executable", "*.exe")],
     )
     if path:
-        _seven_zip_exe = path
-    return _seven_zip_exe
+        tool_paths["7zip"] = path
+    return tool_paths["7zip"]
 
 
 def _calculate_with_7z(filepath):
     exe = _get_seven_zip_exe()
     if not exe:
-        print("7z.exe not provided. Cannot compute SHA256.")
+        print("7z not found. Cannot compute SHA256.")
         return None
 
     try:
@@ -75,7 +141,7 @@ def _calculate_with_certutil(filepath):
     """Compute SHA256 using Windows certutil."""
     try:
         result = subprocess.run(
-            ["certutil", "-hashfile", filepath, "SHA256"],
+            [find_tool("certutil") or "certutil", "-hashfile", filepath, "SHA256"],
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             universal_newlines=True,
@@ -99,7 +165,7 @@ def _calculate_with_certutil(filepath):
 def _calculate_with_sha256sum(filepath):
     try:
         result = subprocess.run(
-            ["sha256sum", filepath],
+            [find_tool("sha256sum") or "sha256sum", filepath],
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             universal_newlines=True,
@@ -117,7 +183,7 @@ def _calculate_with_sha256sum(filepath):
 def _calculate_with_shasum(filepath):
     try:
         result = subprocess.run(
-            ["shasum", "-a", "256", filepath],
+            [find_tool("shasum") or "shasum", "-a", "256", filepath],
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             universal_newlines=True,
@@ -132,23 +198,371 @@ def _calculate_with_shasum(filepath):
         return None
 
 
-def calculate_sha256(filepath):
-    """Calculate SHA256 hash regardless of the host platform."""
-    system = platform.system()
+def _get_read_buffer():
+    """Return this thread's read buffer, reallocating it if BLOCK_SIZE changed.
+
+    An anonymous map rather than a bytearray, so the buffer is page-aligned.
+    """
+    buffer = getattr(_buffers, "read", None)
+    if buffer is None or len(buffer) != BLOCK_SIZE:
+        if buffer is not None:
+            buffer.close()
+        buffer = _buffers.read = mmap.mmap(-1, BLOCK_SIZE)
+    return buffer
+
+
+def _advise(fd, advice):
+    """posix_fadvise the whole file, where FADVISE is set and supported."""
+    if FADVISE:
+        try:
+            os.posix_fadvise(fd, 0, 0, getattr(os, advice))
+        except (AttributeError, OSError):
+            pass
 
-    if system == "Windows":
-        method = _choose_windows_method()
-        if method == "7zip":
-            return _calculate_with_7z(filepath)
-        return _calculate_with_certutil(filepath)
+
+def _hash_mapped(sha256, fd, size):
+    with mmap.mmap(fd, size, access=mmap.ACCESS_READ) as mapped:
+        if hasattr(mapped, "madvise"):
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+        with memoryview(mapped) as view:
+            for offset in range(0, size, BLOCK_SIZE):
+                sha256.update(view[offset:offset + BLOCK_SIZE])
+
+
+def _hash_read(sha256, handle):
+    buffer = _get_read_buffer()
+    with memoryview(buffer) as view:
+        while True:
+            count = handle.readinto(buffer)
+            if not count:
+                break
+            sha256.update(view[:count])
+
+
+def _hash_file(filepath, digest):
+    """Feed a file to ``digest`` without copying it through Python objects.
+
+    Files of MMAP_THRESHOLD bytes or more are hashed from a memory map, the
+    rest are streamed through a reusable page-aligned buffer.
+    """
+    try:
+        with open(filepath, "rb", buffering=0) as handle:
+            fd = handle.fileno()
+            size = os.fstat(fd).st_size
+            _advise(fd, "POSIX_FADV_SEQUENTIAL")
+            try:
+                if MMAP_THRESHOLD is not None and size and size >= MMAP_THRESHOLD:
+                    _hash_mapped(digest, fd, size)
+                else:
+                    _hash_read(digest, handle)
+            finally:
+                _advise(fd, "POSIX_FADV_DONTNEED")
+        return digest.hexdigest()
+    except (OSError, ValueError) as exc:
+        print(f"Error hashing {filepath}: {exc}")
+        return None
+
+
+def _calculate_with_hashlib(filepath):
+    """Compute SHA256 in-process."""
+    return _hash_file(filepath, hashlib.sha256())
+
+
+def calculate_fingerprint(filepath):
+    """Fast, non-confirming fingerprint of a whole file, as ``"algorithm:hex"``.
+
+    Equal fingerprints only make files candidates: confirm with
+    calculate_sha256 before acting on them. The prefix is
+    FINGERPRINT_ALGORITHM, so fingerprints taken with another algorithm
+    never compare equal.
+    """
+    digest = _hash_file(filepath, _new_fingerprint())
+    return f"{FINGERPRINT_ALGORITHM}:{digest}" if digest else None
+
+
+def calculate_sample_sha256(filepath, sample_size=SAMPLE_SIZE):
+    """Hash only the first and last ``sample_size`` bytes of a file.
+
+    A cheap pre-check before a full hash: files of equal size whose samples
+    differ cannot be identical.
+    """
+    sha256 = hashlib.sha256()
+    try:
+        with open(filepath, "rb") as handle:
+            sha256.update(handle.read(sample_size))
+            size = os.fstat(handle.fileno()).st_size
+            handle.seek(max(sample_size, size - sample_size))
+            sha256.update(handle.read(sample_size))
+        return sha256.hexdigest()
+    except OSError as exc:
+        print(f"Error sampling {filepath}: {exc}")
+        return None
+
+
+def _resolve_system_method():
+    """Name of the external tool appropriate for the host platform, or None."""
+    if platform.system() == "Windows":
+        # 7-Zip hashes many files per process; certutil one at a time.
+        if find_tool("7zip"):
+            return "7zip"
+        return "certutil" if find_tool("certutil") else None
 
     # Prefer sha256sum on Unix-like systems
-    if shutil.which("sha256sum"):
-        return _calculate_with_sha256sum(filepath)
+    if find_tool("sha256sum"):
+        return "sha256sum"
 
     # macOS does not always provide sha256sum; use shasum -a 256
-    if shutil.which("shasum"):
-        return _calculate_with_shasum(filepath)
+    if find_tool("shasum"):
+        return "shasum"
+    return None
+
+
+def _calculate_with_system_tool(filepath):
+    """Hash with the external tool appropriate for the host platform."""
+    method = _resolve_system_method()
+    if method is None:
+        print("No suitable SHA256 calculation method found.")
+        return None
+    return _BACKENDS[method](filepath)
+
+
+def _calculate_with_auto_method(filepath):
+    """Hash with the backend chosen by calibration, or set as its override."""
+    return _BACKENDS[auto_method](filepath)
+
+
+# Upper bound on the characters of one batched command line. Windows limits
+# CreateProcess to 32767; POSIX ARG_MAX is far larger but shared with the
+# environment, so stay well below it there too.
+MAX_COMMAND_CHARS = 32000 if platform.system() == "Windows" else 128 * 1024
+
+
+def _chunk_paths(paths, base_length):
+    """Split ``paths`` into lists whose command line stays under MAX_COMMAND_CHARS."""
+    chunk = []
+    length = base_length
+    for path in paths:
+        # Room for a separating space and quoting.
+        needed = len(path) + 3
+        if chunk and length + needed > MAX_COMMAND_CHARS:
+            yield chunk
+            chunk = []
+            length = base_length
+        chunk.append(path)
+        length += needed
+    if chunk:
+        yield chunk
 
-    print("No suitable SHA256 calculation method found.")
+
+def _unescape_sum_name(name):
+    """Undo the escaping sha256sum/shasum apply to names with \\ or newlines."""
+    return re.sub(r"\\(.)", lambda m: {"n": "\n", "r": "\r"}.get(m.group(1), m.group(1)), name)
+
+
+def _parse_sum_output(output):
+    """Parse ``digest  name`` lines as printed by sha256sum and shasum."""
+    digests = {}
+    for line in output.splitlines():
+        escaped = line.startswith("\\")
+        if escaped:
+            line = line[1:]
+        match = re.match(r"([0-9a-fA-F]{64}) [ *](.*)$", line)
+        if not match:
+            continue
+        name = _unescape_sum_name(match.group(2)) if escaped else match.group(2)
+        digests[name] = match.group(1).lower()
+    return digests
+
+
+def _parse_7z_output(output, paths):
+    """Parse the table printed by ``7z h``; rows are matched on the name column.
+
+    7z may print only the file name, so a row whose name fits more than one
+    path in the chunk is ignored and those files are retried one by one.
+    """
+    by_name = {}
+    for path in paths:
+        for name in {path, os.path.basename(path)}:
+            by_name.setdefault(name, []).append(path)
+
+    digests = {}
+    for line in output.splitlines():
+        match = re.match(r"\s*([0-9a-fA-F]{64})\s+\d+\s+(.+?)\s*$", line)
+        if not match:
+            continue
+        candidates = by_name.get(match.group(2), [])
+        if len(candidates) == 1:
+            digests[candidates[0]] = match.group(1).lower()
+    return digests
+
+
+def _batch_command(method):
+    """Command prefix for hashing many files at once, or None if unsupported."""
+    if method == "sha256sum":
+        return [find_tool("sha256sum") or "sha256sum", "--"]
+    if method == "shasum":
+        return [find_tool("shasum") or "shasum", "-a", "256", "--"]
+    if method == "7zip":
+        exe = _get_seven_zip_exe()
+        return [exe, "h", "-scrcSHA256", "--"] if exe else None
     return None
+
+
+def _resolve_method(method=None):
+    method = method or hash_method
+    if method == "auto":
+        method = auto_method
+    if method == "system":
+        return _resolve_system_method()
+    return method
+
+
+def supports_batching(method=None):
+    """Whether calculate_sha256_batch can hash many files per process for ``method``."""
+    return _resolve_method(method) in ("sha256sum", "shasum", "7zip")
+
+
+def _run_batch(command, chunk, method):
+    try:
+        result = subprocess.run(
+            command + chunk,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+        )
+    except Exception as exc:  # pragma: no cover - process execution
+        print(f"Exception hashing a batch of {len(chunk)} files: {exc}")
+        return {}
+
+    # A missing or unreadable file makes the tool exit non-zero but the
+    # other files are still hashed, so parse the output regardless.
+    if method == "7zip":
+        return _parse_7z_output(result.stdout, chunk)
+    return _parse_sum_output(result.stdout)
+
+
+_BACKENDS = {
+    "auto": _calculate_with_auto_method,
+    "hashlib": _calculate_with_hashlib,
+    "sha256sum": _calculate_with_sha256sum,
+    "shasum": _calculate_with_shasum,
+    "certutil": _calculate_with_certutil,
+    "7zip": _calculate_with_7z,
+    "system": _calculate_with_system_tool,
+}
+HASH_METHODS = tuple(_BACKENDS)
+
+# Backends calibration.py can choose from.
+CALIBRATED_METHODS = ("hashlib", "sha256sum", "shasum", "certutil", "7zip")
+
+
+def prepare_backend(method=None):
+    """Resolve any interactive backend choice up front, then check_backend.
+
+    The 7z.exe file dialog must run on the Tk thread, so call this there
+    before hashing from worker threads.
+    """
+    if _resolve_method(method) == "7zip":
+        _locate_seven_zip()
+    check_backend(method)
+
+
+def check_backend(method=None):
+    """Raise RuntimeError if the backend's tool cannot be found.
+
+    Never prompts, so it is safe on worker threads.
+    """
+    resolved = _resolve_method(method)
+    if resolved is None:
+        raise RuntimeError("No external SHA256 tool found for the system hashing method")
+    if resolved in _TOOL_NAMES:
+        tool = _get_seven_zip_exe() if resolved == "7zip" else find_tool(resolved)
+        if not tool:
+            raise RuntimeError(f"Hashing backend {resolved} is selected but its tool cannot be found")
+
+
+def time_backend(method, filepaths):
+    """Hash ``filepaths`` with ``method`` as the hashing pool would, bypassing the cache.
+
+    Returns ``(seconds, {filepath: digest})``.
+    """
+    started = time.perf_counter()
+    command = _batch_command(method)
+    if command is None:
+        digests = {filepath: _BACKENDS[method](filepath) for filepath in filepaths}
+    else:
+        digests = {}
+        base_length = sum(len(part) + 1 for part in command)
+        for chunk in _chunk_paths(filepaths, base_length):
+            digests.update(_run_batch(command, chunk, method))
+    return time.perf_counter() - started, digests
+
+
+def calculate_sha256(filepath, method=None, lookup=True):
+    """Calculate SHA256 hash of a file.
+
+    ``method`` overrides the module-level ``hash_method`` for this call.
+    Digests are looked up in and saved to the persistent hash_cache; pass
+    ``lookup=False`` when the caller has just looked and missed.
+    """
+    backend = _BACKENDS.get(method or hash_method)
+    if backend is None:
+        print(f"Unknown hashing method: {method or hash_method}")
+        return None
+
+    # Stat before reading so a file modified mid-hash is rehashed next time.
+    try:
+        stat_result = os.stat(filepath)
+    except OSError:
+        stat_result = None
+
+    if lookup and stat_result is not None:
+        cached = hash_cache.lookup(filepath, stat_result)
+        if cached:
+            return cached
+
+    digest = backend(filepath)
+    if digest and stat_result is not None:
+        hash_cache.store(filepath, stat_result, digest)
+    return digest
+
+
+def calculate_sha256_batch(filepaths, method=None, lookup=True):
+    """Hash many files, with one tool process per chunk of files.
+
+    Returns a ``{filepath: digest}`` map; a file that could not be hashed
+    maps to None. External tools get as many paths per invocation as fit on
+    a command line; files missing from a tool's output are retried one at a
+    time so their error is reported. Other backends hash file by file.
+    ``lookup`` is as for calculate_sha256.
+    """
+    method = _resolve_method(method)
+    command = _batch_command(method)
+    if command is None:
+        return {filepath: calculate_sha256(filepath, method, lookup) for filepath in filepaths}
+
+    digests = {}
+    stats = {}
+    pending = []
+    for filepath in filepaths:
+        try:
+            stats[filepath] = os.stat(filepath)
+        except OSError:
+            stats[filepath] = None
+        cached = lookup and stats[filepath] and hash_cache.lookup(filepath, stats[filepath])
+        if cached:
+            digests[filepath] = cached
+        else:
+            pending.append(filepath)
+
+    base_length = sum(len(part) + 1 for part in command)
+    for chunk in _chunk_paths(pending, base_length):
+        found = _run_batch(command, chunk, method)
+        for filepath in chunk:
+            digest = found.get(filepath)
+            if not digest:
+                digest = _BACKENDS[method](filepath)
+            if digest and stats[filepath] is not None:
+                hash_cache.store(filepath, stats[filepath], digest)
+            digests[filepath] = digest
+    return digests
@@ -0,0 +1,133 @@
+"""Timing and throughput of one comparison or file operation run.
+
+A RunTelemetry is shared by the Tk thread, the comparison loop and the
+hashing threads. Phases may overlap (the walk and hashing run side by side),
+so each phase's wall time is recorded on its own.
+"""
+
+import contextlib
+import heapq
+import threading
+import time
+from collections import deque
+
+# Files listed in the slowest-files section of the report.
+SLOWEST_FILES = 20
+
+# Seconds of history behind the live throughput figures.
+RATE_WINDOW = 5.0
+
+
+class RunTelemetry:
+    """Bytes, files and time spent per phase, plus the slowest files read."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.finished = None
+        self.phases = {}
+        self.files_total = 0
+        self.bytes_total = 0
+        self.files_done = 0
+        self.bytes_done = 0
+        self.files_cached = 0
+        self.bytes_cached = 0
+        self.read_seconds = 0.0
+        self._open = {}
+        self._slowest = []
+        self._recent = deque()
+        self._recent_bytes = 0
+        self._first_planned = None
+        self._lock = threading.Lock()
+
+    def begin(self, phase):
+        self._open.setdefault(phase, time.monotonic())
+
+    def end(self, phase):
+        started = self._open.pop(phase, None)
+        if started is not None:
+            self.phases[phase] = self.phases.get(phase, 0.0) + time.monotonic() - started
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        self.begin(name)
+        try:
+            yield
+        finally:
+            self.end(name)
+
+    def planned(self, size):
+        """A file of ``size`` bytes was queued for reading."""
+        with self._lock:
+            if self._first_planned is None:
+                self._first_planned = time.monotonic()
+            self.files_total += 1
+            self.bytes_total += size
+
+    def file_done(self, path, size, seconds):
+        """A queued file was read; may be called from any thread."""
+        now = time.monotonic()
+        with self._lock:
+            self.files_done += 1
+            self.bytes_done += size
+            self.read_seconds += seconds
+            self._recent.append((now, size))
+            self._recent_bytes += size
+            while self._recent[0][0] < now - RATE_WINDOW:
+                self._recent_bytes -= self._recent.popleft()[1]
+            if len(self._slowest) < SLOWEST_FILES:
+                heapq.heappush(self._slowest, (seconds, path, size))
+            else:
+                heapq.heappushpop(self._slowest, (seconds, path, size))
+
+    def file_cached(self, size):
+        """A queued file's digest came from the hash cache without reading it."""
+        with self._lock:
+            self.files_total -= 1
+            self.bytes_total -= size
+            self.files_cached += 1
+            self.bytes_cached += size
+
+    def rates(self):
+        """Recent ``(files per second, bytes per second)``."""
+        now = time.monotonic()
+        with self._lock:
+            if self._first_planned is None:
+                return 0.0, 0.0
+            while self._recent and self._recent[0][0] < now - RATE_WINDOW:
+                self._recent_bytes -= self._recent.popleft()[1]
+            span = max(0.001, min(RATE_WINDOW, now - self._first_planned))
+            return len(self._recent) / span, self._recent_bytes / span
+
+    def eta(self):
+        """Seconds until every queued byte is read at the recent rate, or None."""
+        _, bytes_per_second = self.rates()
+        if not bytes_per_second:
+            return None
+        return max(0, self.bytes_total - self.bytes_done) / bytes_per_second
+
+    def finish(self):
+        for phase in list(self._open):
+            self.end(phase)
+        self.finished = time.monotonic()
+
+    def report(self):
+        """The timing report as a JSON-serialisable dict."""
+        wall = (self.finished or time.monotonic()) - self.started
+        reading = self.phases.get("hash") or wall
+        with self._lock:
+            slowest = sorted(self._slowest, reverse=True)
+        return {
+            "wall_seconds": wall,
+            "phases": dict(self.phases),
+            "files_read": self.files_done,
+            "bytes_read": self.bytes_done,
+            "files_cached": self.files_cached,
+            "bytes_cached": self.bytes_cached,
+            "files_per_s": self.files_done / reading if reading else None,
+            "mb_per_s": self.bytes_done / (1024 * 1024) / reading if reading else None,
+            "read_seconds": self.read_seconds,
+            "slowest_files": [
+                {"path": path, "bytes": size, "seconds": seconds}
+                for seconds, path, size in slowest
+            ],
+        }
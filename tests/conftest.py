@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import hash_cache
+
+
+@pytest.fixture(autouse=True)
+def no_hash_cache(monkeypatch, tmp_path):
+    """Keep the tests away from the user's cache and config files."""
+    monkeypatch.setattr(hash_cache, "mode", "ignore")
+    monkeypatch.setattr(hash_cache, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(hash_cache, "CACHE_PATH", str(tmp_path / "hash_cache.sqlite3"))
+
+
+def write_tree(root, files):
+    """Create ``{rel_path: bytes}`` below ``root``; returns ``str(root)``."""
+    for rel_path, content in files.items():
+        path = root / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+    return str(root)
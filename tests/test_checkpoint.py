@@ -0,0 +1,69 @@
+from pathlib import Path
+
+import filebackupcheck
+from checkpoint import Checkpoint
+from comparison import ComparisonResult
+
+
+def _previous(digests):
+    previous = ComparisonResult()
+    for number, (full_path, digest) in enumerate(digests.items()):
+        previous.stats[full_path] = (4, number, number)
+        previous.digests[full_path] = digest
+    return previous
+
+
+def test_extend_appends_only_what_is_new(tmp_path):
+    path = str(tmp_path / "checkpoint.jsonl")
+    first = Checkpoint.create("/p", ["/c"], _previous({"/p/a": "aa", "/c/b": "bb"}), path=path)
+    first.add_row(("cleanup", "b"), ("b", "bb", "Delete"))
+    first.close(finished=True)
+    size = len(Path(path).read_text(encoding="utf-8"))
+
+    previous = _previous({"/p/a": "aa", "/p/b": "bb"})
+    second = Checkpoint.extend("/p", ["/c"], previous, carried=["/p/b"], path=path)
+    second.add_file("/p/c", (1, 2, 3), digest="cc")
+    second.add_row(("preserve", "b"), ("b", "bb", "Reference"))
+    second.close()
+    with open(path, encoding="utf-8") as handle:
+        added = handle.read()[size:]
+    assert '"/p/a"' not in added
+    assert '"/p/b"' in added and '"/p/c"' in added
+
+    loaded = Checkpoint.load(path)
+    assert loaded.rows == {("preserve", "b"): ("b", "bb", "Reference")}
+    assert not loaded.finished
+    assert loaded.previous.digests == {"/p/a": "aa", "/c/b": "bb", "/p/b": "bb", "/p/c": "cc"}
+
+
+def test_extend_after_a_crash_mid_line(tmp_path):
+    path = str(tmp_path / "checkpoint.jsonl")
+    Checkpoint.create("/p", ["/c"], _previous({"/p/a": "aa"}), path=path).close()
+    with open(path, "a", encoding="utf-8") as handle:
+        handle.write('{"path": "/p/cut", "st')
+    second = Checkpoint.extend("/p", ["/c"], ComparisonResult(), path=path)
+    second.add_file("/p/c", (1, 2, 3), digest="cc")
+    second.close(finished=True)
+    loaded = Checkpoint.load(path)
+    assert loaded.previous.digests == {"/p/a": "aa", "/p/c": "cc"}
+    assert loaded.finished
+
+
+def test_extend_other_folders_starts_over(tmp_path):
+    path = str(tmp_path / "checkpoint.jsonl")
+    Checkpoint.create("/p", ["/c"], _previous({"/p/a": "aa"}), path=path).close()
+    Checkpoint.extend("/p", ["/other"], _previous({"/p/b": "bb"}), path=path).close()
+    loaded = Checkpoint.load(path)
+    assert loaded.cleanup_folders == ["/other"]
+    assert loaded.previous.digests == {"/p/b": "bb"}
+
+
+def test_compare_rejects_a_corrupt_checkpoint(tmp_path, capsys):
+    path = tmp_path / "checkpoint.jsonl"
+    path.write_bytes(b"\x00\xff not json")
+    preserve, cleanup = tmp_path / "P", tmp_path / "C"
+    preserve.mkdir()
+    cleanup.mkdir()
+    argv = ["compare", str(preserve), str(cleanup), "--checkpoint", str(path), "--hash-method", "hashlib"]
+    assert filebackupcheck.main([*argv, "--output", str(tmp_path / "out.csv")]) == 2
+    assert "Could not load checkpoint" in capsys.readouterr().err
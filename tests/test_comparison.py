@@ -0,0 +1,105 @@
+import os
+from pathlib import Path
+
+from conftest import write_tree
+
+import execution
+import hash_cache
+from comparison import ACTION_MOVE_MISMATCH, ACTION_MOVE_NEW, compare_trees
+from disk_index import compare_on_disk
+
+
+def _folders(tmp_path):
+    preserve = write_tree(tmp_path / "P", {"a.txt": b"kept"})
+    first = write_tree(tmp_path / "C1", {"dup.txt": b"kept", "x1.txt": b"twice", "d/x2.txt": b"twice"})
+    second = write_tree(tmp_path / "C2", {"x.txt": b"twice", "y1.txt": b"own", "y2.txt": b"own"})
+    return preserve, [first, second]
+
+
+def test_copy_within_one_cleanup_folder_is_moved(tmp_path):
+    preserve, cleanup = _folders(tmp_path)
+    result = compare_trees(preserve, cleanup)
+
+    assert result.delete_plan == [os.path.join(cleanup[0], "dup.txt")]
+    moved = sorted(os.path.relpath(src, tmp_path) for src, _ in result.move_new_plan)
+    assert moved == sorted(["C1/x1.txt", "C1/d/x2.txt", "C2/y1.txt", "C2/y2.txt"])
+    assert result.rows[("cleanup", "x1.txt")][2] == ACTION_MOVE_NEW
+    assert result.rows[("cleanup2", "y2.txt")][2] == ACTION_MOVE_NEW
+    assert result.rows[("cleanup2", "x.txt")][2].startswith("SKIP - Same content as C1")
+
+
+def test_single_cleanup_folder_matches(tmp_path):
+    preserve, cleanup = _folders(tmp_path)
+    single = compare_trees(preserve, cleanup[0])
+    several = compare_trees(preserve, cleanup)
+    assert single.delete_plan == several.delete_plan
+    assert single.move_new_plan == several.plans_for("cleanup")["move_new"]
+
+
+def test_disk_index_decides_the_same(tmp_path):
+    preserve, cleanup = _folders(tmp_path)
+    result = compare_trees(preserve, cleanup)
+    index = compare_on_disk(preserve, cleanup, path=str(tmp_path / "index.sqlite3"))
+    try:
+        assert list(index.iter_rows()) == list(result.rows.items())
+        assert list(index.delete_plan) == result.delete_plan
+        assert list(index.move_new_plan) == result.move_new_plan
+    finally:
+        index.close()
+
+
+def test_hash_cache_hits_are_not_counted_as_read(tmp_path, monkeypatch):
+    monkeypatch.setattr(hash_cache, "mode", "use")
+    preserve, cleanup = _folders(tmp_path)
+    first = compare_trees(preserve, cleanup)
+    assert first.bytes_read > 0 and first.bytes_cached == 0
+
+    again = compare_trees(preserve, cleanup)
+    assert (again.bytes_read, again.bytes_cached) == (0, first.bytes_read)
+    assert again.rows == first.rows
+
+
+def test_same_path_in_two_cleanup_folders_gets_two_targets(tmp_path, monkeypatch):
+    monkeypatch.setattr(execution, "JOURNAL_DIR", str(tmp_path / "journals"))
+    preserve = write_tree(tmp_path / "P", {"x.txt": b"kept", "x'.txt": b"primed"})
+    cleanup = [
+        write_tree(tmp_path / "C1", {"report.bin": b"first", "x.txt": b"one"}),
+        write_tree(tmp_path / "C2", {"report.bin": b"second!", "x.txt": b"two!"}),
+    ]
+    result = compare_trees(preserve, cleanup)
+    targets = {src: os.path.relpath(dst, preserve) for src, dst in result.move_new_plan + result.move_mismatch_plan}
+    assert targets == {
+        os.path.join(cleanup[0], "report.bin"): "report.bin",
+        os.path.join(cleanup[1], "report.bin"): "report'.bin",
+        os.path.join(cleanup[0], "x.txt"): "x''.txt",
+        os.path.join(cleanup[1], "x.txt"): "x'''.txt",
+    }
+    assert result.rows[("cleanup2", "report.bin")][2] == ACTION_MOVE_MISMATCH
+
+    index = compare_on_disk(preserve, cleanup, path=str(tmp_path / "index.sqlite3"))
+    try:
+        assert list(index.iter_rows()) == list(result.rows.items())
+        assert list(index.move_new_plan) == result.move_new_plan
+        assert list(index.move_mismatch_plan) == result.move_mismatch_plan
+    finally:
+        index.close()
+
+    moved, errors, _ = execution.move_files(result.move_new_plan + result.move_mismatch_plan)
+    assert (len(moved), errors) == (4, 0)
+    assert sorted(os.listdir(preserve)) == ["report'.bin", "report.bin", "x'''.txt", "x''.txt", "x'.txt", "x.txt"]
+    assert Path(os.path.join(preserve, "report'.bin")).read_bytes() == b"second!"
+
+
+def test_prefilter_shows_the_confirmed_sha256_of_a_preserve_copy(tmp_path):
+    preserve = write_tree(tmp_path / "P", {"a.txt": b"kept", "b.txt": b"kept"})
+    cleanup = write_tree(tmp_path / "C", {"dup.txt": b"kept"})
+    rows = {}
+    result = compare_trees(preserve, cleanup, prefilter=True, on_row=rows.__setitem__)
+
+    assert result.delete_plan == [os.path.join(cleanup, "dup.txt")]
+    kept = os.path.relpath(result.duplicates[result.delete_plan[0]], preserve)
+    other = "b.txt" if kept == "a.txt" else "a.txt"
+    assert result.rows[("preserve", kept)][1] == result.rows[("cleanup", "dup.txt")][1]
+    assert result.rows[("preserve", kept)][1].startswith("sha256:")
+    assert rows[("preserve", kept)] == result.rows[("preserve", kept)]
+    assert not result.rows[("preserve", other)][1].startswith("sha256:")
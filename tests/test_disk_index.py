@@ -0,0 +1,95 @@
+import os
+
+import pytest
+from conftest import write_tree
+
+import hash_cache
+from disk_index import compare_on_disk
+
+
+def _plans(index):
+    return (
+        sorted(index.delete_plan),
+        sorted(index.link_plan),
+        sorted(index.move_mismatch_plan),
+        sorted(index.move_new_plan),
+    )
+
+
+def test_record_executed_matches_a_new_comparison(tmp_path):
+    preserve = write_tree(tmp_path / "P", {"a.txt": b"kept", "b.txt": b"other"})
+    cleanup = [
+        write_tree(tmp_path / "C1", {"dup.txt": b"kept", "n.txt": b"newer", "b.txt": b"diff!"}),
+        write_tree(tmp_path / "C2", {"n2.txt": b"newer", "m.txt": b"mine"}),
+    ]
+    index = compare_on_disk(preserve, cleanup)
+    try:
+        deleted = list(index.delete_plan)
+        moved = list(index.move_new_plan) + list(index.move_mismatch_plan)
+        assert ("cleanup2", "n2.txt") in dict(index.iter_rows())
+        for path in deleted:
+            os.remove(path)
+        for src, dst in moved:
+            os.replace(src, dst)
+        index.record_executed(deleted=deleted, moved=moved)
+
+        again = compare_on_disk(preserve, cleanup, path=str(tmp_path / "again.sqlite3"))
+        try:
+            assert _plans(index) == _plans(again)
+            assert list(index.delete_plan) == [os.path.join(cleanup[1], "n2.txt")]
+            rows = dict(index.iter_rows())
+            assert {key: row[2] for key, row in rows.items()} == {key: row[2] for key, row in again.iter_rows()}
+        finally:
+            again.close()
+    finally:
+        index.close()
+
+
+@pytest.mark.parametrize("sort_column", [None, "Path", "SHA256", "Action"])
+@pytest.mark.parametrize("reverse", [False, True])
+def test_pages_match_a_full_read(tmp_path, sort_column, reverse):
+    files = {f"d{number % 7}/f{number % 5}.txt": bytes([number % 3]) * (number % 4 + 1) for number in range(60)}
+    preserve = write_tree(tmp_path / "P", dict(list(files.items())[::2]))
+    cleanup = write_tree(tmp_path / "C", files)
+    index = compare_on_disk(preserve, cleanup)
+    try:
+        rows = index.rows(sort_column, reverse, "f")
+        expected = [row.values for row in rows]
+        assert len(expected) == len(rows) > 20
+        paged = []
+        for start in range(0, len(rows), 3):
+            paged.extend(row.values for row in rows[start:start + 3])
+        assert paged == expected
+        # Back, a jump and the same page again.
+        for start in (10, 7, 19, 19, 2, 0, 5):
+            assert [row.values for row in rows[start:start + 4]] == expected[start:start + 4]
+    finally:
+        index.close()
+
+
+def test_each_run_has_its_own_index(tmp_path):
+    preserve = write_tree(tmp_path / "P", {"a.txt": b"kept"})
+    cleanup = write_tree(tmp_path / "C", {"a.txt": b"kept"})
+    first = compare_on_disk(preserve, cleanup)
+    second = compare_on_disk(preserve, cleanup)
+    try:
+        assert first.path != second.path
+        assert os.path.dirname(first.path) == hash_cache.CACHE_DIR
+        first.close()
+        assert not os.path.exists(first.path)
+        assert list(second.delete_plan) == [os.path.join(cleanup, "a.txt")]
+    finally:
+        second.close()
+    assert os.listdir(hash_cache.CACHE_DIR) == []
+
+
+def test_hardlinks_are_read_once(tmp_path):
+    preserve = write_tree(tmp_path / "P", {"a.txt": b"kept"})
+    cleanup = write_tree(tmp_path / "C", {"x.txt": b"kept"})
+    os.link(os.path.join(cleanup, "x.txt"), os.path.join(cleanup, "y.txt"))
+    index = compare_on_disk(preserve, cleanup)
+    try:
+        assert index.bytes_read + index.bytes_cached == 8
+        assert sorted(index.delete_plan) == [os.path.join(cleanup, "x.txt"), os.path.join(cleanup, "y.txt")]
+    finally:
+        index.close()
@@ -0,0 +1,103 @@
+import os
+from pathlib import Path
+
+import pytest
+from conftest import write_tree
+
+import execution
+from execution import (
+    Journal,
+    interrupted_journals,
+    link_files,
+    resume_journal,
+    rollback_journal,
+)
+
+
+@pytest.fixture(autouse=True)
+def journal_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(execution, "JOURNAL_DIR", str(tmp_path / "journals"))
+
+
+def _crashed_moves(tmp_path):
+    """A move run that stopped after its second file, having journaled only the first."""
+    source = write_tree(tmp_path / "C", {"a": b"1", "b": b"2", "sub/c": b"3"})
+    target = str(tmp_path / "P")
+    moves = [(os.path.join(source, name), os.path.join(target, name)) for name in ("a", "b", "sub/c")]
+    journal = Journal.create("Moving new", [("move", src, dst) for src, dst in moves])
+    os.makedirs(os.path.join(target, "sub"))
+    for src, dst in moves[:2]:
+        os.rename(src, dst)
+    journal.record(0, "done")
+    # A copy across devices that was cut short.
+    with open(moves[2][1] + execution.PARTIAL_SUFFIX, "wb") as handle:
+        handle.write(b"")
+    journal.close()
+    assert interrupted_journals() == [journal.path]
+    return journal.path, moves
+
+
+def test_resume_finishes_a_crashed_run(tmp_path):
+    path, moves = _crashed_moves(tmp_path)
+    done, errors, cancelled = resume_journal(path)
+    assert (errors, cancelled) == (0, False)
+    assert sorted(done) == sorted(("move", src, dst) for src, dst in moves[1:])
+    assert all(os.path.exists(dst) and not os.path.exists(src) for src, dst in moves)
+    assert not os.path.exists(moves[2][1] + execution.PARTIAL_SUFFIX)
+    assert interrupted_journals() == []
+    assert Journal.load(path).finished == "completed"
+
+
+def test_rollback_moves_files_back(tmp_path):
+    path, moves = _crashed_moves(tmp_path)
+    done, errors, cancelled = rollback_journal(path)
+    assert (errors, cancelled) == (0, False)
+    assert len(done) == 3
+    assert all(os.path.exists(src) and not os.path.exists(dst) for src, dst in moves)
+    assert interrupted_journals() == []
+    assert Journal.load(path).finished == "rolled back"
+
+
+def test_rollback_unshares_links(tmp_path, monkeypatch):
+    monkeypatch.setattr(execution, "link_mode", "hardlink")
+    preserve = write_tree(tmp_path / "P", {"a": b"same"})
+    cleanup = write_tree(tmp_path / "C", {"a": b"same"})
+    link = (os.path.join(cleanup, "a"), os.path.join(preserve, "a"))
+    linked, errors, _ = link_files([link])
+    assert (linked, errors) == ([link], 0)
+    assert os.path.samefile(*link)
+
+    journal = max(os.listdir(execution.JOURNAL_DIR))
+    done, errors, _ = rollback_journal(os.path.join(execution.JOURNAL_DIR, journal))
+    assert (len(done), errors) == (1, 0)
+    assert not os.path.samefile(*link)
+    assert Path(link[0]).read_bytes() == b"same"
+
+
+def test_moves_never_share_a_destination(tmp_path):
+    source = write_tree(tmp_path / "C", {"a": b"first", "b": b"second"})
+    dst = str(tmp_path / "P" / "x")
+    moves = [(os.path.join(source, "a"), dst), (os.path.join(source, "b"), dst)]
+    moved, errors, _ = execution.move_files(moves)
+    assert (moved, errors) == (moves[:1], 1)
+    assert Path(dst).read_bytes() == b"first"
+    assert Path(moves[1][0]).read_bytes() == b"second"
+
+
+def test_copy_across_devices_keeps_a_file_that_appeared(tmp_path, monkeypatch):
+    source = write_tree(tmp_path / "C", {"a": b"moved"})
+    dst = str(tmp_path / "P" / "a")
+    copy2 = execution.shutil.copy2
+
+    def copy_while_another_job_publishes(src, partial):
+        with open(dst, "wb") as handle:
+            handle.write(b"other")
+        return copy2(src, partial)
+
+    monkeypatch.setattr(execution, "_rename", lambda src, dst: False)
+    monkeypatch.setattr(execution.shutil, "copy2", copy_while_another_job_publishes)
+    moved, errors, _ = execution.move_files([(os.path.join(source, "a"), dst)])
+    assert (moved, errors) == ([], 1)
+    assert Path(dst).read_bytes() == b"other"
+    assert Path(os.path.join(source, "a")).read_bytes() == b"moved"
+    assert not os.path.exists(dst + execution.PARTIAL_SUFFIX)
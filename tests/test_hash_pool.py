@@ -0,0 +1,51 @@
+import queue
+import threading
+
+import devices
+import hash_cache
+from hash_pool import HashScheduler
+from sha256_tools import calculate_sha256
+
+
+def test_physical_order_is_found_off_the_submitting_thread(tmp_path, monkeypatch):
+    path = tmp_path / "a.txt"
+    path.write_bytes(b"kept")
+    threads = []
+
+    def physical_order(filepath, physical):
+        threads.append(threading.current_thread())
+        return 1, physical[1]
+
+    monkeypatch.setattr(devices, "physical_order", physical_order)
+    results = queue.Queue()
+    scheduler = HashScheduler(results, workers=2, batch_size=1, device_limits={1: (1, True)})
+    try:
+        scheduler.submit("a", str(path), size=4, physical=(1, 7))
+        _, key, _, digest, _ = results.get(timeout=10)
+    finally:
+        scheduler.close()
+    assert key == "a" and digest == calculate_sha256(str(path))
+    assert threads and threading.current_thread() not in threads
+
+
+def test_a_cache_miss_is_looked_up_once(tmp_path, monkeypatch):
+    path = tmp_path / "a.txt"
+    path.write_bytes(b"kept")
+    lookups = []
+    lookup = hash_cache.lookup
+
+    def counted(filepath, stat_result):
+        lookups.append(filepath)
+        return lookup(filepath, stat_result)
+
+    monkeypatch.setattr(hash_cache, "mode", "use")
+    monkeypatch.setattr(hash_cache, "lookup", counted)
+    results = queue.Queue()
+    scheduler = HashScheduler(results, workers=1, batch_size=1)
+    try:
+        scheduler.submit("a", str(path), size=4)
+        _, _, _, digest, cached = results.get(timeout=10)
+    finally:
+        scheduler.close()
+    assert digest and not cached
+    assert lookups == [str(path)]
@@ -0,0 +1,50 @@
+import pytest
+from conftest import write_tree
+
+from manifest import Manifest, build_manifest
+
+
+@pytest.fixture
+def saved(tmp_path):
+    root = write_tree(tmp_path / "P", {"a.txt": b"one", "d/b.txt": b"two", "c.bin": bytes(300 * 1024)})
+    path = str(tmp_path / "p.fbcidx")
+    build_manifest(root).save(path)
+    return root, path
+
+
+def test_round_trip(saved):
+    root, path = saved
+    loaded = Manifest.load(path)
+    assert loaded.root == root
+    assert sorted(loaded.entries) == ["a.txt", "c.bin", "d/b.txt"]
+    assert loaded.entries["c.bin"].sample is not None
+    assert loaded.entries["a.txt"].sample is None
+
+
+def test_truncated_file_is_rejected(saved):
+    _, path = saved
+    with open(path, "rb") as handle:
+        data = handle.read()
+    for length in range(len(data) - 1, 8, -7):
+        with open(path, "wb") as handle:
+            handle.write(data[:length])
+        with pytest.raises(ValueError, match="truncated or corrupt"):
+            Manifest.load(path)
+
+
+def test_corrupt_header_is_rejected(saved):
+    _, path = saved
+    with open(path, "rb") as handle:
+        data = bytearray(handle.read())
+    data[12:14] = b"\xff\xfe"
+    with open(path, "wb") as handle:
+        handle.write(data)
+    with pytest.raises(ValueError, match="truncated or corrupt"):
+        Manifest.load(path)
+
+
+def test_other_file_is_rejected(tmp_path):
+    path = tmp_path / "other"
+    path.write_bytes(b"not an index")
+    with pytest.raises(ValueError, match="not a preserve folder manifest"):
+        Manifest.load(str(path))
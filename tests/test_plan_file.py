@@ -0,0 +1,94 @@
+import os
+
+import pytest
+from conftest import write_tree
+
+from comparison import compare_trees
+from plan_file import (
+    ACTION_CHANGED,
+    ACTION_MATCH_CHANGED,
+    ACTION_MISSING,
+    load_plan,
+    plan_roots,
+    result_records,
+    verify_plan,
+    write_plan,
+)
+from result_table import ResultRow
+
+
+def _saved(tmp_path, name):
+    preserve = write_tree(tmp_path / "P", {"a.txt": b"kept", "b.txt": b"base", "c.txt": b"same"})
+    cleanup = [
+        write_tree(tmp_path / "C1", {"a.txt": b"kept", "b2.txt": b"base", "n.txt": b"new", "c.txt": b"other"}),
+        write_tree(tmp_path / "C2", {"c2.txt": b"same", "m.txt": b"more"}),
+    ]
+    result = compare_trees(preserve, cleanup)
+    rows = [ResultRow(*values, key=key) for key, values in result.rows.items()]
+    path = str(tmp_path / name)
+    assert write_plan(path, list(result.roots.items()), result_records(result, rows)) == len(rows)
+    return result, path
+
+
+def _plans(plans):
+    return tuple(sorted(plan) for plan in plans)
+
+
+@pytest.mark.parametrize("name", ["plan.csv", "plan.csv.gz"])
+def test_round_trip(tmp_path, name):
+    result, path = _saved(tmp_path, name)
+    assert plan_roots(path) == list(result.roots.items())
+    index = load_plan(path)
+    try:
+        assert index.roots == result.roots
+        assert dict(index.iter_rows()) == result.rows
+        assert _plans((index.delete_plan, index.move_mismatch_plan, index.move_new_plan)) == _plans(
+            (result.delete_plan, result.move_mismatch_plan, result.move_new_plan)
+        )
+        assert verify_plan(index, workers=2) == 0
+        assert sorted(index.delete_plan) == sorted(result.delete_plan)
+    finally:
+        index.close()
+
+
+def test_verify_drops_changed_files(tmp_path):
+    result, path = _saved(tmp_path, "plan.csv")
+    cleanup = list(result.roots.values())[1:]
+    os.remove(os.path.join(cleanup[0], "n.txt"))
+    # Changed content of the same size, and a preserve copy that changed.
+    (tmp_path / "C1" / "a.txt").write_bytes(b"KEPT")
+    (tmp_path / "P" / "b.txt").write_bytes(b"gone")
+    # Touched but with the same content keeps its plan.
+    os.utime(os.path.join(cleanup[1], "c2.txt"), ns=(0, 0))
+
+    index = load_plan(path)
+    try:
+        assert verify_plan(index, workers=2) == 4
+        actions = {key: row[2] for key, row in index.iter_rows()}
+        assert actions[("cleanup", "n.txt")] == ACTION_MISSING
+        assert actions[("cleanup", "a.txt")] == ACTION_CHANGED
+        assert actions[("preserve", "b.txt")] == ACTION_CHANGED
+        assert actions[("cleanup", "b2.txt")] == ACTION_MATCH_CHANGED
+        assert list(index.delete_plan) == [os.path.join(cleanup[1], "c2.txt")]
+        assert list(index.move_new_plan) == [(os.path.join(cleanup[1], "m.txt"), os.path.join(result.roots["preserve"], "m.txt"))]
+    finally:
+        index.close()
+
+
+def test_verify_reads_preserve_copies_the_plan_has_no_row_for(tmp_path):
+    preserve = write_tree(tmp_path / "P", {"a.txt": b"kept", "b.txt": b"same"})
+    cleanup = write_tree(tmp_path / "C", {"a.txt": b"kept", "b.txt": b"same"})
+    result = compare_trees(preserve, cleanup)
+    deletes = [ResultRow(*values, key=key) for key, values in result.rows.items() if key[0] == "cleanup"]
+    path = str(tmp_path / "plan.csv")
+    write_plan(path, list(result.roots.items()), result_records(result, deletes))
+    (tmp_path / "P" / "a.txt").write_bytes(b"KEPT")
+
+    index = load_plan(path)
+    try:
+        assert verify_plan(index, workers=2) == 1
+        assert dict(index.iter_rows())[("cleanup", "a.txt")][2] == ACTION_MATCH_CHANGED
+        assert list(index.delete_plan) == [os.path.join(cleanup, "b.txt")]
+        assert len(list(index.iter_rows())) == 2
+    finally:
+        index.close()
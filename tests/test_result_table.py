@@ -0,0 +1,52 @@
+from result_table import ResultTable
+
+
+class _Widget:
+    """Just enough of a Treeview and Scrollbar to drive a ResultTable."""
+
+    def __init__(self):
+        self.items = []
+
+    def config(self, **options):
+        pass
+
+    def bind(self, sequence, handler):
+        pass
+
+    def heading(self, column, text):
+        pass
+
+    def set(self, first, last):
+        pass
+
+    def winfo_height(self):
+        return 200
+
+    def get_children(self):
+        return list(range(len(self.items)))
+
+    def bbox(self, item):
+        return None
+
+    def item(self, item, values):
+        self.items[item] = values
+
+    def insert(self, parent, index, values):
+        self.items.append(values)
+
+    def delete(self, *items):
+        del self.items[min(items):]
+
+
+def test_sorted_rows_ignore_the_filter():
+    table = ResultTable(_Widget(), _Widget())
+    table.set_rows([
+        (("cleanup", "b"), ("b", "bb", "Delete (duplicate of b)")),
+        (("cleanup", "a"), ("a", "aa", "Move")),
+        (("preserve", "b"), ("b", "bb", "Reference Copy")),
+    ])
+    table.sort_by("Path")
+    table.set_filter("delete")
+
+    assert [row.values for row in table.view] == [("b", "bb", "Delete (duplicate of b)")]
+    assert [row.path for row in table.sorted_rows()] == ["a", "b", "b"]
@@ -0,0 +1,82 @@
+import os
+
+import pytest
+from conftest import write_tree
+
+import execution
+from comparison import ACTION_MOVE_MISMATCH, compare_entries
+from watch import WATCH_ACTIONS, Watch
+from worker import TaskCancelled
+
+
+def _plans(result):
+    return (
+        sorted(result.delete_plan),
+        sorted(result.link_plan),
+        sorted(result.move_mismatch_plan),
+        sorted(result.move_new_plan),
+        result.duplicates,
+        result.preserve_path_to_hash,
+    )
+
+
+@pytest.mark.parametrize("folders", [1, 2])
+def test_update_matches_a_full_comparison(tmp_path, folders):
+    preserve = write_tree(
+        tmp_path / "P",
+        {"a.txt": b"kept", "b.txt": b"other", "same.txt": b"12345", "gone/g.txt": b"g", "m.txt": b"mmm"},
+    )
+    cleanup = [
+        write_tree(
+            tmp_path / "C1",
+            {"dup.txt": b"kept", "b.txt": b"diff!", "n.txt": b"newer", "d/x.txt": b"twice", "big.txt": b"untouched size"},
+        ),
+        write_tree(tmp_path / "C2", {"x.txt": b"twice", "b.txt": b"other", "g.txt": b"g"}),
+    ][:folders]
+    watch = Watch(preserve, cleanup)
+    watch._scan()
+    before, changes = watch._update(None)
+    assert changes is None
+
+    (tmp_path / "C1" / "n.txt").write_bytes(b"kept")
+    os.remove(os.path.join(preserve, "b.txt"))
+    write_tree(tmp_path / "C1", {"sub/y.txt": b"other2", "m.txt": b"changed!"})
+    (tmp_path / "P" / "same.txt").write_bytes(b"54321!")
+    os.remove(os.path.join(preserve, "gone", "g.txt"))
+    os.rmdir(os.path.join(preserve, "gone"))
+    touched = {
+        side: set().union(*(watch._refresh(side, rel_path) for rel_path in rel_paths))
+        for side, rel_paths in (("preserve", ["b.txt", "same.txt", "gone"]), ("cleanup", ["n.txt", "sub", "m.txt"]))
+    }
+    result, changes = watch._update(None, touched)
+
+    full = compare_entries(
+        preserve,
+        {side: list(known.values()) for side, known in watch.entries.items()},
+        previous=before,
+        labels=watch.labels,
+    )
+    assert result.rows == full.rows
+    assert _plans(result) == _plans(full)
+    for key in set(before.rows) | set(full.rows):
+        if before.rows.get(key) != full.rows.get(key):
+            assert changes[key] == full.rows.get(key)
+    assert changes[("cleanup", "m.txt")][2] == ACTION_MOVE_MISMATCH
+    assert ("cleanup", "big.txt") not in changes
+
+
+def test_execute_can_be_cancelled(tmp_path, monkeypatch):
+    monkeypatch.setattr(execution, "JOURNAL_DIR", str(tmp_path / "journals"))
+    preserve = write_tree(tmp_path / "P", {"a.txt": b"kept"})
+    cleanup = write_tree(tmp_path / "C", {"dup.txt": b"kept", "n.txt": b"newer"})
+    watch = Watch(preserve, [cleanup], actions=WATCH_ACTIONS)
+    watch._scan()
+    watch._update(None)
+    executed = []
+
+    def progress(stage, done, total):
+        raise TaskCancelled()
+
+    watch.execute(lambda action, done, failed: executed.append((action, done)), progress)
+    assert executed == [("delete", [])]
+    assert sorted(os.listdir(cleanup)) == ["dup.txt", "n.txt"]
@@ -0,0 +1,509 @@
+"""Watch mode: keep a comparison up to date while files arrive.
+
+A Watch holds the stat of every file in the preserve and cleanup folders
+and the last ComparisonResult in memory. Changed paths are reported by
+inotify on Linux, or found by walking the folders every POLL_INTERVAL
+seconds elsewhere. Only those paths are stat'ed again, and only the files
+sharing a size with one of them are classified again; of those, only the
+new or changed ones are read, everything else keeps its digest from the
+last result.
+
+With ``actions``, the delete and move plans are carried out once no file
+has changed for ``quiet`` seconds. Files whose stat changed since they
+were compared are left for the next round.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import stat
+import struct
+import sys
+import time
+from itertools import count
+
+from comparison import ComparisonResult, cleanup_sides, compare_entries, unprimed_paths
+from execution import delete_files, move_files
+from scanner import FileEntry, scan_entries
+
+# Seconds between walks of the folders when inotify is not available.
+POLL_INTERVAL = 5.0
+
+# While files keep changing, the plan is updated at most this often.
+UPDATE_INTERVAL = 1.0
+
+# Default seconds without changes before plans are carried out.
+QUIET_PERIOD = 60.0
+
+WATCH_ACTIONS = ("delete", "move-mismatch", "move-new")
+
+# Longest a wait for changes blocks, so a stop request is seen quickly.
+_WAIT_STEP = 0.5
+
+_IN_MODIFY = 0x2
+_IN_ATTRIB = 0x4
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_FROM = 0x40
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_Q_OVERFLOW = 0x4000
+_IN_IGNORED = 0x8000
+_IN_ONLYDIR = 0x1000000
+_IN_ISDIR = 0x40000000
+_IN_MASK = (
+    _IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO
+    | _IN_CREATE | _IN_DELETE | _IN_ONLYDIR
+)
+_EVENT = struct.Struct("iIII")
+
+
+class _InotifyWatcher:
+    """Changed paths below several roots, from Linux inotify.
+
+    ``report(message)`` is told about folders that cannot be watched.
+    """
+
+    def __init__(self, roots, report=print):
+        self._report = report
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._roots = roots
+        self._folders = {}
+        try:
+            for side, root in roots.items():
+                self._watch_tree(side, root, "")
+        except OSError:
+            self.close()
+            raise
+
+    def _watch_tree(self, side, folder, rel_folder):
+        for current, subfolders, _ in os.walk(folder):
+            rel_current = os.path.relpath(current, folder)
+            if rel_current == ".":
+                rel_current = rel_folder
+            elif rel_folder:
+                rel_current = os.path.join(rel_folder, rel_current)
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(current), _IN_MASK)
+            if wd < 0:
+                error = ctypes.get_errno()
+                raise OSError(error, f"Cannot watch {current}: {os.strerror(error)}")
+            self._folders[wd] = (side, rel_current)
+
+    def _unwatch_tree(self, side, rel_folder):
+        """Stop watching a folder that was moved away, and everything below it."""
+        prefix = rel_folder + os.sep
+        for wd, (watched_side, watched) in list(self._folders.items()):
+            if watched_side == side and (watched == rel_folder or watched.startswith(prefix)):
+                self._libc.inotify_rm_watch(self._fd, wd)
+                del self._folders[wd]
+
+    def wait(self, timeout):
+        """``{side: {rel_path, ...}}`` changed within ``timeout`` seconds.
+
+        A rel_path may name a folder, or be "" for a whole side after the
+        kernel's event queue overflowed.
+        """
+        changes = {}
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return changes
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return changes
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            name = data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b"\0")
+            offset += _EVENT.size + length
+            if mask & _IN_Q_OVERFLOW:
+                for side in self._roots:
+                    changes.setdefault(side, set()).add("")
+                continue
+            if mask & _IN_IGNORED:
+                self._folders.pop(wd, None)
+                continue
+            if wd not in self._folders:
+                continue
+            side, rel_folder = self._folders[wd]
+            rel_path = os.path.join(rel_folder, os.fsdecode(name)) if rel_folder else os.fsdecode(name)
+            changes.setdefault(side, set()).add(rel_path)
+            if mask & _IN_ISDIR and mask & _IN_MOVED_FROM:
+                self._unwatch_tree(side, rel_path)
+            if mask & _IN_ISDIR and mask & (_IN_CREATE | _IN_MOVED_TO):
+                try:
+                    self._watch_tree(side, os.path.join(self._roots[side], rel_path), rel_path)
+                except OSError as exc:
+                    self._report(str(exc))
+        return changes
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class _PollingWatcher:
+    """Changed paths below several roots, found by walking them periodically."""
+
+    def __init__(self, roots, interval=POLL_INTERVAL):
+        self._roots = roots
+        self._interval = interval
+        self._snapshots = {side: self._scan(root) for side, root in roots.items()}
+        self._next_poll = time.monotonic() + interval
+
+    def _scan(self, root):
+        return {entry.rel_path: entry.stat_key for entry in scan_entries(root)}
+
+    def wait(self, timeout):
+        delay = self._next_poll - time.monotonic()
+        if delay > timeout:
+            time.sleep(timeout)
+            return {}
+        time.sleep(max(0.0, delay))
+        self._next_poll = time.monotonic() + self._interval
+        changes = {}
+        for side, root in self._roots.items():
+            old = self._snapshots[side]
+            new = self._snapshots[side] = self._scan(root)
+            changed = {rel_path for rel_path, stat_key in new.items() if old.get(rel_path) != stat_key}
+            changed.update(rel_path for rel_path in old if rel_path not in new)
+            if changed:
+                changes[side] = changed
+        return changes
+
+    def close(self):
+        pass
+
+
+def _make_watcher(roots, poll_interval, use_inotify=True, report=print):
+    if use_inotify and sys.platform.startswith("linux"):
+        try:
+            return _InotifyWatcher(roots, report)
+        except (OSError, AttributeError) as exc:
+            report(f"inotify unavailable, polling every {poll_interval:g}s instead: {exc}")
+    return _PollingWatcher(roots, poll_interval)
+
+
+def _shown_path(labels, side, rel_path):
+    label = labels.get(side)
+    return os.path.join(label, rel_path) if label else rel_path
+
+
+def _merge(old, update, replaced):
+    """``old`` with the files of ``replaced`` taken from ``update`` instead.
+
+    ``replaced`` is ``{(side, rel_path), ...}``, the keys ``old`` had in the
+    size groups that ``update`` compared again. Nothing is changed in place,
+    as ``old`` may still be shown.
+    """
+    result = ComparisonResult()
+    result.labels = old.labels
+    result.roots = old.roots
+    result.bytes_read = update.bytes_read
+    result.bytes_cached = update.bytes_cached
+    result.files = {side: dict(files) for side, files in old.files.items()}
+    gone = set()
+    for side, rel_path in replaced:
+        full_path = result.files[side].pop(rel_path, None)
+        if full_path is not None:
+            gone.add(full_path)
+    for side, files in update.files.items():
+        result.files.setdefault(side, {}).update(files)
+
+    result.rows = {key: row for key, row in old.rows.items() if key not in replaced}
+    result.rows.update(update.rows)
+
+    result.stats = dict(old.stats)
+    result.samples = dict(old.samples)
+    result.digests = dict(old.digests)
+    result.fingerprints = dict(old.fingerprints)
+    for full_path in gone | set(update.stats):
+        if full_path in update.stats:
+            result.stats[full_path] = update.stats[full_path]
+        else:
+            result.stats.pop(full_path, None)
+        for known, merged in (
+            (update.samples, result.samples),
+            (update.digests, result.digests),
+            (update.fingerprints, result.fingerprints),
+        ):
+            if full_path in known:
+                merged[full_path] = known[full_path]
+            else:
+                merged.pop(full_path, None)
+
+    result.delete_plan = [path for path in old.delete_plan if path not in gone] + update.delete_plan
+    result.duplicates = {path: match for path, match in old.duplicates.items() if path not in gone}
+    result.duplicates.update(update.duplicates)
+    for name in ("link_plan", "move_mismatch_plan", "move_new_plan"):
+        kept = [pair for pair in getattr(old, name) if pair[0] not in gone]
+        setattr(result, name, kept + getattr(update, name))
+
+    result.file_hashes = dict(old.file_hashes)
+    result.preserve_path_to_hash = dict(old.preserve_path_to_hash)
+    result.preserve_hashes = dict(old.preserve_hashes)
+    for side, rel_path in replaced:
+        result.file_hashes.pop(_shown_path(old.labels, side, rel_path), None)
+        if side == "preserve":
+            digest = result.preserve_path_to_hash.pop(rel_path, None)
+            if digest:
+                others = [other for other in result.preserve_hashes.get(digest, ()) if other != rel_path]
+                if others:
+                    result.preserve_hashes[digest] = others
+                else:
+                    result.preserve_hashes.pop(digest, None)
+    result.file_hashes.update(update.file_hashes)
+    result.preserve_path_to_hash.update(update.preserve_path_to_hash)
+    for digest, rel_paths in update.preserve_hashes.items():
+        result.preserve_hashes[digest] = result.preserve_hashes.get(digest, []) + rel_paths
+    return result
+
+
+class Watch:
+    """A comparison kept current as files change; see the module docstring.
+
+    ``result`` is the last ComparisonResult. ``actions`` is a subset of
+    WATCH_ACTIONS to carry out after ``quiet`` seconds without changes.
+    """
+
+    def __init__(
+        self,
+        preserve_folder,
+        cleanup_folders,
+        workers=None,
+        prefilter=False,
+        actions=(),
+        quiet=QUIET_PERIOD,
+        poll_interval=POLL_INTERVAL,
+        use_inotify=True,
+    ):
+        self.preserve_folder = preserve_folder
+        self.labels = cleanup_sides(cleanup_folders)
+        self.roots = {"preserve": preserve_folder, **dict(zip(self.labels, cleanup_folders))}
+        self.workers = workers
+        self.prefilter = prefilter
+        self.actions = set(actions)
+        self.quiet = quiet
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+        self.entries = {}
+        self.result = None
+        # Scan position of every (side, rel_path), so a partial comparison
+        # sees files in the order a full one would.
+        self._order = {}
+        self._counter = count()
+        # Size of every (side, rel_path) compared, and the keys by size.
+        self._sizes = {}
+        self._by_size = {}
+
+    def _scan(self):
+        self.entries = {side: {} for side in self.roots}
+        for side, root in self.roots.items():
+            for entry in scan_entries(root):
+                self._add(side, entry)
+
+    def _add(self, side, entry):
+        known = self.entries[side]
+        if entry.rel_path not in known:
+            self._order[(side, entry.rel_path)] = next(self._counter)
+        known[entry.rel_path] = entry
+
+    def _remove(self, side, rel_path):
+        self._order.pop((side, rel_path), None)
+        return self.entries[side].pop(rel_path, None) is not None
+
+    def _refresh(self, side, rel_path):
+        """Stat ``rel_path`` again; a folder, or a path that is gone, is redone as a whole.
+
+        Returns the relative paths of the files that were added, changed or
+        removed.
+        """
+        known = self.entries[side]
+        root = self.roots[side]
+        full_path = os.path.join(root, rel_path) if rel_path else root
+        try:
+            stat_result = os.stat(full_path)
+        except OSError:
+            stat_result = None
+        if stat_result is not None and stat.S_ISREG(stat_result.st_mode):
+            self._add(side, FileEntry(rel_path, full_path, stat_result))
+            return {rel_path}
+        touched = set()
+        if self._remove(side, rel_path):
+            touched.add(rel_path)
+        prefix = rel_path + os.sep if rel_path else ""
+        for below in [other for other in known if other.startswith(prefix)]:
+            self._remove(side, below)
+            touched.add(below)
+        if stat_result is not None and stat.S_ISDIR(stat_result.st_mode) and not (rel_path and os.path.islink(full_path)):
+            for entry in scan_entries(full_path):
+                below = os.path.join(rel_path, entry.rel_path) if rel_path else entry.rel_path
+                entry.rel_path = below
+                self._add(side, entry)
+                touched.add(below)
+        return touched
+
+    def _index(self, key, size):
+        self._sizes[key] = size
+        self._by_size.setdefault(size, set()).add(key)
+
+    def _unindex(self, key):
+        size = self._sizes.pop(key, None)
+        if size is not None:
+            same_size = self._by_size[size]
+            same_size.discard(key)
+            if not same_size:
+                del self._by_size[size]
+
+    def _compare(self, entries, progress, preserve_paths=None, cleanup_paths=None):
+        return compare_entries(
+            self.preserve_folder,
+            entries,
+            workers=self.workers,
+            progress=progress,
+            previous=self.result,
+            labels=self.labels,
+            prefilter=self.prefilter,
+            preserve_paths=preserve_paths,
+            roots=self.roots,
+            cleanup_paths=cleanup_paths,
+        )
+
+    def _update(self, progress, touched=None):
+        """Compare again; returns ``(result, changes)``.
+
+        Without ``touched``, every file is compared and ``changes`` is None.
+        Otherwise only the size groups of the files in ``touched``
+        (``{side: {rel_path, ...}}``, as returned by _refresh) are: no other
+        file can change its decision. Cleanup files at a touched path, or
+        whose primed move target it is, are included, as they may turn from
+        new into a mismatch or back, or get another target.
+        ``changes`` then maps the key of every row that may have changed to
+        its new ``(path, digest, action)``, or None if it is gone.
+        """
+        if touched is None or self.result is None:
+            self.result = self._compare({side: list(known.values()) for side, known in self.entries.items()}, progress)
+            self._sizes = {}
+            self._by_size = {}
+            for side, known in self.entries.items():
+                for rel_path, entry in known.items():
+                    self._index((side, rel_path), entry.size)
+            return self.result, None
+
+        sizes = set()
+        for side, rel_paths in touched.items():
+            for rel_path in rel_paths:
+                if (side, rel_path) in self._sizes:
+                    sizes.add(self._sizes[(side, rel_path)])
+                paths = unprimed_paths(rel_path) if side == "preserve" else [rel_path]
+                for other in {side, *self.labels}:
+                    for path in paths:
+                        entry = self.entries[other].get(path)
+                        if entry is not None:
+                            sizes.add(entry.size)
+        replaced = set().union(*(self._by_size.get(size, ()) for size in sizes))
+        for side, rel_paths in touched.items():
+            for rel_path in rel_paths:
+                self._unindex((side, rel_path))
+                entry = self.entries[side].get(rel_path)
+                if entry is not None:
+                    self._index((side, rel_path), entry.size)
+        compared = set().union(*(self._by_size.get(size, ()) for size in sizes))
+
+        subset = {side: [] for side in self.roots}
+        for side, rel_path in sorted(compared, key=self._order.__getitem__):
+            subset[side].append(self.entries[side][rel_path])
+        update = self._compare(
+            subset,
+            progress,
+            preserve_paths=self.entries["preserve"],
+            cleanup_paths={side: self.entries[side] for side in self.labels},
+        )
+        self.result = _merge(self.result, update, replaced)
+        changes = dict.fromkeys(replaced | compared)
+        changes.update(update.rows)
+        return self.result, changes
+
+    def _unchanged(self, path):
+        try:
+            stat_result = os.stat(path)
+        except OSError:
+            return False
+        return self.result.stats.get(path) == (stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino)
+
+    def execute(self, on_executed=None, progress=None):
+        """Carry out the plans in ``actions``; files changed since they were compared are skipped.
+
+        ``progress`` is passed on to execution, so it can cancel like for a
+        plan carried out by hand; the remaining plans are then left alone.
+        """
+        result = self.result
+        for action in WATCH_ACTIONS:
+            if action not in self.actions:
+                continue
+            if action == "delete":
+                plan = [path for path in result.delete_plan if self._unchanged(path)]
+                if plan:
+                    done, failed, cancelled = delete_files(plan, progress)
+            else:
+                plan = result.move_mismatch_plan if action == "move-mismatch" else result.move_new_plan
+                plan = [(src, dst) for src, dst in plan if self._unchanged(src)]
+                if plan:
+                    done, failed, cancelled = move_files(plan, action, progress)
+                    for src, dst in done:
+                        result.carry_over(src, dst)
+            if plan and on_executed:
+                on_executed(action, done, failed)
+            if plan and cancelled:
+                return
+
+    def run(self, on_update=None, progress=None, check=None, on_executed=None, on_message=print):
+        """Compare, then keep the result current until ``check()`` raises.
+
+        ``on_update(result, changes)`` is called after every comparison,
+        with the ``changes`` to its rows as returned by _update, and
+        ``on_executed(action, done, failed)`` after each plan carried out;
+        ``progress`` is passed on to the comparisons and executions.
+        ``on_message(text)`` is told about folders that cannot be watched.
+        """
+        # Watch before the first walk so nothing arriving during it is missed.
+        watcher = _make_watcher(self.roots, self.poll_interval, self.use_inotify, on_message)
+        try:
+            self._scan()
+            result, changes = self._update(progress)
+            if on_update:
+                on_update(result, changes)
+            dirty = {}
+            last_change = last_update = time.monotonic()
+            planned = True
+            while True:
+                if check:
+                    check()
+                changes = watcher.wait(_WAIT_STEP)
+                now = time.monotonic()
+                if changes:
+                    last_change = now
+                    for side, rel_paths in changes.items():
+                        dirty.setdefault(side, set()).update(rel_paths)
+                if dirty and now - last_update >= UPDATE_INTERVAL:
+                    touched = {}
+                    for side, rel_paths in dirty.items():
+                        # Shorter paths first: a folder's walk covers its files.
+                        for rel_path in sorted(rel_paths, key=len):
+                            touched.setdefault(side, set()).update(self._refresh(side, rel_path))
+                    dirty = {}
+                    last_update = now
+                    planned = True
+                    result, changes = self._update(progress, touched)
+                    if on_update:
+                        on_update(result, changes)
+                if self.actions and planned and not dirty and now - last_change >= self.quiet:
+                    planned = False
+                    self.execute(on_executed, progress)
+        finally:
+            watcher.close()
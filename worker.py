@@ -0,0 +1,129 @@
+"""Run long operations off the Tk thread.
+
+A work function receives its BackgroundTask and calls ``task.report(...)``
+to publish progress. The same call blocks while the task is paused and
+raises TaskCancelled once it has been cancelled. Progress, the result and
+any error are handed back to the Tk thread through a queue drained with
+``root.after``; the callbacks always run on the Tk thread, as do functions
+handed to ``task.post``.
+"""
+
+import queue
+import threading
+import time
+
+POLL_INTERVAL_MS = 50
+
+# Minimum seconds between progress messages: at most 10 updates per second.
+PROGRESS_INTERVAL = 0.1
+
+
+class TaskCancelled(Exception):
+    """Raised inside a work function once its task has been cancelled."""
+
+
+class BackgroundTask:
+    """A work function running on its own thread, reporting to the Tk thread."""
+
+    def __init__(self, root, work, on_done, on_progress=None, on_error=None, on_cancel=None):
+        self.root = root
+        self._work = work
+        self._on_done = on_done
+        self._on_progress = on_progress
+        self._on_error = on_error
+        self._on_cancel = on_cancel
+        self._messages = queue.Queue()
+        self._cancelled = threading.Event()
+        self._running = threading.Event()
+        self._running.set()
+        self._last_report = 0.0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @property
+    def paused(self):
+        return not self._running.is_set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def start(self):
+        self._thread.start()
+        self.root.after(POLL_INTERVAL_MS, self._poll)
+        return self
+
+    def pause(self):
+        self._running.clear()
+
+    def resume(self):
+        self._running.set()
+
+    def cancel(self):
+        self._cancelled.set()
+        self._running.set()
+
+    def check(self):
+        """Block while paused and raise TaskCancelled if cancelled."""
+        self._running.wait()
+        if self._cancelled.is_set():
+            raise TaskCancelled()
+
+    def report(self, stage, done, total=0):
+        """Publish progress (throttled) from the worker thread.
+
+        ``total`` of 0 means the total is not known yet.
+        """
+        self.check()
+        now = time.monotonic()
+        if (total and done >= total) or now - self._last_report >= PROGRESS_INTERVAL:
+            self._last_report = now
+            self._messages.put(("progress", (stage, done, total)))
+
+    def post(self, callback, *args):
+        """Call ``callback(*args)`` on the Tk thread, in order with other posts."""
+        self._messages.put(("call", (callback, args)))
+
+    def _run(self):
+        try:
+            result = self._work(self)
+        except TaskCancelled:
+            self._messages.put(("cancelled", None))
+        except Exception as exc:
+            self._messages.put(("error", exc))
+        else:
+            self._messages.put(("done", result))
+
+    def _poll(self):
+        """Drain the queue on the Tk thread, showing only the latest progress."""
+        progress = None
+        finished = None
+        while finished is None:
+            try:
+                kind, payload = self._messages.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "progress":
+                progress = payload
+            elif kind == "call":
+                callback, args = payload
+                callback(*args)
+            else:
+                finished = kind, payload
+
+        if progress is not None and self._on_progress:
+            self._on_progress(*progress)
+
+        if finished is None:
+            self.root.after(POLL_INTERVAL_MS, self._poll)
+            return
+
+        kind, payload = finished
+        if kind == "done":
+            self._on_done(payload)
+        elif kind == "error":
+            if self._on_error:
+                self._on_error(payload)
+            else:
+                print(f"Background task failed: {payload}")
+        elif self._on_cancel:
+            self._on_cancel()